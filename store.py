@@ -0,0 +1,4084 @@
+# The store's data layer, reports, import/export, archiving, backups and
+# the JSON HTTP API, with no Tk code, so the server, the command line and the
+# report worker processes run on hosts without a display. test3.py is the
+# Tk GUI on top of it.
+import argparse
+import asyncio
+import csv
+import gzip
+import json
+import multiprocessing
+import os
+import queue
+import random
+import re
+import shutil
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from collections import OrderedDict, deque
+from contextlib import closing, contextmanager, nullcontext
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from itertools import accumulate, islice
+from urllib.parse import parse_qs, quote, urlsplit
+
+STORAGE_PROFILE = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -32000,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+
+def apply_storage_profile(conn, profile=None):
+    profile = STORAGE_PROFILE if profile is None else profile
+    for pragma, value in profile.items():
+        conn.execute(f"PRAGMA {pragma} = {value};")
+
+SEARCH_INDEXES = {
+    "customers_fts": ("customers", "customer_id", ("name", "phone", "address")),
+    "products_fts": ("products", "product_id", ("name",)),
+}
+
+def fts5_trigram_available(conn):
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x, tokenize='trigram')")
+        conn.execute("DROP TABLE temp.fts5_probe")
+        return True
+    except sqlite3.Error:
+        return False
+
+def create_search_indexes(conn):
+    # Without FTS5 trigram support the searches fall back to LIKE scans.
+    if not fts5_trigram_available(conn):
+        return
+
+    for fts_table, (table, key, columns) in SEARCH_INDEXES.items():
+        column_list = ", ".join(columns)
+        new_values = ", ".join(f"new.{c}" for c in columns)
+        old_values = ", ".join(f"old.{c}" for c in columns)
+        conn.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(
+                {column_list}, content='{table}', content_rowid='{key}', tokenize='trigram'
+            )""")
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts_table} (rowid, {column_list}) VALUES (new.{key}, {new_values});
+            END""")
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', old.{key}, {old_values});
+            END""")
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE ON {table} BEGIN
+                INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', old.{key}, {old_values});
+                INSERT INTO {fts_table} (rowid, {column_list}) VALUES (new.{key}, {new_values});
+            END""")
+        conn.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')")
+
+SALES_SUMMARY_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS product_sales (
+        product_id INTEGER NOT NULL,
+        product_name TEXT NOT NULL,
+        total_quantity INTEGER NOT NULL DEFAULT 0,
+        total_revenue INTEGER NOT NULL DEFAULT 0,
+        line_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (product_id, product_name)
+    ) WITHOUT ROWID""",
+    """
+    CREATE TABLE IF NOT EXISTS customer_sales (
+        customer_id INTEGER PRIMARY KEY,
+        total_spent INTEGER NOT NULL DEFAULT 0,
+        invoice_count INTEGER NOT NULL DEFAULT 0,
+        total_items INTEGER NOT NULL DEFAULT 0
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS daily_product_sales (
+        sale_date TEXT NOT NULL,
+        product_name TEXT NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        line_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (sale_date, product_name)
+    ) WITHOUT ROWID""",
+    """
+    CREATE TRIGGER IF NOT EXISTS sales_invoices_ai AFTER INSERT ON invoices BEGIN
+        INSERT INTO customer_sales (customer_id, total_spent, invoice_count)
+        VALUES (new.customer_id, new.total_amount, 1)
+        ON CONFLICT (customer_id) DO UPDATE SET
+            total_spent = total_spent + excluded.total_spent,
+            invoice_count = invoice_count + 1;
+    END""",
+    # Runs before the ON DELETE CASCADE removes the items, while the invoice
+    # and its lines can still be read; the item trigger below skips cascades.
+    """
+    CREATE TRIGGER IF NOT EXISTS sales_invoices_bd BEFORE DELETE ON invoices BEGIN
+        UPDATE product_sales SET
+            total_quantity = total_quantity - removed.sold_quantity,
+            total_revenue = total_revenue - removed.sold_revenue,
+            line_count = line_count - removed.sold_lines
+        FROM (
+            SELECT product_id, product_name, SUM(quantity) AS sold_quantity, SUM(subtotal) AS sold_revenue, COUNT(*) AS sold_lines
+            FROM invoice_items WHERE invoice_id = old.invoice_id
+            GROUP BY product_id, product_name
+        ) AS removed
+        WHERE product_sales.product_id = removed.product_id AND product_sales.product_name = removed.product_name;
+        DELETE FROM product_sales WHERE line_count <= 0;
+
+        UPDATE daily_product_sales SET
+            quantity = quantity - removed.sold_quantity,
+            line_count = line_count - removed.sold_lines
+        FROM (
+            SELECT product_name, SUM(quantity) AS sold_quantity, COUNT(*) AS sold_lines
+            FROM invoice_items WHERE invoice_id = old.invoice_id
+            GROUP BY product_name
+        ) AS removed
+        WHERE daily_product_sales.sale_date = substr(old.date, 1, 10)
+          AND daily_product_sales.product_name = removed.product_name;
+        DELETE FROM daily_product_sales WHERE sale_date = substr(old.date, 1, 10) AND line_count <= 0;
+
+        UPDATE customer_sales SET
+            total_spent = total_spent - old.total_amount,
+            invoice_count = invoice_count - 1,
+            total_items = total_items - (SELECT COALESCE(SUM(quantity), 0) FROM invoice_items WHERE invoice_id = old.invoice_id)
+        WHERE customer_id = old.customer_id;
+        DELETE FROM customer_sales WHERE customer_id = old.customer_id AND invoice_count <= 0;
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS sales_invoices_au AFTER UPDATE OF customer_id, total_amount ON invoices BEGIN
+        UPDATE customer_sales SET
+            total_spent = total_spent - old.total_amount,
+            invoice_count = invoice_count - 1,
+            total_items = total_items - (SELECT COALESCE(SUM(quantity), 0) FROM invoice_items WHERE invoice_id = old.invoice_id)
+        WHERE customer_id = old.customer_id;
+        INSERT INTO customer_sales (customer_id, total_spent, invoice_count, total_items)
+        VALUES (new.customer_id, new.total_amount, 1,
+                (SELECT COALESCE(SUM(quantity), 0) FROM invoice_items WHERE invoice_id = new.invoice_id))
+        ON CONFLICT (customer_id) DO UPDATE SET
+            total_spent = total_spent + excluded.total_spent,
+            invoice_count = invoice_count + 1,
+            total_items = total_items + excluded.total_items;
+        DELETE FROM customer_sales WHERE customer_id = old.customer_id AND invoice_count <= 0;
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS sales_items_ai AFTER INSERT ON invoice_items BEGIN
+        INSERT INTO product_sales (product_id, product_name, total_quantity, total_revenue, line_count)
+        VALUES (new.product_id, new.product_name, new.quantity, new.subtotal, 1)
+        ON CONFLICT (product_id, product_name) DO UPDATE SET
+            total_quantity = total_quantity + excluded.total_quantity,
+            total_revenue = total_revenue + excluded.total_revenue,
+            line_count = line_count + 1;
+
+        INSERT INTO daily_product_sales (sale_date, product_name, quantity, line_count)
+        SELECT substr(date, 1, 10), new.product_name, new.quantity, 1
+        FROM invoices WHERE invoice_id = new.invoice_id
+        ON CONFLICT (sale_date, product_name) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            line_count = line_count + 1;
+
+        UPDATE customer_sales SET total_items = total_items + new.quantity
+        WHERE customer_id = (SELECT customer_id FROM invoices WHERE invoice_id = new.invoice_id);
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS sales_items_ad AFTER DELETE ON invoice_items
+    WHEN EXISTS (SELECT 1 FROM invoices WHERE invoice_id = old.invoice_id) BEGIN
+        UPDATE product_sales SET
+            total_quantity = total_quantity - old.quantity,
+            total_revenue = total_revenue - old.subtotal,
+            line_count = line_count - 1
+        WHERE product_id = old.product_id AND product_name = old.product_name;
+        DELETE FROM product_sales
+        WHERE product_id = old.product_id AND product_name = old.product_name AND line_count <= 0;
+
+        UPDATE daily_product_sales SET
+            quantity = quantity - old.quantity,
+            line_count = line_count - 1
+        WHERE sale_date = (SELECT substr(date, 1, 10) FROM invoices WHERE invoice_id = old.invoice_id)
+          AND product_name = old.product_name;
+        DELETE FROM daily_product_sales
+        WHERE sale_date = (SELECT substr(date, 1, 10) FROM invoices WHERE invoice_id = old.invoice_id)
+          AND product_name = old.product_name AND line_count <= 0;
+
+        UPDATE customer_sales SET total_items = total_items - old.quantity
+        WHERE customer_id = (SELECT customer_id FROM invoices WHERE invoice_id = old.invoice_id);
+    END""",
+]
+
+DATA_VERSION_TABLES = ("customers", "products", "invoices", "invoice_items")
+
+def create_data_version_log(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )""")
+    conn.execute("INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)")
+    for table in DATA_VERSION_TABLES:
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS data_version_{table}_{event.lower()} AFTER {event} ON {table} BEGIN
+                    UPDATE data_version SET version = version + 1 WHERE id = 1;
+                END""")
+
+CATALOG_TABLES = ("customers", "products")
+
+def create_table_versions(conn):
+    # Per-table counterpart of data_version, so the catalog cache reloads
+    # customers only when customers change.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS table_versions (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID""")
+    for table in CATALOG_TABLES:
+        conn.execute("INSERT OR IGNORE INTO table_versions (table_name, version) VALUES (?, 0)", (table,))
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS table_version_{table}_{event.lower()} AFTER {event} ON {table} BEGIN
+                    UPDATE table_versions SET version = version + 1 WHERE table_name = '{table}';
+                END""")
+
+SUMMARY_TABLES = ("product_sales", "customer_sales", "daily_product_sales")
+
+SALES_SUMMARY_BACKFILL = [
+    "DELETE FROM product_sales",
+    "DELETE FROM customer_sales",
+    "DELETE FROM daily_product_sales",
+    """
+    INSERT INTO product_sales (product_id, product_name, total_quantity, total_revenue, line_count)
+    SELECT product_id, product_name, SUM(quantity), SUM(subtotal), COUNT(*)
+    FROM invoice_items
+    GROUP BY product_id, product_name""",
+    """
+    INSERT INTO customer_sales (customer_id, total_spent, invoice_count, total_items)
+    SELECT i.customer_id, SUM(i.total_amount), COUNT(*),
+           COALESCE(SUM((SELECT SUM(quantity) FROM invoice_items ii WHERE ii.invoice_id = i.invoice_id)), 0)
+    FROM invoices i
+    GROUP BY i.customer_id""",
+    """
+    INSERT INTO daily_product_sales (sale_date, product_name, quantity, line_count)
+    SELECT substr(i.date, 1, 10), ii.product_name, SUM(ii.quantity), COUNT(*)
+    FROM invoice_items ii
+    JOIN invoices i ON ii.invoice_id = i.invoice_id
+    GROUP BY substr(i.date, 1, 10), ii.product_name""",
+]
+
+IMPORT_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS import_jobs (
+        job_id INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        source TEXT NOT NULL,
+        source_size INTEGER NOT NULL,
+        rows_done INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'running',
+        started TEXT NOT NULL,
+        finished TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_import_jobs_source ON import_jobs (kind, source, source_size, status)",
+    """
+    CREATE TABLE IF NOT EXISTS import_deferred (
+        name TEXT PRIMARY KEY,
+        type TEXT NOT NULL,
+        tbl_name TEXT NOT NULL,
+        sql TEXT NOT NULL
+    )""",
+]
+
+# Closed years of invoices can be moved to one SQLite file per year (see
+# InvoiceArchiver). archive_partitions lists them; rows copied under a batch
+# newer than the registered one are not visible yet. The archived_* tables
+# keep what the moved rows contributed to the sales summaries, so a summary
+# rebuild still covers the archived years.
+ARCHIVE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS archive_partitions (
+        year INTEGER PRIMARY KEY,
+        path TEXT NOT NULL,
+        first_day INTEGER NOT NULL,
+        last_day INTEGER NOT NULL,
+        batch INTEGER NOT NULL DEFAULT 0,
+        invoices INTEGER NOT NULL DEFAULT 0,
+        lines INTEGER NOT NULL DEFAULT 0,
+        archived TEXT
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS archived_product_sales (
+        product_id INTEGER NOT NULL,
+        product_name TEXT NOT NULL,
+        total_quantity INTEGER NOT NULL DEFAULT 0,
+        total_revenue INTEGER NOT NULL DEFAULT 0,
+        line_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (product_id, product_name)
+    ) WITHOUT ROWID""",
+    """
+    CREATE TABLE IF NOT EXISTS archived_customer_sales (
+        customer_id INTEGER PRIMARY KEY,
+        total_spent INTEGER NOT NULL DEFAULT 0,
+        invoice_count INTEGER NOT NULL DEFAULT 0,
+        total_items INTEGER NOT NULL DEFAULT 0
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS archived_daily_product_sales (
+        sale_date TEXT NOT NULL,
+        product_name TEXT NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        line_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (sale_date, product_name)
+    ) WITHOUT ROWID""",
+    # Archived invoices cannot hold a foreign key into this file.
+    """
+    CREATE TRIGGER IF NOT EXISTS archived_customers_bd BEFORE DELETE ON customers
+    WHEN EXISTS (SELECT 1 FROM archived_customer_sales WHERE customer_id = old.customer_id) BEGIN
+        SELECT RAISE(ABORT, 'customer has archived invoices');
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS archived_products_bd BEFORE DELETE ON products
+    WHEN EXISTS (SELECT 1 FROM archived_product_sales WHERE product_id = old.product_id) BEGIN
+        SELECT RAISE(ABORT, 'product has archived invoices');
+    END""",
+]
+
+ARCHIVED_SALES_MERGE = [
+    """
+    INSERT INTO product_sales (product_id, product_name, total_quantity, total_revenue, line_count)
+    SELECT product_id, product_name, total_quantity, total_revenue, line_count FROM archived_product_sales WHERE true
+    ON CONFLICT (product_id, product_name) DO UPDATE SET
+        total_quantity = total_quantity + excluded.total_quantity,
+        total_revenue = total_revenue + excluded.total_revenue,
+        line_count = line_count + excluded.line_count""",
+    """
+    INSERT INTO customer_sales (customer_id, total_spent, invoice_count, total_items)
+    SELECT customer_id, total_spent, invoice_count, total_items FROM archived_customer_sales WHERE true
+    ON CONFLICT (customer_id) DO UPDATE SET
+        total_spent = total_spent + excluded.total_spent,
+        invoice_count = invoice_count + excluded.invoice_count,
+        total_items = total_items + excluded.total_items""",
+    """
+    INSERT INTO daily_product_sales (sale_date, product_name, quantity, line_count)
+    SELECT sale_date, product_name, quantity, line_count FROM archived_daily_product_sales WHERE true
+    ON CONFLICT (sale_date, product_name) DO UPDATE SET
+        quantity = quantity + excluded.quantity,
+        line_count = line_count + excluded.line_count""",
+]
+
+def rebuild_sales_summaries(cursor):
+    for statement in SALES_SUMMARY_BACKFILL:
+        cursor.execute(statement)
+    if cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'archived_product_sales'").fetchone():
+        for statement in ARCHIVED_SALES_MERGE:
+            cursor.execute(statement)
+
+def defer_schema_objects(cursor, tables, triggers=True, keep=()):
+    # Drops the indexes of tables, and with triggers their triggers as well,
+    # keeping their definitions in import_deferred until
+    # restore_schema_objects puts them back. Without triggers the summaries,
+    # search indexes and versions stay current, so other connections can go
+    # on working while the objects are missing.
+    types = ("index", "trigger") if triggers else ("index",)
+    objects = cursor.execute(f"""
+        SELECT type, name, tbl_name, sql FROM sqlite_master
+        WHERE type IN ({", ".join("?" for _ in types)}) AND sql IS NOT NULL
+          AND tbl_name IN ({", ".join("?" for _ in tables)}) AND name NOT IN ({", ".join("?" for _ in keep)})
+    """, tuple(types) + tuple(tables) + tuple(keep)).fetchall()
+    for object_type, name, table, sql in objects:
+        cursor.execute("INSERT OR IGNORE INTO import_deferred (name, type, tbl_name, sql) VALUES (?, ?, ?, ?)",
+                       (name, object_type, table, sql))
+        cursor.execute(f'DROP {object_type.upper()} IF EXISTS "{name}"')
+
+def restore_schema_objects(cursor):
+    objects = cursor.execute(
+        "SELECT type, tbl_name, sql FROM import_deferred ORDER BY type = 'trigger'").fetchall()
+    if not objects:
+        return set()
+    for object_type, table, sql in objects:
+        cursor.execute(sql)
+    tables = {table for _, table, _ in objects}
+    # Only what the deferred triggers would have maintained needs catching up.
+    triggered = {table for object_type, table, _ in objects if object_type == "trigger"}
+    for fts_table, (table, key, columns) in SEARCH_INDEXES.items():
+        exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts_table,)).fetchone()
+        if table in triggered and exists:
+            cursor.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')")
+    if triggered & {"invoices", "invoice_items"}:
+        rebuild_sales_summaries(cursor)
+    cursor.execute("DELETE FROM import_deferred")
+    if triggered:
+        cursor.execute("UPDATE data_version SET version = version + 1 WHERE id = 1")
+        cursor.executemany("UPDATE table_versions SET version = version + 1 WHERE table_name = ?",
+                           [(table,) for table in triggered])
+    return tables
+
+# Money is stored as whole rials in INTEGER columns, so sums are exact. The
+# windows show and accept tomans; the HTTP API, the command line, imports
+# and exports all work in rials. Databases from before schema version 7 kept
+# tomans in REAL columns and are converted by migrate_money_to_rials.
+RIALS_PER_TOMAN = 10
+MONEY_COLUMNS = {
+    "products": ("price",),
+    "invoices": ("total_amount",),
+    "invoice_items": ("unit_price", "subtotal"),
+}
+MONEY_SUMMARY_COLUMNS = {
+    "product_sales": ("total_revenue",),
+    "customer_sales": ("total_spent",),
+}
+MONEY_BATCH_ROWS = 50000
+
+class MoneyMismatch(sqlite3.DatabaseError):
+    pass
+
+@contextmanager
+def _immediate(conn):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+def _column_types(conn, table):
+    return {row[1]: row[2].upper() for row in conn.execute(f"PRAGMA table_info({table})")}
+
+def _to_rials_sql(column):
+    return f"CAST(round({column} * {RIALS_PER_TOMAN}) AS INTEGER)"
+
+def _check_money(conn, table, columns):
+    # Catches up rows written by an older program after their batch was
+    # converted, then compares every column total before and after.
+    changed = " OR ".join(f"{c}_rials IS NOT {_to_rials_sql(c)}" for c in columns)
+    assignments = ", ".join(f"{c}_rials = {_to_rials_sql(c)}" for c in columns)
+    caught_up = conn.execute(f"UPDATE {table} SET {assignments} WHERE {changed}").rowcount
+    checks = []
+    for column in columns:
+        rows, old_total, new_total, worst = conn.execute(f"""
+            SELECT COUNT(*), TOTAL({column}) * {RIALS_PER_TOMAN}, COALESCE(SUM({column}_rials), 0),
+                   COALESCE(MAX(ABS({column}_rials - {column} * {RIALS_PER_TOMAN})), 0)
+            FROM {table}
+        """).fetchone()
+        # Each row may round by up to half a rial; TOTAL() adds float error.
+        allowed = 0.5 * rows + abs(old_total) * 1e-9
+        if worst > 0.5 + 1e-6 or abs(new_total - old_total) > allowed:
+            raise MoneyMismatch(f"{table}.{column}: {old_total:,.2f} rials before, {new_total:,} after")
+        checks.append({"stage": "verified", "table": table, "column": column, "rows": rows,
+                       "old_total": old_total, "new_total": new_total, "caught_up": caught_up})
+    return checks
+
+def migrate_money_to_rials(conn, target, progress=None, batch_rows=MONEY_BATCH_ROWS):
+    # Runs as many short transactions instead of one, so converting a large
+    # database can be interrupted and picked up again by the next start:
+    # the *_rials columns are added first, filled in rowid batches with the
+    # position kept in money_migration, and swapped in for the REAL columns
+    # only after their totals match the old ones.
+    with _immediate(conn):
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= target:
+            return
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'money_migration'").fetchone():
+            conn.execute("""
+                CREATE TABLE money_migration (
+                    table_name TEXT PRIMARY KEY,
+                    columns TEXT NOT NULL,
+                    last_rowid INTEGER NOT NULL DEFAULT 0
+                )""")
+            for table, columns in MONEY_COLUMNS.items():
+                types = _column_types(conn, table)
+                pending = [c for c in columns if types[c] != "INTEGER"]
+                for column in pending:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column}_rials INTEGER NOT NULL DEFAULT 0")
+                if pending:
+                    conn.execute("INSERT INTO money_migration (table_name, columns) VALUES (?, ?)",
+                                 (table, ",".join(pending)))
+
+    for table, columns in conn.execute("SELECT table_name, columns FROM money_migration").fetchall():
+        assignments = ", ".join(f"{c}_rials = {_to_rials_sql(c)}" for c in columns.split(","))
+        while True:
+            with _immediate(conn):
+                last = conn.execute("SELECT last_rowid FROM money_migration WHERE table_name = ?",
+                                    (table,)).fetchone()[0]
+                end = conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}").fetchone()[0]
+                if last >= end:
+                    break
+                upper = min(last + batch_rows, end)
+                conn.execute(f"UPDATE {table} SET {assignments} WHERE rowid > ? AND rowid <= ?", (last, upper))
+                conn.execute("UPDATE money_migration SET last_rowid = ? WHERE table_name = ?", (upper, table))
+            if progress is not None:
+                progress({"stage": "backfill", "table": table, "rowid": upper, "last_rowid": end})
+
+    with _immediate(conn):
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= target:
+            return
+        pending = {table: columns.split(",") for table, columns in
+                   conn.execute("SELECT table_name, columns FROM money_migration")}
+        summaries = {table: [c for c in columns if _column_types(conn, table)[c] != "INTEGER"]
+                     for table, columns in MONEY_SUMMARY_COLUMNS.items()}
+        summaries = {table: columns for table, columns in summaries.items() if columns}
+        checks = []
+        for table, columns in pending.items():
+            checks.extend(_check_money(conn, table, columns))
+        if pending or summaries:
+            # Columns used by an index or trigger cannot be dropped, so all
+            # of them go for the swap; restoring them also rebuilds the
+            # sales summaries from the converted lines.
+            defer_schema_objects(conn, list(MONEY_COLUMNS) + list(MONEY_SUMMARY_COLUMNS))
+            for table, columns in summaries.items():
+                for column in columns:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column}_rials INTEGER NOT NULL DEFAULT 0")
+            for table, columns in list(pending.items()) + list(summaries.items()):
+                for column in columns:
+                    conn.execute(f"ALTER TABLE {table} DROP COLUMN {column}")
+                    conn.execute(f"ALTER TABLE {table} RENAME COLUMN {column}_rials TO {column}")
+            restore_schema_objects(conn)
+        conn.execute("DROP TABLE money_migration")
+        conn.execute(f"PRAGMA user_version = {target}")
+    if progress is not None:
+        for check in checks:
+            progress(check)
+    if pending or summaries:
+        conn.execute("ANALYZE")
+
+# Invoice dates stay "%Y-%m-%d %H:%M:%S" text for display, paging and
+# exports. The generated day column (days since 1970-01-01) gives reports an
+# integer to range over, and the calendar tables map days to Gregorian and
+# Jalali months.
+EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+INVOICE_DAY_SQL = "CAST(julianday(substr(date, 1, 10)) - 2440587.5 AS INTEGER)"
+CALENDAR_FIRST_YEAR = 1990
+CALENDAR_LAST_YEAR = 2100
+
+def day_number(moment):
+    return moment.toordinal() - EPOCH_ORDINAL
+
+def gregorian_to_jalali(year, month, day):
+    month_starts = (0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334)
+    leap_year = year + 1 if month > 2 else year
+    days = (355666 + 365 * year + (leap_year + 3) // 4 - (leap_year + 99) // 100 + (leap_year + 399) // 400
+            + day + month_starts[month - 1])
+    jalali_year = -1595 + 33 * (days // 12053)
+    days %= 12053
+    jalali_year += 4 * (days // 1461)
+    days %= 1461
+    if days > 365:
+        jalali_year += (days - 1) // 365
+        days = (days - 1) % 365
+    if days < 186:
+        return jalali_year, 1 + days // 31, 1 + days % 31
+    return jalali_year, 7 + (days - 186) // 30, 1 + (days - 186) % 30
+
+def create_calendar(conn):
+    columns = {row[1] for row in conn.execute("PRAGMA table_xinfo(invoices)")}
+    if "day" not in columns:
+        conn.execute(f"ALTER TABLE invoices ADD COLUMN day INTEGER GENERATED ALWAYS AS ({INVOICE_DAY_SQL}) VIRTUAL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_day ON invoices (day, customer_id, total_amount)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS calendar (
+            day INTEGER PRIMARY KEY,
+            date TEXT NOT NULL UNIQUE,
+            month TEXT NOT NULL,
+            weekday INTEGER NOT NULL,
+            jalali_date TEXT NOT NULL,
+            jalali_month TEXT NOT NULL
+        )""")
+    # One row per Gregorian and per Jalali month; their YYYY-MM keys cannot
+    # collide since the years are six centuries apart.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS calendar_months (
+            month TEXT PRIMARY KEY,
+            calendar TEXT NOT NULL,
+            first_day INTEGER NOT NULL,
+            last_day INTEGER NOT NULL,
+            first_date TEXT NOT NULL,
+            last_date TEXT NOT NULL
+        ) WITHOUT ROWID""")
+    rows = []
+    first = datetime(CALENDAR_FIRST_YEAR, 1, 1).toordinal()
+    last = datetime(CALENDAR_LAST_YEAR, 12, 31).toordinal()
+    for ordinal in range(first, last + 1):
+        moment = datetime.fromordinal(ordinal)
+        jalali_year, jalali_month, jalali_day = gregorian_to_jalali(moment.year, moment.month, moment.day)
+        # weekday 0 is Saturday, the first day of the Persian week.
+        rows.append((ordinal - EPOCH_ORDINAL, moment.strftime("%Y-%m-%d"), moment.strftime("%Y-%m"),
+                     (moment.weekday() + 2) % 7, f"{jalali_year:04d}/{jalali_month:02d}/{jalali_day:02d}",
+                     f"{jalali_year:04d}-{jalali_month:02d}"))
+    conn.executemany("INSERT OR IGNORE INTO calendar (day, date, month, weekday, jalali_date, jalali_month) "
+                     "VALUES (?, ?, ?, ?, ?, ?)", rows)
+    conn.execute("""
+        INSERT OR REPLACE INTO calendar_months (month, calendar, first_day, last_day, first_date, last_date)
+        SELECT month, 'gregorian', MIN(day), MAX(day), MIN(date), MAX(date) FROM calendar GROUP BY month
+        UNION ALL
+        SELECT jalali_month, 'jalali', MIN(day), MAX(day), MIN(date), MAX(date) FROM calendar GROUP BY jalali_month""")
+
+SCHEMA_MIGRATIONS = [
+    (1, [
+        "CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices (date)",
+        "CREATE INDEX IF NOT EXISTS idx_invoices_customer_date ON invoices (customer_id, date, total_amount)",
+        "CREATE INDEX IF NOT EXISTS idx_invoices_total ON invoices (total_amount)",
+        "CREATE INDEX IF NOT EXISTS idx_invoice_items_invoice ON invoice_items (invoice_id)",
+        "CREATE INDEX IF NOT EXISTS idx_invoice_items_product ON invoice_items (product_id, quantity, subtotal)",
+        "CREATE INDEX IF NOT EXISTS idx_invoice_items_product_name ON invoice_items (product_name, quantity, subtotal, invoice_id)",
+        "CREATE INDEX IF NOT EXISTS idx_customers_name ON customers (name)",
+        "CREATE INDEX IF NOT EXISTS idx_products_stock ON products (stock)",
+        "ANALYZE",
+    ]),
+    (2, [
+        create_search_indexes,
+    ]),
+    (3, SALES_SUMMARY_SCHEMA + SALES_SUMMARY_BACKFILL + ["ANALYZE"]),
+    (4, [
+        create_data_version_log,
+    ]),
+    (5, IMPORT_SCHEMA),
+    (6, [
+        create_table_versions,
+    ]),
+    # A function instead of a list of steps runs its own transactions and
+    # sets user_version itself.
+    (7, migrate_money_to_rials),
+    (8, [
+        create_calendar,
+        "ANALYZE",
+    ]),
+    (9, ARCHIVE_SCHEMA),
+]
+
+def migrate(conn, progress=None):
+    version = conn.execute("PRAGMA user_version;").fetchone()[0]
+    for target, steps in SCHEMA_MIGRATIONS:
+        if target <= version:
+            continue
+        if callable(steps):
+            steps(conn, target, progress)
+            version = target
+            continue
+        conn.execute("BEGIN")
+        try:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {target};")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        version = target
+    return version
+
+def setup_database(db_file="store.db", profile=None, progress=None):
+    conn = sqlite3.connect(db_file)
+    conn.execute("PRAGMA foreign_keys = ON;")
+    apply_storage_profile(conn, profile)
+    cursor = conn.cursor()
+    
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS customers (
+        customer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        phone TEXT UNIQUE,
+        address TEXT
+    );""")
+    
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS products (
+        product_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        price INTEGER NOT NULL,
+        stock INTEGER NOT NULL DEFAULT 0
+    );""")
+    
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS invoices (
+        invoice_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        customer_id INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        total_amount INTEGER NOT NULL,
+        FOREIGN KEY (customer_id) REFERENCES customers (customer_id) ON DELETE RESTRICT
+    );""")
+    
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS invoice_items (
+        item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        invoice_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        product_name TEXT NOT NULL, 
+        unit_price INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        subtotal INTEGER NOT NULL,
+        FOREIGN KEY (invoice_id) REFERENCES invoices (invoice_id) ON DELETE CASCADE,
+        FOREIGN KEY (product_id) REFERENCES products (product_id) ON DELETE RESTRICT
+    );""")
+    
+    conn.commit()
+    migrate(conn, progress)
+    # An import that died left the indexes of its tables dropped.
+    if conn.execute("SELECT 1 FROM import_deferred LIMIT 1").fetchone():
+        with _immediate(conn):
+            restore_schema_objects(conn)
+    conn.close()
+
+
+class Report:
+    def __init__(self, number, title, columns, sql, params=(), indexes=(), money=(), partitioned=False, partial=None):
+        self.number = number
+        self.title = title
+        self.columns = columns
+        self.sql = sql
+        self.params = params
+        self.indexes = indexes
+        # Positions of the columns holding rials.
+        self.money = money
+        # Reads invoices or invoice_items rather than the sales summaries,
+        # so archived years have to be attached for it.
+        self.partitioned = partitioned
+        # How to recompute it from invoice shards in worker processes.
+        self.partial = partial
+
+    @property
+    def label(self):
+        return f"{self.number}. {self.title}"
+
+    def bind(self, param=""):
+        return tuple(REPORT_PARAMETERS[name](param) for name in self.params)
+
+class PartialAggregate:
+    # A summary report recomputed from the invoice tables in pieces, so that
+    # the pieces can run in separate processes (Database.run_parallel_report).
+    # sql aggregates one rowid range of the shard table, bound as its two
+    # parameters, into grouping keys followed by a single sum or count. The
+    # partials are added up per key; names, having, order and limit are then
+    # applied to the merged totals, as the report's own SQL does.
+    def __init__(self, sql, shard="invoice_items", names=None, having=None, order=None, ascending=False,
+                 limit=None, decorate=None):
+        self.sql = sql
+        self.shard = shard
+        # A query of (id, name) pairs; the first key is an id to be replaced
+        # by its name, with ids sharing a name added together.
+        self.names = names
+        self.having = having
+        self.order = order or (lambda row: row[-1])
+        self.ascending = ascending
+        self.limit = limit
+        self.decorate = decorate
+
+    def merge(self, partials):
+        totals = {}
+        for rows in partials:
+            for row in rows:
+                key = tuple(row[:-1])
+                totals[key] = totals.get(key, 0) + row[-1]
+        return totals
+
+    def finish(self, conn, totals):
+        if self.names:
+            names = dict(conn.execute(self.names).fetchall())
+            named = {}
+            for (key, *rest), total in totals.items():
+                if key in names:
+                    key = (names[key], *rest)
+                    named[key] = named.get(key, 0) + total
+            totals = named
+        rows = [key + (total,) for key, total in totals.items()]
+        if self.having:
+            rows = [row for row in rows if self.having(row[-1])]
+        rows.sort(key=self.order, reverse=not self.ascending)
+        if self.limit:
+            rows = rows[:self.limit]
+        if self.decorate:
+            rows = self.decorate(conn, rows)
+        return rows
+
+PARTIAL_PRODUCT_QUANTITY = """
+    SELECT product_id, SUM(quantity) FROM invoice_items
+    WHERE item_id BETWEEN ? AND ?
+    GROUP BY product_id
+"""
+
+PARTIAL_PRODUCT_REVENUE = """
+    SELECT product_name, SUM(subtotal) FROM invoice_items
+    WHERE item_id BETWEEN ? AND ?
+    GROUP BY product_name
+"""
+
+PARTIAL_PRODUCT_LINES = """
+    SELECT product_name, COUNT(*) FROM invoice_items
+    WHERE item_id BETWEEN ? AND ?
+    GROUP BY product_name
+"""
+
+PARTIAL_CUSTOMER_SPENT = """
+    SELECT customer_id, SUM(total_amount) FROM invoices
+    WHERE invoice_id BETWEEN ? AND ?
+    GROUP BY customer_id
+"""
+
+PARTIAL_CUSTOMER_INVOICES = """
+    SELECT customer_id, COUNT(*) FROM invoices
+    WHERE invoice_id BETWEEN ? AND ?
+    GROUP BY customer_id
+"""
+
+PARTIAL_CUSTOMER_ITEMS = """
+    SELECT i.customer_id, COALESCE(SUM((SELECT SUM(quantity) FROM invoice_items ii WHERE ii.invoice_id = i.invoice_id)), 0)
+    FROM invoices i
+    WHERE i.invoice_id BETWEEN ? AND ?
+    GROUP BY i.customer_id
+"""
+
+PARTIAL_DAILY_QUANTITY = """
+    SELECT substr(i.date, 1, 10), ii.product_name, SUM(ii.quantity)
+    FROM invoice_items ii
+    JOIN invoices i ON ii.invoice_id = i.invoice_id
+    WHERE ii.item_id BETWEEN ? AND ?
+    GROUP BY substr(i.date, 1, 10), ii.product_name
+"""
+
+CUSTOMER_NAMES = "SELECT customer_id, name FROM customers"
+PRODUCT_NAMES = "SELECT product_id, name FROM products"
+
+def _with_jalali_dates(conn, rows):
+    if not rows:
+        return rows
+    dates = [row[0] for row in rows]
+    jalali = dict(conn.execute("SELECT date, jalali_date FROM calendar WHERE date BETWEEN ? AND ?",
+                               (min(dates), max(dates))).fetchall())
+    return [(row[0], jalali.get(row[0])) + tuple(row[1:]) for row in rows]
+
+def _month_param(param):
+    param = param.strip()
+    try:
+        datetime.strptime(param, "%Y-%m")
+    except ValueError:
+        raise ValueError("ماه باید به شکل YYYY-MM (میلادی یا شمسی) وارد شود.")
+    return param
+
+def _days_ago_param(days):
+    return lambda param: day_number(datetime.now()) - days
+
+REPORT_PARAMETERS = {
+    "month": _month_param,
+    "since_90_days": _days_ago_param(90),
+    "since_30_days": _days_ago_param(30),
+    # Closing the range lets the planner pick the day index.
+    "today": _days_ago_param(0),
+}
+
+# The summary tables have columns named like the report aliases, and in
+# HAVING a column name wins over an alias, so the filters repeat the SUM.
+REPORTS = [
+    Report(1, "مجموع فروش هر کالا (تعداد)",
+           ["نام کالا", "مجموع تعداد فروش"],
+           """
+            SELECT p.name, SUM(ps.total_quantity) as total_quantity
+            FROM product_sales ps
+            JOIN products p ON ps.product_id = p.product_id
+            GROUP BY p.name
+            ORDER BY total_quantity DESC
+           """,
+           partial=PartialAggregate(PARTIAL_PRODUCT_QUANTITY, names=PRODUCT_NAMES)),
+    Report(2, "کالاها با فروش بیشتر از 10 عدد",
+           ["نام کالا", "مجموع تعداد فروش"],
+           """
+            SELECT p.name, SUM(ps.total_quantity) as total_quantity
+            FROM product_sales ps
+            JOIN products p ON ps.product_id = p.product_id
+            GROUP BY p.name
+            HAVING SUM(ps.total_quantity) > 10
+            ORDER BY total_quantity DESC
+           """,
+           partial=PartialAggregate(PARTIAL_PRODUCT_QUANTITY, names=PRODUCT_NAMES,
+                                    having=lambda total: total > 10)),
+    Report(3, "مجموع خرید هر مشتری (مبلغ)",
+           ["نام مشتری", "مجموع مبلغ خرید"],
+           """
+            SELECT c.name, SUM(cs.total_spent) as total_spent
+            FROM customer_sales cs
+            JOIN customers c ON cs.customer_id = c.customer_id
+            GROUP BY c.name
+            ORDER BY total_spent DESC
+           """,
+           indexes=("idx_customers_name",), money=(1,),
+           partial=PartialAggregate(PARTIAL_CUSTOMER_SPENT, shard="invoices", names=CUSTOMER_NAMES)),
+    Report(4, "مشتریان با خرید بالای 500",
+           ["نام مشتری", "مجموع مبلغ خرید"],
+           f"""
+            SELECT c.name, SUM(cs.total_spent) as total_spent
+            FROM customer_sales cs
+            JOIN customers c ON cs.customer_id = c.customer_id
+            GROUP BY c.name
+            HAVING SUM(cs.total_spent) > {500 * RIALS_PER_TOMAN}
+            ORDER BY total_spent DESC
+           """,
+           indexes=("idx_customers_name",), money=(1,),
+           partial=PartialAggregate(PARTIAL_CUSTOMER_SPENT, shard="invoices", names=CUSTOMER_NAMES,
+                                    having=lambda total: total > 500 * RIALS_PER_TOMAN)),
+    Report(5, "فاکتورهای با مبلغ بالای 1000",
+           ["شماره فاکتور", "نام مشتری", "مبلغ کل"],
+           f"""
+            SELECT i.invoice_id, c.name, i.total_amount
+            FROM invoices i
+            JOIN customers c ON i.customer_id = c.customer_id
+            WHERE i.total_amount > {1000 * RIALS_PER_TOMAN}
+            ORDER BY i.total_amount DESC
+           """,
+           indexes=("idx_invoices_total",), money=(2,), partitioned=True),
+    Report(6, "کالاها با فروش کمتر از 5 عدد",
+           ["نام کالا", "مجموع تعداد فروش"],
+           """
+            SELECT p.name, SUM(ps.total_quantity) as total_quantity
+            FROM product_sales ps
+            JOIN products p ON ps.product_id = p.product_id
+            GROUP BY p.name
+            HAVING SUM(ps.total_quantity) < 5
+            ORDER BY total_quantity ASC
+           """,
+           partial=PartialAggregate(PARTIAL_PRODUCT_QUANTITY, names=PRODUCT_NAMES,
+                                    having=lambda total: total < 5, ascending=True)),
+    Report(7, "پرفروش‌ترین کالا (مبلغ)",
+           ["نام کالا", "مجموع مبلغ فروش"],
+           """
+            SELECT product_name, SUM(total_revenue) as total_revenue
+            FROM product_sales
+            GROUP BY product_name
+            ORDER BY total_revenue DESC
+            LIMIT 5
+           """,
+           money=(1,),
+           partial=PartialAggregate(PARTIAL_PRODUCT_REVENUE, limit=5)),
+    Report(8, "بهترین مشتریان (م مبلغ)",
+           ["نام مشتری", "مجموع مبلغ خرید"],
+           """
+            SELECT c.name, SUM(cs.total_spent) as total_spent
+            FROM customer_sales cs
+            JOIN customers c ON cs.customer_id = c.customer_id
+            GROUP BY c.name
+            ORDER BY total_spent DESC
+            LIMIT 5
+           """,
+           indexes=("idx_customers_name",), money=(1,),
+           partial=PartialAggregate(PARTIAL_CUSTOMER_SPENT, shard="invoices", names=CUSTOMER_NAMES, limit=5)),
+    Report(9, "کالاهای با موجودی کمتر از 5",
+           ["نام کالا", "موجودی"],
+           "SELECT name, stock FROM products WHERE stock < 5 ORDER BY stock ASC",
+           indexes=("idx_products_stock",)),
+    Report(10, "فروش کالا در ماه خاص (مثال: 2024-10 یا 1403-07)",
+           ["نام کالا", "تعداد فروش در ماه"],
+           """
+            SELECT product_name, SUM(quantity) as total_quantity
+            FROM daily_product_sales
+            WHERE sale_date BETWEEN (SELECT first_date FROM calendar_months WHERE month = ?)
+                                AND (SELECT last_date FROM calendar_months WHERE month = ?)
+            GROUP BY product_name
+            ORDER BY total_quantity DESC
+           """,
+           params=("month", "month")),
+    Report(11, "مشتریان فعال در ماه خاص (مثال: 2024-10 یا 1403-07)",
+           ["نام مشتری", "مجموع خرید در ماه"],
+           """
+            SELECT c.name, SUM(i.total_amount) as total_spent
+            FROM invoices i
+            JOIN customers c ON i.customer_id = c.customer_id
+            WHERE i.day BETWEEN (SELECT first_day FROM calendar_months WHERE month = ?)
+                            AND (SELECT last_day FROM calendar_months WHERE month = ?)
+            GROUP BY c.name
+            ORDER BY total_spent DESC
+           """,
+           params=("month", "month"), indexes=("idx_invoices_day",), money=(1,), partitioned=True),
+    Report(12, "فاکتورهای با بیش از 5 قلم کالا",
+           ["شماره فاکتور", "تعداد اقلام"],
+           """
+            SELECT invoice_id, COUNT(item_id) as item_count
+            FROM invoice_items
+            GROUP BY invoice_id
+            HAVING item_count > 5
+            ORDER BY item_count DESC
+           """,
+           indexes=("idx_invoice_items_invoice",), partitioned=True),
+    Report(13, "کالاهای فروخته شده کمتر از 3 بار",
+           ["نام کالا", "تعداد دفعات فروش"],
+           """
+            SELECT product_name, SUM(line_count) as sale_count
+            FROM product_sales
+            GROUP BY product_name
+            HAVING sale_count < 3
+            ORDER BY sale_count ASC
+           """,
+           partial=PartialAggregate(PARTIAL_PRODUCT_LINES, having=lambda count: count < 3, ascending=True)),
+    Report(14, "مجموع خرید هر مشتری (تعداد)",
+           ["نام مشتری", "مجموع تعداد خرید"],
+           """
+            SELECT c.name, SUM(cs.total_items) as total_items
+            FROM customer_sales cs
+            JOIN customers c ON cs.customer_id = c.customer_id
+            GROUP BY c.name
+            ORDER BY total_items DESC
+           """,
+           indexes=("idx_customers_name",),
+           partial=PartialAggregate(PARTIAL_CUSTOMER_ITEMS, shard="invoices", names=CUSTOMER_NAMES)),
+    Report(15, "مشتریان با بیش از 3 فاکتور",
+           ["نام مشتری", "تعداد فاکتور"],
+           """
+            SELECT c.name, SUM(cs.invoice_count) as invoice_count
+            FROM customer_sales cs
+            JOIN customers c ON cs.customer_id = c.customer_id
+            GROUP BY c.name
+            HAVING SUM(cs.invoice_count) > 3
+            ORDER BY invoice_count DESC
+           """,
+           indexes=("idx_customers_name",),
+           partial=PartialAggregate(PARTIAL_CUSTOMER_INVOICES, shard="invoices", names=CUSTOMER_NAMES,
+                                    having=lambda count: count > 3)),
+    Report(16, "کالاها با فروش بیش از 500 (مبلغ)",
+           ["نام کالا", "مجموع مبلغ فروش"],
+           f"""
+            SELECT product_name, SUM(total_revenue) as total_revenue
+            FROM product_sales
+            GROUP BY product_name
+            HAVING SUM(total_revenue) > {500 * RIALS_PER_TOMAN}
+            ORDER BY total_revenue DESC
+           """,
+           money=(1,),
+           partial=PartialAggregate(PARTIAL_PRODUCT_REVENUE, having=lambda total: total > 500 * RIALS_PER_TOMAN)),
+    Report(17, "خرید مشتری در 3 ماه گذشته",
+           ["نام مشتری", "مجموع خرید ۳ ماه اخیر"],
+           """
+            SELECT c.name, SUM(i.total_amount) as total_spent
+            FROM invoices i
+            JOIN customers c ON i.customer_id = c.customer_id
+            WHERE i.day BETWEEN ? AND ?
+            GROUP BY c.name
+            ORDER BY total_spent DESC
+           """,
+           params=("since_90_days", "today"), indexes=("idx_invoices_day",), money=(1,), partitioned=True),
+    Report(18, "کالاها با موجودی بین 5 تا 10",
+           ["نام کالا", "موجودی"],
+           "SELECT name, stock FROM products WHERE stock BETWEEN 5 AND 10 ORDER BY stock ASC",
+           indexes=("idx_products_stock",)),
+    Report(19, "مشتریان بدون خرید در ماه گذشته",
+           ["نام مشتری"],
+           """
+            SELECT name
+            FROM customers
+            WHERE customer_id NOT IN (
+                SELECT DISTINCT customer_id FROM invoices WHERE day BETWEEN ? AND ?
+            )
+           """,
+           params=("since_30_days", "today"), indexes=("idx_invoices_day",), partitioned=True),
+    Report(20, "مجموع فروش روزانه هر کالا (تعداد)",
+           ["تاریخ", "تاریخ شمسی", "نام کالا", "تعداد فروش روزانه"],
+           """
+            SELECT sale_date, cal.jalali_date, product_name, quantity as daily_quantity
+            FROM daily_product_sales
+            LEFT JOIN calendar cal ON cal.date = sale_date
+            ORDER BY sale_date DESC, daily_quantity DESC
+           """,
+           partial=PartialAggregate(PARTIAL_DAILY_QUANTITY, order=lambda row: (row[0], row[-1]),
+                                    decorate=_with_jalali_dates)),
+]
+
+REPORTS_BY_NUMBER = {report.number: report for report in REPORTS}
+
+REPORT_LIST = [report.label for report in REPORTS]
+
+def get_report(number):
+    try:
+        return REPORTS_BY_NUMBER[int(number)]
+    except (KeyError, ValueError):
+        raise ValueError(f"Unknown report: {number}")
+
+def explain_report_plans(db):
+    plans = []
+    with db.get_conn() as conn:
+        for report in REPORTS:
+            rows = conn.execute("EXPLAIN QUERY PLAN " + report.sql, report.bind("2024-10")).fetchall()
+            details = [row["detail"] for row in rows]
+            problems = [d for d in details if d.startswith("SCAN") and "COVERING INDEX" not in d
+                        and d.split()[1] not in SUMMARY_TABLES]
+            problems += [f"expected index not used: {name}" for name in report.indexes
+                         if not any(name in d for d in details)]
+            plans.append((report, details, problems))
+    return plans
+
+INSERT_INVOICE_ITEM = """
+    INSERT INTO invoice_items
+    (invoice_id, product_id, product_name, unit_price, quantity, subtotal)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+# Quantities arrive as a JSON array of [product_id, quantity] pairs so that
+# a whole cart (or a batch of carts) adjusts stock in one statement. Lines
+# without enough stock are left untouched and missing from RETURNING.
+SUBTRACT_SOLD_STOCK = """
+    UPDATE products SET stock = stock - sold.sold_quantity
+    FROM (SELECT json_extract(value, '$[0]') AS product_id,
+                 json_extract(value, '$[1]') AS sold_quantity
+          FROM json_each(?)) AS sold
+    WHERE products.product_id = sold.product_id
+      AND products.stock >= sold.sold_quantity
+    RETURNING products.product_id
+"""
+
+RESTORE_INVOICE_STOCK = """
+    UPDATE products SET stock = stock + sold.sold_quantity
+    FROM (SELECT product_id, SUM(quantity) AS sold_quantity
+          FROM invoice_items WHERE invoice_id = ?
+          GROUP BY product_id) AS sold
+    WHERE products.product_id = sold.product_id
+"""
+
+SEARCH_LIMIT = 200
+REPORT_BATCH_SIZE = 500
+REPORT_CACHE_MAX_ROWS = 5000
+STATEMENT_CACHE_SIZE = 256
+INVOICE_BATCH_SIZE = 500
+INVOICE_PAGE_SIZE = 100
+EXPORT_BATCH_SIZE = 5000
+PARTIAL_SHARDS_PER_PROCESS = 4
+BACKUP_PAGES = 256
+BACKUP_PAUSE = 0.02
+BACKUP_KEEP = 7
+BACKUP_RESTARTS = 3
+BACKUP_SPARE_STEPS = 10
+BACKUP_PRE_RESTORE = "pre-restore"
+WRITE_RETRY_ATTEMPTS = 6
+WRITE_RETRY_DELAY = 0.05
+
+_task_state = threading.local()
+
+class QueryCancelled(Exception):
+    pass
+
+def _interrupt_if_cancelled():
+    cancel_event = getattr(_task_state, "cancel_event", None)
+    return 1 if cancel_event is not None and cancel_event.is_set() else 0
+
+class StockError(Exception):
+    def __init__(self, shortages):
+        # shortages holds (product_id, requested, available) per failed line;
+        # available is None when the product no longer exists.
+        self.shortages = shortages
+        super().__init__(", ".join(
+            f"product {pid}: requested {requested}, available {available}"
+            for pid, requested, available in shortages))
+
+def _is_busy(error):
+    name = getattr(error, "sqlite_errorname", "")
+    if name:
+        return name.startswith(("SQLITE_BUSY", "SQLITE_LOCKED"))
+    return "locked" in str(error) or "busy" in str(error)
+
+def _read_only(path):
+    conn = sqlite3.connect(f"file:{quote(os.path.abspath(path))}?mode=ro", uri=True)
+    apply_storage_profile(conn, {pragma: STORAGE_PROFILE[pragma] for pragma in ("cache_size", "mmap_size", "temp_store")})
+    return conn
+
+def _partial_rows(path, batch, sql, low, high):
+    # Runs in a worker process on its own read-only connection. Archive
+    # files hide rows of unregistered batches behind temp views, the same
+    # filter Database.route applies.
+    with closing(_read_only(path)) as conn:
+        if batch is not None:
+            for table, columns in ARCHIVE_TABLES.items():
+                conn.execute(f"CREATE TEMP VIEW {table} AS SELECT {columns} FROM main.{table} "
+                             f"WHERE archive_batch <= {batch}")
+        return conn.execute(sql, (low, high)).fetchall()
+
+QUERY_SLOW_MS = 200
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+SLOW_QUERY_HISTORY = 100
+
+def _histogram():
+    return [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+def _bucket(ms):
+    for i, bound in enumerate(LATENCY_BUCKETS_MS):
+        if ms <= bound:
+            return i
+    return len(LATENCY_BUCKETS_MS)
+
+def _histogram_percentile(buckets, fraction):
+    # Upper bound of the bucket holding the percentile; the overflow bucket
+    # has no bound and reports None.
+    total = sum(buckets)
+    if not total:
+        return 0.0
+    seen = 0
+    for i, count in enumerate(buckets):
+        seen += count
+        if seen >= fraction * total:
+            return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else None
+    return None
+
+class QueryProfiler:
+    # Collects statement latencies, row counts and pool wait times from every
+    # thread. Statements slower than slow_ms get their EXPLAIN QUERY PLAN
+    # captured and, with a log_path, are appended to it as JSON lines.
+    def __init__(self, slow_ms=QUERY_SLOW_MS, log_path=None):
+        self.slow_ms = slow_ms
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.statements = {}
+            self.screens = {}
+            self.waits = {"count": 0, "total": 0.0, "max": 0.0, "buckets": _histogram()}
+            self.traced = {}
+            self.slow = deque(maxlen=SLOW_QUERY_HISTORY)
+            self._plans = {}
+
+    @contextmanager
+    def measure(self, statement, conn=None, params=(), name=None):
+        # The caller stores the number of rows it read in result["rows"].
+        result = {"rows": 0}
+        started = time.perf_counter()
+        try:
+            yield result
+        except Exception as e:
+            self.record(statement, time.perf_counter() - started, 0, name=name, error=e)
+            raise
+        ms = (time.perf_counter() - started) * 1000
+        plan = None
+        if ms >= self.slow_ms and conn is not None:
+            plan = self.plan(conn, statement, params)
+        self.record(statement, ms / 1000, result["rows"], name=name, plan=plan)
+
+    def plan(self, conn, statement, params):
+        if statement in self._plans:
+            return self._plans[statement]
+        try:
+            rows = conn.execute("EXPLAIN QUERY PLAN " + statement, params).fetchall()
+            plan = [row[-1] for row in rows]
+        except sqlite3.Error as e:
+            plan = [f"(no plan: {e})"]
+        self._plans[statement] = plan
+        return plan
+
+    def record(self, statement, seconds, rows, name=None, error=None, plan=None):
+        ms = seconds * 1000
+        key = name or " ".join(statement.split())
+        screen = getattr(_task_state, "screen", None) or "-"
+        with self._lock:
+            entry = self.statements.get(key)
+            if entry is None:
+                entry = self.statements[key] = {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                                "rows": 0, "buckets": _histogram(), "last_error": None}
+            entry["count"] += 1
+            entry["total_ms"] += ms
+            entry["max_ms"] = max(entry["max_ms"], ms)
+            entry["rows"] += rows
+            entry["buckets"][_bucket(ms)] += 1
+            if error is not None:
+                entry["errors"] += 1
+                entry["last_error"] = str(error)
+
+            totals = self.screens.setdefault(screen, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            totals["count"] += 1
+            totals["total_ms"] += ms
+            totals["max_ms"] = max(totals["max_ms"], ms)
+
+            if plan is not None:
+                slow = {"time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "ms": ms, "rows": rows,
+                        "screen": screen, "statement": key, "plan": plan}
+                self.slow.append(slow)
+                if self.log_path:
+                    with open(self.log_path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(slow, ensure_ascii=False) + "\n")
+
+    def record_wait(self, seconds):
+        ms = seconds * 1000
+        with self._lock:
+            self.waits["count"] += 1
+            self.waits["total"] += ms
+            self.waits["max"] = max(self.waits["max"], ms)
+            self.waits["buckets"][_bucket(ms)] += 1
+
+    def trace(self, statement):
+        # set_trace_callback sees every statement SQLite runs, including the
+        # untimed ones. A statement is reported again for each trigger program
+        # it fires, and statements SQLite runs internally (FTS shadow tables,
+        # for one) arrive prefixed with "-- ".
+        nested = statement.startswith("-- ")
+        words = (statement[3:] if nested else statement).split(None, 1)
+        kind = words[0].upper() if words else "?"
+        if nested:
+            kind = "nested " + kind
+        with self._lock:
+            self.traced[kind] = self.traced.get(kind, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            statements = []
+            for key, entry in self.statements.items():
+                statements.append(dict(
+                    statement=key,
+                    count=entry["count"],
+                    errors=entry["errors"],
+                    last_error=entry["last_error"],
+                    rows=entry["rows"],
+                    mean_ms=entry["total_ms"] / entry["count"],
+                    p50_ms=_histogram_percentile(entry["buckets"], 0.50),
+                    p95_ms=_histogram_percentile(entry["buckets"], 0.95),
+                    max_ms=entry["max_ms"],
+                    total_ms=entry["total_ms"],
+                    histogram=dict(zip([f"<={b}" for b in LATENCY_BUCKETS_MS] + ["more"], entry["buckets"])),
+                ))
+            statements.sort(key=lambda s: s["total_ms"], reverse=True)
+            waits = self.waits
+            return {
+                "since": datetime.fromtimestamp(self.started).strftime("%Y-%m-%d %H:%M:%S"),
+                "slow_ms": self.slow_ms,
+                "statements": statements,
+                "screens": {screen: dict(totals, mean_ms=totals["total_ms"] / totals["count"])
+                            for screen, totals in self.screens.items()},
+                "pool_wait": {"count": waits["count"], "max_ms": waits["max"],
+                              "mean_ms": waits["total"] / waits["count"] if waits["count"] else 0.0,
+                              "p95_ms": _histogram_percentile(waits["buckets"], 0.95)},
+                "traced": dict(sorted(self.traced.items(), key=lambda item: item[1], reverse=True)),
+                "slow": list(self.slow),
+            }
+
+    def export(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=2, ensure_ascii=False)
+
+class ConnectionPool:
+    def __init__(self, db_file, size=5, timeout=10.0, profile=None, profiler=None):
+        self.db_file = db_file
+        self.size = size
+        self.timeout = timeout
+        self.profile = profile
+        self.profiler = profiler
+        self.opened = 0
+        self.reused = 0
+        self._idle = []
+        self._all = set()
+        self._opening = 0
+        self._closed = False
+        self._local = threading.local()
+        self._cond = threading.Condition()
+
+    def _connect(self):
+        # Report and page SQL strings are constants, so each statement is
+        # prepared once per connection and reused from this cache.
+        conn = sqlite3.connect(self.db_file, timeout=self.timeout, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        conn.execute("PRAGMA foreign_keys = ON;")
+        apply_storage_profile(conn, self.profile)
+        conn.row_factory = sqlite3.Row
+        conn.set_progress_handler(_interrupt_if_cancelled, 1000)
+        if self.profiler is not None:
+            conn.set_trace_callback(self.profiler.trace)
+        return conn
+
+    def _is_healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn):
+        self._all.discard(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def acquire(self):
+        # A thread that already holds a connection keeps using it, so nested
+        # calls inside one transaction never see two different connections.
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.depth += 1
+            return conn
+
+        started = time.perf_counter()
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise sqlite3.ProgrammingError("Connection pool is closed.")
+                    if self._idle:
+                        conn = self._idle.pop()
+                        break
+                    if len(self._all) + self._opening < self.size:
+                        # The slot is taken now; the connection is opened
+                        # below.
+                        self._opening += 1
+                        conn = None
+                        break
+                    if not self._cond.wait(self.timeout):
+                        raise sqlite3.OperationalError("Timed out waiting for a free database connection.")
+
+            # Opening a connection and probing an idle one are done outside
+            # the lock, so other threads can check connections in and out
+            # meanwhile.
+            if conn is None:
+                try:
+                    conn = self._connect()
+                finally:
+                    with self._cond:
+                        self._opening -= 1
+                        if conn is not None:
+                            self._all.add(conn)
+                            self.opened += 1
+                        self._cond.notify()
+                break
+            if self._is_healthy(conn):
+                with self._cond:
+                    self.reused += 1
+                break
+            with self._cond:
+                self._discard(conn)
+                self._cond.notify()
+
+        if self.profiler is not None:
+            self.profiler.record_wait(time.perf_counter() - started)
+        self._local.conn = conn
+        self._local.depth = 1
+        return conn
+
+    def release(self, conn):
+        self._local.depth -= 1
+        if self._local.depth > 0:
+            return
+        self._local.conn = None
+
+        if conn.in_transaction:
+            conn.rollback()
+        with self._cond:
+            if self._closed:
+                self._discard(conn)
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        # Only the outermost block ends the transaction; a nested one is
+        # part of its caller's.
+        conn = self.acquire()
+        outermost = self._local.depth == 1
+        try:
+            yield conn
+            if outermost and conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            if outermost and conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self.size,
+                "open": len(self._all),
+                "idle": len(self._idle),
+                "opened": self.opened,
+                "reused": self.reused,
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            for conn in self._idle:
+                self._discard(conn)
+            self._idle = []
+            self._cond.notify_all()
+
+class ReportCache:
+    def __init__(self, max_entries=32, max_rows=REPORT_CACHE_MAX_ROWS):
+        # Results longer than max_rows are not kept, so the cache holds at
+        # most max_entries * max_rows rows whichever path produced them.
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, rows):
+        with self._lock:
+            if len(rows) > self.max_rows:
+                self.entries.pop(key, None)
+                return
+            self.entries[key] = (version, rows)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+CATALOG_MATCHES = 20
+
+def normalize_lookup(text):
+    # Arabic yeh and kaf are common in imported data; fold them to Persian
+    # so both spellings find the same customer.
+    text = _field(text).casefold().replace("ي", "ی").replace("ك", "ک")
+    return " ".join(text.split())
+
+class CatalogCache:
+    # In-process copies of customers and products. A table is reloaded only
+    # when its row in table_versions has moved since the last load, so an
+    # unchanged catalog costs one small query to confirm.
+    def __init__(self, db):
+        self.db = db
+        self.versions = {}
+        self.customers = {}
+        self.products = {}
+        self._customer_keys = []
+        self._customers_by_name = []
+        self._products_by_name = []
+        self.loads = 0
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return len(self.versions) == len(CATALOG_TABLES)
+
+    def refresh(self):
+        with self._lock, self.db.get_conn() as conn:
+            # One read transaction, so versions match the rows loaded with them.
+            conn.execute("BEGIN")
+            versions = dict(conn.execute("SELECT table_name, version FROM table_versions").fetchall())
+            if versions.get("customers") != self.versions.get("customers"):
+                self._load_customers(conn.execute("SELECT customer_id, name, phone, address FROM customers").fetchall())
+            if versions.get("products") != self.versions.get("products"):
+                self._load_products(conn.execute("SELECT product_id, name, price, stock FROM products").fetchall())
+            conn.commit()
+        self.versions = versions
+        return self
+
+    def _load_customers(self, rows):
+        customers = {row["customer_id"]: row for row in rows}
+        # Every customer is findable by full name, by each later word of the
+        # name (usually the family name) and by phone.
+        keys = []
+        names = []
+        for row in rows:
+            name = normalize_lookup(row["name"])
+            names.append((name, row["customer_id"]))
+            for word in name.split()[1:]:
+                keys.append((word, row["customer_id"]))
+            if row["phone"]:
+                keys.append((normalize_lookup(row["phone"]), row["customer_id"]))
+        names.sort()
+        keys.extend(names)
+        keys.sort()
+        by_name = [customers[customer_id] for name, customer_id in names]
+        # Swapped in together; readers on the Tk thread never see a half-built index.
+        self.customers, self._customer_keys, self._customers_by_name = customers, keys, by_name
+        self.loads += 1
+
+    def _load_products(self, rows):
+        self.products = {row["product_id"]: row for row in rows}
+        self._products_by_name = sorted(rows, key=lambda row: row["name"])
+        self.loads += 1
+
+    def customer(self, customer_id):
+        return self.customers.get(customer_id)
+
+    def product(self, product_id):
+        return self.products.get(product_id)
+
+    def find_customers(self, text, limit=CATALOG_MATCHES):
+        key = normalize_lookup(text)
+        if not key:
+            return self._customers_by_name[:limit]
+        keys, customers = self._customer_keys, self.customers
+        found = {}
+        for position in range(bisect_left(keys, (key,)), len(keys)):
+            entry, customer_id = keys[position]
+            if not entry.startswith(key):
+                break
+            if customer_id in customers:
+                found[customer_id] = customers[customer_id]
+            if len(found) >= limit:
+                break
+        return sorted(found.values(), key=lambda row: normalize_lookup(row["name"]))
+
+    def products_in_stock(self):
+        return [row for row in self._products_by_name if row["stock"] > 0]
+
+    def stats(self):
+        return {"customers": len(self.customers), "products": len(self.products), "loads": self.loads,
+                "versions": dict(self.versions)}
+
+class DBTask:
+    def __init__(self, future, cancel_event):
+        self.future = future
+        self.cancel_event = cancel_event
+
+    def cancel(self):
+        self.cancel_event.set()
+        self.future.cancel()
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def done(self):
+        return self.future.done()
+
+class DBExecutor:
+    def __init__(self, workers=3):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db-worker")
+
+    def submit(self, fn, *args, **kwargs):
+        return self.submit_for(None, fn, *args, **kwargs)
+
+    def submit_for(self, screen, fn, *args, **kwargs):
+        # screen names the window or caller the task runs for in the
+        # query profile.
+        cancel_event = threading.Event()
+        future = self._pool.submit(self._run, cancel_event, screen, fn, args, kwargs)
+        return DBTask(future, cancel_event)
+
+    def _run(self, cancel_event, screen, fn, args, kwargs):
+        if cancel_event.is_set():
+            raise QueryCancelled()
+        # The connection progress handler polls this event, so a cancelled
+        # task interrupts whatever statement it is running.
+        _task_state.cancel_event = cancel_event
+        _task_state.screen = screen
+        try:
+            return fn(*args, **kwargs)
+        except sqlite3.OperationalError:
+            if cancel_event.is_set():
+                raise QueryCancelled()
+            raise
+        finally:
+            _task_state.cancel_event = None
+            _task_state.screen = None
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+class Database:
+    def __init__(self, db_file="store.db", pool_size=5, profile=None, checkpoint_interval=300, workers=3,
+                 report_cache_size=32, slow_ms=QUERY_SLOW_MS, profile_log=None, report_processes=None,
+                 backup_interval=0, backup_dir=None):
+        self.db_file = db_file
+        self.profiler = QueryProfiler(slow_ms, profile_log)
+        self.pool = ConnectionPool(db_file, size=pool_size, profile=profile, profiler=self.profiler)
+        self.executor = DBExecutor(workers)
+        self.report_cache = ReportCache(report_cache_size)
+        self.catalog = CatalogCache(self)
+        self._search_indexes = {}
+        self.report_processes = report_processes or os.cpu_count() or 1
+        self._process_pool = None
+        self._process_pool_lock = threading.Lock()
+        self._stop_background = threading.Event()
+        self._checkpoint_thread = None
+        if checkpoint_interval:
+            self._checkpoint_thread = threading.Thread(target=self._checkpoint_loop, args=(checkpoint_interval,),
+                                                       name="wal-checkpoint", daemon=True)
+            self._checkpoint_thread.start()
+        self.backup_dir = backup_dir
+        self.last_backup = None
+        self._backup_lock = threading.Lock()
+        if backup_interval:
+            threading.Thread(target=self._backup_loop, args=(backup_interval,), name="backup", daemon=True).start()
+
+    def get_conn(self):
+        return self.pool.connection()
+
+    def run_query(self, query, params=(), commit=False):
+        with self.get_conn() as conn, self.profiler.measure(query, conn, params) as measured:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            if commit:
+                conn.commit()
+                measured["rows"] = cursor.rowcount
+                return cursor.lastrowid
+            else:
+                rows = cursor.fetchall()
+                measured["rows"] = len(rows)
+                return rows
+
+    def submit(self, fn, *args, **kwargs):
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def submit_for(self, screen, fn, *args, **kwargs):
+        return self.executor.submit_for(screen, fn, *args, **kwargs)
+
+    def has_search_index(self, fts_table):
+        if fts_table not in self._search_indexes:
+            rows = self.run_query("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts_table,))
+            self._search_indexes[fts_table] = bool(rows)
+        return self._search_indexes[fts_table]
+
+    def search(self, fts_table, term, limit=SEARCH_LIMIT):
+        table, key, columns = SEARCH_INDEXES[fts_table]
+        term = term.strip()
+        # Trigram queries need at least three characters; shorter terms use a
+        # bound LIKE over the same columns instead.
+        if len(term) >= 3 and self.has_search_index(fts_table):
+            query = f"""
+                SELECT t.* FROM {fts_table} f
+                JOIN {table} t ON t.{key} = f.rowid
+                WHERE {fts_table} MATCH ?
+                ORDER BY f.rank
+                LIMIT ?
+            """
+            return self.run_query(query, ('"' + term.replace('"', '""') + '"', limit))
+
+        pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        conditions = " OR ".join(f"{c} LIKE ? ESCAPE '\\'" for c in columns)
+        query = f"SELECT * FROM {table} WHERE {conditions} ORDER BY name LIMIT ?"
+        return self.run_query(query, (pattern,) * len(columns) + (limit,))
+
+    def search_customers(self, term, limit=SEARCH_LIMIT):
+        return self.search("customers_fts", term, limit)
+
+    def search_products(self, term, limit=SEARCH_LIMIT):
+        return self.search("products_fts", term, limit)
+
+    def submit_query(self, query, params=(), commit=False):
+        return self.submit(self.run_query, query, params, commit)
+
+    def data_version(self, conn=None):
+        if conn is None:
+            with self.get_conn() as conn:
+                return self.data_version(conn)
+        row = conn.execute("SELECT version FROM data_version WHERE id = 1").fetchone()
+        return row[0] if row else 0
+
+    @contextmanager
+    def _attached(self, conn, databases):
+        attached = []
+        try:
+            for schema, path in databases.items():
+                conn.execute("ATTACH DATABASE ? AS ?", (path, schema))
+                attached.append(schema)
+            yield
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            for schema in attached:
+                conn.execute(f"DETACH DATABASE {schema}")
+
+    def archive_path(self, name):
+        return os.path.join(os.path.dirname(os.path.abspath(self.db_file)), name)
+
+    def archived_years(self, conn=None):
+        query = "SELECT year FROM archive_partitions WHERE batch > 0 ORDER BY year"
+        if conn is not None:
+            return [row[0] for row in conn.execute(query)]
+        return [row[0] for row in self.run_query(query)]
+
+    @contextmanager
+    def route(self, conn, first_day=None, last_day=None, years=None, hot=True):
+        # Shadows invoices and invoice_items on conn with temp views over the
+        # hot tables and the archive partitions that overlap the day range
+        # (or the given years), so queries keep their plain table names.
+        # With no partition to add nothing is attached at all.
+        partitions = conn.execute("""
+            SELECT year, path, batch FROM archive_partitions
+            WHERE batch > 0 AND last_day >= COALESCE(?, last_day) AND first_day <= COALESCE(?, first_day)
+            ORDER BY year
+        """, (first_day, last_day)).fetchall()
+        if years is not None:
+            partitions = [row for row in partitions if row[0] in years]
+        if not partitions:
+            yield []
+            return
+        if len(partitions) > conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED):
+            raise ValueError(f"the range spans {len(partitions)} archived years; narrow it down")
+        databases = {}
+        for year, path, batch in partitions:
+            path = self.archive_path(path)
+            if not os.path.exists(path):
+                raise sqlite3.OperationalError(f"archive file missing: {path}")
+            databases[f"archive_{year}"] = path
+        with self._attached(conn, databases):
+            try:
+                for table, columns in ARCHIVE_TABLES.items():
+                    arms = [f"SELECT {columns} FROM main.{table}"] if hot else []
+                    arms += [f"SELECT {columns} FROM archive_{year}.{table} WHERE archive_batch <= {batch}"
+                             for year, path, batch in partitions]
+                    conn.execute(f"CREATE TEMP VIEW {table} AS " + " UNION ALL ".join(arms))
+                yield [row[0] for row in partitions]
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                for table in ARCHIVE_TABLES:
+                    conn.execute(f"DROP VIEW IF EXISTS temp.{table}")
+
+    def _report_route(self, conn, report, params):
+        if not report.partitioned:
+            return nullcontext()
+        if "month" in report.params:
+            month = params[report.params.index("month")]
+            days = conn.execute("SELECT first_day, last_day FROM calendar_months WHERE month = ?", (month,)).fetchone()
+            return self.route(conn, *(days or (0, -1)))
+        if "today" in report.params:
+            return self.route(conn, min(params), max(params))
+        return self.route(conn)
+
+    def run_report(self, number, param=""):
+        report = get_report(number)
+        params = report.bind(param)
+        key = (report.number, params)
+
+        with self.get_conn() as conn, self._report_route(conn, report, params):
+            # One read transaction, so the version matches the rows it caches.
+            conn.execute("BEGIN")
+            version = self.data_version(conn)
+            rows = self.report_cache.get(key, version)
+            if rows is None:
+                with self.profiler.measure(report.sql, conn, params, name=report.label) as measured:
+                    rows = conn.execute(report.sql, params).fetchall()
+                    measured["rows"] = len(rows)
+                self.report_cache.put(key, version, rows)
+            conn.commit()
+        return report.columns, rows
+
+    def stream_report(self, number, param, out_queue, batch_size=REPORT_BATCH_SIZE, parallel=False, offset=0,
+                      limit=None):
+        # Sends the rows after the first offset, at most limit of them, then
+        # ("more", rows so far) if the report goes on or ("done", total).
+        # Stopping at the limit closes the cursor and ends the read
+        # transaction, so a window waiting on its "more" button holds no
+        # worker or connection and keeps no WAL checkpoint behind its
+        # snapshot; the next page runs the report again from its offset.
+        report = get_report(number)
+        params = report.bind(param)
+        key = (report.number, params)
+        end = None if limit is None else offset + limit
+
+        def put(item):
+            # The queue is bounded, so a reader that falls behind pauses the
+            # cursor here instead of letting rows pile up in memory.
+            while True:
+                try:
+                    out_queue.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    if _interrupt_if_cancelled():
+                        raise QueryCancelled()
+
+        def put_page(rows):
+            page = rows[offset:end]
+            for start in range(0, len(page), batch_size):
+                put(("rows", page[start:start + batch_size]))
+            put(("more" if end is not None and len(rows) > end else "done", offset + len(page)))
+            return offset + len(page)
+
+        if parallel and report.partial is not None:
+            # The merge needs every partial, so rows arrive all at once.
+            columns, rows = self.run_parallel_report(number, param)
+            put(("columns", columns))
+            return put_page(rows)
+
+        with self.get_conn() as conn, self._report_route(conn, report, params):
+            conn.execute("BEGIN")
+            version = self.data_version(conn)
+            put(("columns", report.columns))
+
+            rows = self.report_cache.get(key, version)
+            if rows is not None:
+                conn.commit()
+                if offset == 0 and (end is None or len(rows) <= end):
+                    # A cached result that fits the page is shown whole.
+                    put(("all", rows))
+                    put(("done", len(rows)))
+                    return len(rows)
+                return put_page(rows)
+
+            sql, query_params = report.sql, params
+            if offset:
+                sql = f"SELECT * FROM ({report.sql}) LIMIT -1 OFFSET ?"
+                query_params = params + (offset,)
+            # Only time spent in SQLite is profiled, not time blocked on the
+            # queue waiting for the window to catch up.
+            started = time.perf_counter()
+            cursor = conn.execute(sql, query_params)
+            spent = time.perf_counter() - started
+            kept = [] if offset == 0 else None
+            sent = 0
+            more = False
+            while True:
+                started = time.perf_counter()
+                if end is not None and offset + sent >= end:
+                    more = cursor.fetchone() is not None
+                    batch = []
+                else:
+                    batch = cursor.fetchmany(batch_size if end is None else min(batch_size, end - offset - sent))
+                spent += time.perf_counter() - started
+                if not batch:
+                    break
+                sent += len(batch)
+                if kept is not None:
+                    kept.extend(batch)
+                    if len(kept) > self.report_cache.max_rows:
+                        kept = None
+                put(("rows", batch))
+            cursor.close()
+            conn.commit()
+            plan = self.profiler.plan(conn, sql, query_params) if spent * 1000 >= self.profiler.slow_ms else None
+            self.profiler.record(report.sql, spent, sent, name=report.label, plan=plan)
+
+        if kept is not None and not more:
+            self.report_cache.put(key, version, kept)
+        put(("more" if more else "done", offset + sent))
+        return offset + sent
+
+    def process_pool(self):
+        with self._process_pool_lock:
+            if self._process_pool is None:
+                # Spawned rather than forked, so the workers do not inherit
+                # the pooled connections or the threads using them.
+                self._process_pool = ProcessPoolExecutor(self.report_processes,
+                                                         mp_context=multiprocessing.get_context("spawn"))
+            return self._process_pool
+
+    def report_shards(self, conn, table, pieces):
+        # Splits the rowids of table, in the hot database and in every
+        # archived year, into about pieces ranges of similar width.
+        sources = [(os.path.abspath(self.db_file), None)]
+        sources += [(self.archive_path(path), batch) for path, batch in conn.execute(
+            "SELECT path, batch FROM archive_partitions WHERE batch > 0 ORDER BY year")]
+        ranges = []
+        for path, batch in sources:
+            query = f"SELECT MIN(rowid), MAX(rowid) FROM main.{table}"
+            if batch is None:
+                low, high = conn.execute(query).fetchone()
+            else:
+                with closing(_read_only(path)) as archive:
+                    low, high = archive.execute(query).fetchone()
+            if low is not None:
+                ranges.append((path, batch, low, high))
+        step = max(1, -(-sum(high - low + 1 for _, _, low, high in ranges) // pieces))
+        return [(path, batch, start, min(start + step - 1, high))
+                for path, batch, low, high in ranges
+                for start in range(low, high + 1, step)]
+
+    def run_parallel_report(self, number, param=""):
+        # Recomputes a summary report from the invoice lines instead of
+        # reading the summary tables, with the shards spread over processes.
+        report = get_report(number)
+        if report.partial is None:
+            raise ValueError(f"Report {report.number} cannot run in parallel")
+        partial = report.partial
+        key = (report.number, report.bind(param))
+
+        with self.get_conn() as conn:
+            version = self.data_version(conn)
+            rows = self.report_cache.get(key, version)
+            if rows is not None:
+                return report.columns, rows
+            with self.profiler.measure(partial.sql, name=f"{report.label} (parallel)") as measured:
+                shards = self.report_shards(conn, partial.shard, self.report_processes * PARTIAL_SHARDS_PER_PROCESS)
+                pool = self.process_pool()
+                pending = {pool.submit(_partial_rows, path, batch, partial.sql, low, high)
+                           for path, batch, low, high in shards}
+                partials = []
+                try:
+                    while pending:
+                        if _interrupt_if_cancelled():
+                            raise QueryCancelled()
+                        done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                        partials.extend(future.result() for future in done)
+                finally:
+                    for future in pending:
+                        future.cancel()
+                rows = partial.finish(conn, partial.merge(partials))
+                measured["rows"] = len(rows)
+            # Each shard was read in its own snapshot, so the result is only
+            # cached when nothing was written while they ran.
+            if self.data_version(conn) == version:
+                self.report_cache.put(key, version, rows)
+        return report.columns, rows
+
+    def write_transaction(self, fn, *args, attach=None):
+        # BEGIN IMMEDIATE takes the write lock up front, so concurrent
+        # writers queue on SQLite's lock rather than failing half way.
+        # If the lock stays busy past the connection timeout, the whole
+        # transaction is retried with jittered exponential backoff.
+        # attach maps schema names to database files to attach around it.
+        delay = WRITE_RETRY_DELAY
+        for attempt in range(WRITE_RETRY_ATTEMPTS):
+            try:
+                with self.get_conn() as conn, self._attached(conn, attach or {}), \
+                        self.profiler.measure(f"transaction {fn.__qualname__}"):
+                    conn.execute("BEGIN IMMEDIATE")
+                    result = fn(conn.cursor(), *args)
+                    conn.commit()
+                    return result
+            except sqlite3.OperationalError as e:
+                if not _is_busy(e) or attempt == WRITE_RETRY_ATTEMPTS - 1:
+                    raise
+            time.sleep(delay * random.uniform(0.5, 1.5))
+            delay *= 2
+
+    def _write_invoice(self, cursor, customer_id, invoice_date, cart):
+        total_amount = sum(item["price"] * item["quantity"] for item in cart.values())
+        cursor.execute("INSERT INTO invoices (customer_id, date, total_amount) VALUES (?, ?, ?)",
+                       (customer_id, invoice_date, total_amount))
+        invoice_id = cursor.lastrowid
+
+        cursor.executemany(INSERT_INVOICE_ITEM, [
+            (invoice_id, pid, item["name"], item["price"], item["quantity"], item["price"] * item["quantity"])
+            for pid, item in cart.items()
+        ])
+        return invoice_id
+
+    def _sold_quantities(self, carts):
+        sold = {}
+        for cart in carts:
+            for pid, item in cart.items():
+                sold[pid] = sold.get(pid, 0) + item["quantity"]
+        return sold
+
+    def _reserve_stock(self, cursor, sold):
+        updated = {row[0] for row in cursor.execute(SUBTRACT_SOLD_STOCK, (json.dumps(list(sold.items())),))}
+        if len(updated) == len(sold):
+            return
+
+        # Rows that failed the stock check were not touched, so their
+        # current stock is what was available to this transaction.
+        shortages = []
+        for pid, requested in sold.items():
+            if pid in updated:
+                continue
+            row = cursor.execute("SELECT stock FROM products WHERE product_id = ?", (pid,)).fetchone()
+            shortages.append((pid, requested, row[0] if row else None))
+        raise StockError(shortages)
+
+    def create_invoice(self, customer_id, cart):
+        invoice_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        def write(cursor):
+            # Stock is reserved before the lines are written, so a product
+            # deleted meanwhile is reported as a shortage, not a key error.
+            self._reserve_stock(cursor, self._sold_quantities([cart]))
+            return self._write_invoice(cursor, customer_id, invoice_date, cart)
+
+        return self.write_transaction(write)
+
+    def create_invoices(self, invoices, batch_size=INVOICE_BATCH_SIZE):
+        # invoices yields (customer_id, cart) or (customer_id, cart, date).
+        # Each batch is one transaction with a single stock update; a batch
+        # that would oversell any product is rolled back with a StockError.
+        invoice_ids = []
+        started = time.perf_counter()
+        batch = []
+
+        def write(cursor):
+            self._reserve_stock(cursor, self._sold_quantities(entry[1] for entry in batch))
+            ids = []
+            for entry in batch:
+                customer_id, cart = entry[0], entry[1]
+                invoice_date = entry[2] if len(entry) > 2 else datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                ids.append(self._write_invoice(cursor, customer_id, invoice_date, cart))
+            return ids
+
+        for entry in invoices:
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                invoice_ids.extend(self.write_transaction(write))
+                batch.clear()
+        if batch:
+            invoice_ids.extend(self.write_transaction(write))
+
+        elapsed = time.perf_counter() - started
+        return {
+            "invoice_ids": invoice_ids,
+            "seconds": elapsed,
+            "invoices_per_second": len(invoice_ids) / elapsed if elapsed else 0.0,
+        }
+
+    def delete_invoice(self, invoice_id):
+        def write(cursor):
+            cursor.execute(RESTORE_INVOICE_STOCK, (invoice_id,))
+            cursor.execute("DELETE FROM invoices WHERE invoice_id = ?", (invoice_id,))
+
+        self.write_transaction(write)
+
+    def invoice_page(self, key, limit, newer=False):
+        # Keyset paging over the hot tables and the archive partitions. The
+        # hot tables come first; partitions are read one at a time, nearest
+        # year first, only while they could still hold rows for this page.
+        query = NEWER_INVOICE_PAGE_QUERY if newer else INVOICE_PAGE_QUERY
+        rows = list(self.run_query(query, key + (limit,)))
+        year = int(key[0][:4]) if key[0][:4].isdigit() else 9999
+        years = self.archived_years()
+        years = [y for y in years if y >= year] if newer else [y for y in reversed(years) if y <= year]
+        for archived in years:
+            if len(rows) >= limit:
+                last = int(rows[-1]["date"][:4])
+                if (last < archived) if newer else (last > archived):
+                    break
+            with self.get_conn() as conn, self.route(conn, years=(archived,), hot=False):
+                rows.extend(conn.execute(query, key + (limit,)).fetchall())
+            rows.sort(key=lambda row: (row["date"], row["invoice_id"]), reverse=not newer)
+            del rows[limit:]
+        return rows
+
+    def archived_rows(self, query, params=(), years=None):
+        # Runs query against one archive partition at a time, newest first
+        # unless years says otherwise, and returns the first rows found.
+        for year in reversed(self.archived_years()) if years is None else years:
+            with self.get_conn() as conn, self.route(conn, years=(year,), hot=False) as found:
+                rows = conn.execute(query, params).fetchall() if found else []
+            if rows:
+                return rows
+        return []
+
+    def invoice_lines(self, invoice_id, invoice_date=None):
+        rows = self.run_query(INVOICE_LINES_QUERY, (invoice_id,))
+        if rows:
+            return rows
+        return self.archived_rows(INVOICE_LINES_QUERY, (invoice_id,),
+                                  [int(invoice_date[:4])] if invoice_date else None)
+
+    def export_query(self, query, params, path, compress=True, progress=None, batch_size=EXPORT_BATCH_SIZE,
+                     route=None):
+        # Rows go from the cursor to the file one batch at a time, so memory
+        # use does not grow with the size of the export. The file is written
+        # under a temporary name and only renamed into place when complete.
+        # route, given a connection, returns the context to read it under.
+        fmt = export_format(path)
+        temp_path = path + ".part"
+        started = time.perf_counter()
+        rows = 0
+        try:
+            with self.get_conn() as conn, (route or self.route)(conn), _open_export(temp_path, fmt) as f:
+                conn.execute("BEGIN")
+                cursor = conn.execute(query, params)
+                columns = [description[0] for description in cursor.description]
+                if fmt == "csv":
+                    writer = csv.writer(f)
+                    writer.writerow(columns)
+                else:
+                    writer = ColumnarWriter(f, columns, compress)
+                while True:
+                    batch = cursor.fetchmany(batch_size)
+                    if not batch:
+                        break
+                    writer.writerows(batch)
+                    rows += len(batch)
+                    if _interrupt_if_cancelled():
+                        raise QueryCancelled()
+                    if progress is not None:
+                        progress({"rows": rows, "seconds": time.perf_counter() - started})
+                if fmt != "csv":
+                    writer.close()
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        seconds = time.perf_counter() - started
+        return {"rows": rows, "seconds": seconds, "bytes": os.path.getsize(path),
+                "rows_per_second": rows / seconds if seconds else 0.0}
+
+    def export_table(self, name, path, compress=True, progress=None):
+        return self.export_query(EXPORT_QUERIES[name], (), path, compress, progress)
+
+    def export_report(self, number, param, path, compress=True, progress=None):
+        report = get_report(number)
+        params = report.bind(param)
+        return self.export_query(report.sql, params, path, compress, progress,
+                                 route=lambda conn: self._report_route(conn, report, params))
+
+    def checkpoint(self, mode="PASSIVE"):
+        with self.get_conn() as conn:
+            return tuple(conn.execute(f"PRAGMA wal_checkpoint({mode});").fetchone())
+
+    def _checkpoint_loop(self, interval):
+        while not self._stop_background.wait(interval):
+            try:
+                self.checkpoint()
+            except sqlite3.Error:
+                pass
+
+    def backup(self, **options):
+        # One snapshot at a time; a scheduled one and one asked for from the
+        # window would otherwise race on the rotation.
+        with self._backup_lock:
+            self.last_backup = SnapshotManager(self, self.backup_dir, **options).run()
+        return self.last_backup
+
+    def _backup_loop(self, interval):
+        while not self._stop_background.wait(interval):
+            try:
+                self.backup()
+            except (OSError, sqlite3.Error) as e:
+                self.last_backup = {"error": str(e)}
+
+    def connection_stats(self):
+        return self.pool.stats()
+
+    def close(self):
+        self._stop_background.set()
+        self.executor.shutdown()
+        if self._process_pool is not None:
+            self._process_pool.shutdown(cancel_futures=True)
+        try:
+            with self.get_conn() as conn:
+                conn.execute("PRAGMA optimize;")
+            self.checkpoint("TRUNCATE")
+        except sqlite3.Error:
+            pass
+        self.pool.close()
+
+INVOICE_PAGE_QUERY = """
+    SELECT i.invoice_id, c.name, i.date, i.total_amount
+    FROM invoices i
+    JOIN customers c ON i.customer_id = c.customer_id
+    WHERE (i.date, i.invoice_id) < (?, ?)
+    ORDER BY i.date DESC, i.invoice_id DESC
+    LIMIT ?
+"""
+
+NEWER_INVOICE_PAGE_QUERY = """
+    SELECT i.invoice_id, c.name, i.date, i.total_amount
+    FROM invoices i
+    JOIN customers c ON i.customer_id = c.customer_id
+    WHERE (i.date, i.invoice_id) > (?, ?)
+    ORDER BY i.date ASC, i.invoice_id ASC
+    LIMIT ?
+"""
+
+INVOICE_LINES_QUERY = """
+    SELECT item_id, product_id, product_name, unit_price, quantity, subtotal
+    FROM invoice_items WHERE invoice_id = ?
+"""
+
+class ValidationError(ValueError):
+    pass
+
+class NotFound(LookupError):
+    pass
+
+def _field(value):
+    return "" if value is None else str(value).strip()
+
+def format_toman(rials):
+    if rials is None:
+        return ""
+    if rials % RIALS_PER_TOMAN:
+        return f"{rials / RIALS_PER_TOMAN:,.1f}"
+    return f"{rials // RIALS_PER_TOMAN:,}"
+
+def parse_toman(text):
+    # Tomans as typed in a window, to whole rials; None when left empty.
+    text = _field(text).replace(",", "").replace("٫", ".")
+    if not text:
+        return None
+    try:
+        rials = Decimal(text) * RIALS_PER_TOMAN
+    except InvalidOperation:
+        raise ValidationError("قیمت باید عدد باشد.")
+    if not rials.is_finite():
+        raise ValidationError("قیمت باید عدد باشد.")
+    if rials != rials.to_integral_value():
+        raise ValidationError("قیمت را حداکثر با یک رقم اعشار وارد کنید.")
+    return int(rials)
+
+EXPORT_QUERIES = {
+    "invoices": """
+        SELECT i.invoice_id, i.date, i.customer_id, c.name AS customer_name, i.total_amount
+        FROM invoices i
+        JOIN customers c ON i.customer_id = c.customer_id
+        ORDER BY i.date, i.invoice_id
+    """,
+    "items": """
+        SELECT ii.item_id, ii.invoice_id, i.date, i.customer_id, ii.product_id, ii.product_name,
+               ii.unit_price, ii.quantity, ii.subtotal
+        FROM invoice_items ii
+        JOIN invoices i ON ii.invoice_id = i.invoice_id
+        ORDER BY ii.invoice_id, ii.item_id
+    """,
+}
+
+# Columnar export layout, all integers little-endian:
+#   magic, u8 compression (0 none, 1 zlib), u32 column count,
+#   per column u16 name length + UTF-8 name;
+#   row groups of u32 row count followed, per column, by u8 type (with
+#   COLUMN_HAS_NULLS set when a validity bitmap leads the data), u32 data
+#   length and the data, zlib-compressed when enabled;
+#   a u32 zero row count and u64 total rows as the trailer.
+COLUMNAR_MAGIC = b"STCOL1\n"
+COLUMNAR_ROW_GROUP = 65536
+COLUMN_NULL, COLUMN_INTEGER, COLUMN_REAL, COLUMN_TEXT, COLUMN_BLOB = range(5)
+COLUMN_HAS_NULLS = 0x80
+
+def _little_endian(values):
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+def _encode_column(values):
+    present = [value for value in values if value is not None]
+    kinds = {type(value) for value in present}
+    if not present:
+        return COLUMN_NULL, b""
+
+    bitmap = b""
+    nulls = 0
+    if len(present) != len(values):
+        nulls = COLUMN_HAS_NULLS
+        bits = bytearray((len(values) + 7) // 8)
+        for i, value in enumerate(values):
+            if value is not None:
+                bits[i >> 3] |= 1 << (i & 7)
+        bitmap = bytes(bits)
+
+    if kinds <= {int}:
+        try:
+            return COLUMN_INTEGER | nulls, bitmap + _little_endian(array("q", (0 if v is None else v for v in values)))
+        except OverflowError:
+            kinds = {str}
+    if kinds <= {int, float}:
+        return COLUMN_REAL | nulls, bitmap + _little_endian(array("d", (0.0 if v is None else v for v in values)))
+
+    if kinds <= {bytes}:
+        kind, chunks = COLUMN_BLOB, [b"" if v is None else v for v in values]
+    else:
+        kind, chunks = COLUMN_TEXT, [b"" if v is None else str(v).encode("utf-8") for v in values]
+    offsets = array("I", [0])
+    total = 0
+    for chunk in chunks:
+        total += len(chunk)
+        offsets.append(total)
+    return kind | nulls, bitmap + _little_endian(offsets) + b"".join(chunks)
+
+class ColumnarWriter:
+    def __init__(self, f, columns, compress=True, row_group=COLUMNAR_ROW_GROUP):
+        self.f = f
+        self.columns = list(columns)
+        self.compress = compress
+        self.row_group = row_group
+        self.pending = []
+        self.rows = 0
+        f.write(COLUMNAR_MAGIC + struct.pack("<BI", 1 if compress else 0, len(self.columns)))
+        for name in self.columns:
+            encoded = name.encode("utf-8")
+            f.write(struct.pack("<H", len(encoded)) + encoded)
+
+    # Named after csv.writer.writerows so either writer can be fed batches.
+    def writerows(self, rows):
+        self.pending.extend(rows)
+        while len(self.pending) >= self.row_group:
+            self._write_group(self.pending[:self.row_group])
+            del self.pending[:self.row_group]
+
+    def _write_group(self, rows):
+        self.f.write(struct.pack("<I", len(rows)))
+        for i in range(len(self.columns)):
+            kind, data = _encode_column([row[i] for row in rows])
+            if self.compress:
+                data = zlib.compress(data, 6)
+            self.f.write(struct.pack("<BI", kind, len(data)) + data)
+        self.rows += len(rows)
+
+    def close(self):
+        if self.pending:
+            self._write_group(self.pending)
+            self.pending = []
+        self.f.write(struct.pack("<IQ", 0, self.rows))
+
+class ColumnarReader:
+    def __init__(self, f):
+        self.f = f
+        if f.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+            raise ValueError("not a columnar export file")
+        self.compressed, count = struct.unpack("<BI", f.read(5))
+        self.columns = []
+        for _ in range(count):
+            (length,) = struct.unpack("<H", f.read(2))
+            self.columns.append(f.read(length).decode("utf-8"))
+
+    def _decode_column(self, kind, data, count):
+        values = [None] * count
+        bitmap = None
+        if kind & COLUMN_HAS_NULLS:
+            size = (count + 7) // 8
+            bitmap, data = data[:size], data[size:]
+        kind &= ~COLUMN_HAS_NULLS
+        if kind == COLUMN_INTEGER or kind == COLUMN_REAL:
+            values = array("q" if kind == COLUMN_INTEGER else "d")
+            values.frombytes(data)
+            if sys.byteorder == "big":
+                values.byteswap()
+            values = list(values)
+        elif kind in (COLUMN_TEXT, COLUMN_BLOB):
+            offsets = array("I")
+            offsets.frombytes(data[:4 * (count + 1)])
+            if sys.byteorder == "big":
+                offsets.byteswap()
+            blob = data[4 * (count + 1):]
+            values = [blob[offsets[i]:offsets[i + 1]] for i in range(count)]
+            if kind == COLUMN_TEXT:
+                values = [value.decode("utf-8") for value in values]
+        if bitmap is not None:
+            values = [value if bitmap[i >> 3] >> (i & 7) & 1 else None for i, value in enumerate(values)]
+        return values
+
+    def __iter__(self):
+        while True:
+            (count,) = struct.unpack("<I", self.f.read(4))
+            if count == 0:
+                return
+            columns = []
+            for _ in self.columns:
+                kind, length = struct.unpack("<BI", self.f.read(5))
+                data = self.f.read(length)
+                if self.compressed:
+                    data = zlib.decompress(data)
+                columns.append(self._decode_column(kind, data, count))
+            yield from zip(*columns)
+
+def export_format(path):
+    return "csv" if path.lower().endswith(".csv") else "columnar"
+
+def _open_export(path, fmt):
+    if fmt == "csv":
+        # The BOM lets spreadsheet programs detect UTF-8 Persian text.
+        return open(path, "w", newline="", encoding="utf-8-sig")
+    return open(path, "wb")
+
+class StoreService:
+    # The store operations without any Tk code, shared by the windows, the
+    # HTTP server and the command line.
+    def __init__(self, db):
+        self.db = db
+
+    @staticmethod
+    def customer_fields(name, phone, address):
+        name, phone, address = _field(name), _field(phone), _field(address)
+        if not name:
+            raise ValidationError("فیلد نام نمی‌تواند خالی باشد.")
+        return name, phone, address
+
+    @staticmethod
+    def product_fields(name, price, stock):
+        name, price, stock = _field(name), _field(price), _field(stock)
+        if not name or not price or not stock:
+            raise ValidationError("تمام فیلدها باید پر شوند.")
+        try:
+            # Prices are whole rials here; the windows convert from tomans.
+            price, stock = int(price), int(stock)
+        except ValueError:
+            raise ValidationError("قیمت و موجودی باید عدد باشند.")
+        if price < 0:
+            raise ValidationError("قیمت نمی‌تواند منفی باشد.")
+        return name, price, stock
+
+    def _one(self, query, params, what):
+        rows = self.db.run_query(query, params)
+        if not rows:
+            raise NotFound(f"{what} not found")
+        return rows[0]
+
+    def _change(self, query, params, what):
+        with self.db.get_conn() as conn:
+            cursor = conn.execute(query, params)
+            conn.commit()
+        if cursor.rowcount == 0:
+            raise NotFound(f"{what} not found")
+
+    def list_customers(self, term="", limit=SEARCH_LIMIT):
+        if term.strip():
+            return self.db.search_customers(term, limit)
+        return self.db.run_query("SELECT * FROM customers ORDER BY name LIMIT ?", (limit,))
+
+    def get_customer(self, customer_id):
+        return self._one("SELECT * FROM customers WHERE customer_id = ?", (customer_id,), "customer")
+
+    def add_customer(self, name, phone, address):
+        return self.db.run_query("INSERT INTO customers (name, phone, address) VALUES (?, ?, ?)",
+                                 self.customer_fields(name, phone, address), commit=True)
+
+    def update_customer(self, customer_id, name, phone, address):
+        self._change("UPDATE customers SET name=?, phone=?, address=? WHERE customer_id=?",
+                     self.customer_fields(name, phone, address) + (customer_id,), "customer")
+
+    def delete_customer(self, customer_id):
+        self._change("DELETE FROM customers WHERE customer_id=?", (customer_id,), "customer")
+
+    def list_products(self, term="", limit=SEARCH_LIMIT):
+        if term.strip():
+            return self.db.search_products(term, limit)
+        return self.db.run_query("SELECT * FROM products ORDER BY name LIMIT ?", (limit,))
+
+    def get_product(self, product_id):
+        return self._one("SELECT * FROM products WHERE product_id = ?", (product_id,), "product")
+
+    def add_product(self, name, price, stock):
+        return self.db.run_query("INSERT INTO products (name, price, stock) VALUES (?, ?, ?)",
+                                 self.product_fields(name, price, stock), commit=True)
+
+    def update_product(self, product_id, name, price, stock):
+        self._change("UPDATE products SET name=?, price=?, stock=? WHERE product_id=?",
+                     self.product_fields(name, price, stock) + (product_id,), "product")
+
+    def delete_product(self, product_id):
+        self._change("DELETE FROM products WHERE product_id=?", (product_id,), "product")
+
+    def list_invoices(self, before_date=None, before_id=None, limit=100):
+        # Keyset paging, newest first; pass the last row's date and id to
+        # get the next page.
+        if before_date is None:
+            before_date, before_id = "9999-12-31", 0
+        elif before_id is None:
+            before_id = 0
+        return self.db.invoice_page((before_date, before_id), limit)
+
+    def get_invoice(self, invoice_id):
+        query = """
+            SELECT i.invoice_id, i.customer_id, c.name, i.date, i.total_amount
+            FROM invoices i
+            JOIN customers c ON i.customer_id = c.customer_id
+            WHERE i.invoice_id = ?
+        """
+        rows = self.db.run_query(query, (invoice_id,)) or self.db.archived_rows(query, (invoice_id,))
+        if not rows:
+            raise NotFound("invoice not found")
+        return rows[0], self.db.invoice_lines(invoice_id, rows[0]["date"])
+
+    def create_invoice(self, customer_id, quantities):
+        # quantities maps product_id to quantity. Names and prices come from
+        # the products table rather than from the caller.
+        lines = {}
+        for pid, quantity in dict(quantities).items():
+            try:
+                pid, quantity = int(pid), int(quantity)
+            except (TypeError, ValueError):
+                raise ValidationError("تعداد باید یک عدد صحیح مثبت باشد.")
+            if quantity <= 0:
+                raise ValidationError("تعداد باید یک عدد صحیح مثبت باشد.")
+            lines[pid] = lines.get(pid, 0) + quantity
+        if not lines:
+            raise ValidationError("سبد خرید خالی است.")
+
+        products = self.db.run_query(
+            "SELECT product_id, name, price FROM products WHERE product_id IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(lines)),))
+        found = {row["product_id"]: row for row in products}
+        missing = [pid for pid in lines if pid not in found]
+        if missing:
+            raise NotFound(f"product not found: {', '.join(map(str, missing))}")
+
+        cart = {pid: {"name": found[pid]["name"], "price": found[pid]["price"], "quantity": quantity}
+                for pid, quantity in lines.items()}
+        return self.db.create_invoice(int(customer_id), cart)
+
+    def delete_invoice(self, invoice_id):
+        query = "SELECT invoice_id FROM invoices WHERE invoice_id = ?"
+        if not self.db.run_query(query, (invoice_id,)):
+            if self.db.archived_rows(query, (invoice_id,)):
+                raise ValidationError("فاکتورهای بایگانی‌شده قابل حذف نیستند.")
+            raise NotFound("invoice not found")
+        self.db.delete_invoice(invoice_id)
+
+    def list_reports(self):
+        return [{"number": report.number, "title": report.title, "columns": list(report.columns)}
+                for report in REPORTS]
+
+    def run_report(self, number, param=""):
+        return self.db.run_report(number, param)
+
+class LatencyMetrics:
+    def __init__(self, window=1024):
+        self.window = window
+        self.routes = {}
+
+    def record(self, route, status, seconds):
+        entry = self.routes.get(route)
+        if entry is None:
+            entry = self.routes[route] = {"count": 0, "errors": 0, "total": 0.0, "max": 0.0,
+                                          "samples": deque(maxlen=self.window)}
+        entry["count"] += 1
+        if status >= 500:
+            entry["errors"] += 1
+        entry["total"] += seconds
+        entry["max"] = max(entry["max"], seconds)
+        entry["samples"].append(seconds)
+
+    def snapshot(self):
+        result = {}
+        for route, entry in self.routes.items():
+            samples = sorted(entry["samples"])
+
+            def percentile(p):
+                return samples[min(len(samples) - 1, int(p * len(samples)))] * 1000
+
+            result[route] = {
+                "count": entry["count"],
+                "errors": entry["errors"],
+                "mean_ms": entry["total"] / entry["count"] * 1000,
+                "p50_ms": percentile(0.50),
+                "p95_ms": percentile(0.95),
+                "p99_ms": percentile(0.99),
+                "max_ms": entry["max"] * 1000,
+            }
+        return result
+
+HTTP_REASONS = {200: "OK", 201: "Created", 204: "No Content", 400: "Bad Request", 404: "Not Found",
+                405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+                500: "Internal Server Error"}
+
+class StoreServer:
+    MAX_BODY = 1024 * 1024
+
+    def __init__(self, service, host="127.0.0.1", port=8080):
+        self.service = service
+        self.db = service.db
+        self.host = host
+        self.port = port
+        self.metrics = LatencyMetrics()
+        self.server = None
+        self.write_queue = None
+        self.writer_task = None
+        # SQLite allows one writer at a time, so every write goes through one
+        # queue and one thread instead of contending for the lock.
+        self.write_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="store-writer",
+                                               initializer=setattr, initargs=(_task_state, "screen", "http"))
+        self.routes = [
+            ("GET", r"/customers", self.list_customers),
+            ("POST", r"/customers", self.add_customer),
+            ("GET", r"/customers/(\d+)", self.get_customer),
+            ("PUT", r"/customers/(\d+)", self.update_customer),
+            ("DELETE", r"/customers/(\d+)", self.delete_customer),
+            ("GET", r"/products", self.list_products),
+            ("POST", r"/products", self.add_product),
+            ("GET", r"/products/(\d+)", self.get_product),
+            ("PUT", r"/products/(\d+)", self.update_product),
+            ("DELETE", r"/products/(\d+)", self.delete_product),
+            ("GET", r"/invoices", self.list_invoices),
+            ("POST", r"/invoices", self.create_invoice),
+            ("GET", r"/invoices/(\d+)", self.get_invoice),
+            ("DELETE", r"/invoices/(\d+)", self.delete_invoice),
+            ("GET", r"/reports", self.list_reports),
+            ("GET", r"/reports/(\d+)", self.run_report),
+            ("GET", r"/metrics", self.get_metrics),
+        ]
+        self.routes = [(method, re.compile(pattern + "$"), pattern, handler)
+                       for method, pattern, handler in self.routes]
+
+    async def start(self):
+        self.write_queue = asyncio.Queue()
+        self.writer_task = asyncio.create_task(self.run_writes())
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        return self.server
+
+    async def serve_forever(self):
+        server = await self.start()
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        if self.writer_task is not None:
+            self.writer_task.cancel()
+        self.write_thread.shutdown(wait=True)
+
+    async def read(self, fn, *args):
+        return await asyncio.wrap_future(self.db.submit_for("http", fn, *args).future)
+
+    async def write(self, fn, *args):
+        future = asyncio.get_running_loop().create_future()
+        await self.write_queue.put((fn, args, future))
+        return await future
+
+    async def run_writes(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            fn, args, future = await self.write_queue.get()
+            try:
+                result = await loop.run_in_executor(self.write_thread, fn, *args)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self.send(writer, 400, {"error": "malformed request line"}, False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self.send(writer, 400, {"error": "invalid Content-Length"}, False)
+                    break
+                if length > self.MAX_BODY:
+                    await self.send(writer, 413, {"error": "request body too large"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                started = time.perf_counter()
+                route, status, payload = await self.dispatch(method, target, body)
+                self.metrics.record(route, status, time.perf_counter() - started)
+                await self.send(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def send(self, writer, status, payload, keep_alive):
+        body = b"" if payload is None else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        head = [
+            f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}",
+            "Content-Type: application/json; charset=utf-8",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        matched = None
+        for route_method, regex, pattern, handler in self.routes:
+            match = regex.match(url.path)
+            if not match:
+                continue
+            matched = pattern
+            if route_method != method:
+                continue
+            route = f"{method} {pattern}"
+            try:
+                data = json.loads(body) if body else {}
+                if not isinstance(data, dict):
+                    raise ValidationError("request body must be a JSON object")
+                status, payload = await handler(*match.groups(), query=query, data=data)
+            except ValidationError as e:
+                status, payload = 400, {"error": str(e)}
+            except NotFound as e:
+                status, payload = 404, {"error": str(e)}
+            except StockError as e:
+                status, payload = 409, {"error": "insufficient stock", "shortages": [
+                    {"product_id": pid, "requested": requested, "available": available}
+                    for pid, requested, available in e.shortages]}
+            except sqlite3.IntegrityError as e:
+                status, payload = 409, {"error": str(e)}
+            except ValueError as e:
+                status, payload = 400, {"error": str(e)}
+            except Exception as e:
+                status, payload = 500, {"error": str(e)}
+            return route, status, payload
+        if matched is not None:
+            return f"{method} {matched}", 405, {"error": "method not allowed"}
+        return "unmatched", 404, {"error": "no such endpoint"}
+
+    def rows(self, rows):
+        return [dict(row) for row in rows]
+
+    def limit(self, query, default, cap):
+        # LIMIT -1 would mean no limit at all to SQLite.
+        return max(1, min(int(query.get("limit", default)), cap))
+
+    async def list_customers(self, query, data):
+        limit = self.limit(query, SEARCH_LIMIT, SEARCH_LIMIT)
+        return 200, self.rows(await self.read(self.service.list_customers, query.get("q", ""), limit))
+
+    async def get_customer(self, customer_id, query, data):
+        return 200, dict(await self.read(self.service.get_customer, int(customer_id)))
+
+    async def add_customer(self, query, data):
+        customer_id = await self.write(self.service.add_customer,
+                                       data.get("name"), data.get("phone"), data.get("address"))
+        return 201, {"customer_id": customer_id}
+
+    async def update_customer(self, customer_id, query, data):
+        await self.write(self.service.update_customer, int(customer_id),
+                         data.get("name"), data.get("phone"), data.get("address"))
+        return 200, {"customer_id": int(customer_id)}
+
+    async def delete_customer(self, customer_id, query, data):
+        await self.write(self.service.delete_customer, int(customer_id))
+        return 204, None
+
+    async def list_products(self, query, data):
+        limit = self.limit(query, SEARCH_LIMIT, SEARCH_LIMIT)
+        return 200, self.rows(await self.read(self.service.list_products, query.get("q", ""), limit))
+
+    async def get_product(self, product_id, query, data):
+        return 200, dict(await self.read(self.service.get_product, int(product_id)))
+
+    async def add_product(self, query, data):
+        product_id = await self.write(self.service.add_product,
+                                      data.get("name"), data.get("price"), data.get("stock"))
+        return 201, {"product_id": product_id}
+
+    async def update_product(self, product_id, query, data):
+        await self.write(self.service.update_product, int(product_id),
+                         data.get("name"), data.get("price"), data.get("stock"))
+        return 200, {"product_id": int(product_id)}
+
+    async def delete_product(self, product_id, query, data):
+        await self.write(self.service.delete_product, int(product_id))
+        return 204, None
+
+    async def list_invoices(self, query, data):
+        limit = self.limit(query, 100, 1000)
+        before_id = int(query["before_id"]) if "before_id" in query else None
+        return 200, self.rows(await self.read(self.service.list_invoices,
+                                              query.get("before_date"), before_id, limit))
+
+    async def get_invoice(self, invoice_id, query, data):
+        invoice, items = await self.read(self.service.get_invoice, int(invoice_id))
+        return 200, dict(invoice, items=self.rows(items))
+
+    async def create_invoice(self, query, data):
+        items = data.get("items", [])
+        if not isinstance(items, list) or not all(
+                isinstance(line, dict) and isinstance(line.get("product_id"), (int, str)) and "quantity" in line
+                for line in items):
+            raise ValidationError("items must be a list of objects with product_id and quantity")
+        quantities = {line["product_id"]: line["quantity"] for line in items}
+        invoice_id = await self.write(self.service.create_invoice, data.get("customer_id"), quantities)
+        return 201, {"invoice_id": invoice_id}
+
+    async def delete_invoice(self, invoice_id, query, data):
+        await self.write(self.service.delete_invoice, int(invoice_id))
+        return 204, None
+
+    async def list_reports(self, query, data):
+        return 200, self.service.list_reports()
+
+    async def run_report(self, number, query, data):
+        columns, rows = await self.read(self.service.run_report, int(number), query.get("param", ""))
+        return 200, {"columns": list(columns), "rows": [list(row) for row in rows]}
+
+    async def get_metrics(self, query, data):
+        return 200, {
+            "routes": self.metrics.snapshot(),
+            "write_queue": self.write_queue.qsize(),
+            "pool": self.db.connection_stats(),
+            "report_cache": self.db.report_cache.stats(),
+            "queries": self.db.profiler.snapshot(),
+        }
+
+IMPORT_KINDS = {
+    "customers": ("customers",),
+    "products": ("products",),
+    "invoices": ("invoices", "invoice_items"),
+}
+IMPORT_CHUNK_SIZE = 10000
+IMPORT_READ_SIZE = 1024 * 1024
+IMPORT_MAX_ERRORS = 20
+IMPORT_KEPT_INDEXES = ("idx_invoice_items_invoice",)
+
+def _import_key(record):
+    return {str(key).strip().lower(): value for key, value in record.items() if key is not None}
+
+def _iter_json_array(f):
+    # Decodes one record at a time, so a large array never has to be held in
+    # memory as a whole.
+    decoder = json.JSONDecoder()
+    buffer = f.read(IMPORT_READ_SIZE).lstrip()
+    if not buffer.startswith("["):
+        raise ValueError("a .json import file must contain an array of records")
+    pos = 1
+    while True:
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos == len(buffer):
+            more = f.read(IMPORT_READ_SIZE)
+            if not more:
+                raise ValueError("unterminated JSON array")
+            buffer, pos = more, 0
+            continue
+        if buffer[pos] == "]":
+            return
+        try:
+            record, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            more = f.read(IMPORT_READ_SIZE)
+            if not more:
+                raise
+            buffer, pos = buffer[pos:] + more, 0
+            continue
+        yield record
+        pos = end
+
+def iter_import_records(path):
+    lower = path.lower()
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if lower.endswith(".csv"):
+            for record in csv.DictReader(f):
+                yield _import_key(record)
+        elif lower.endswith((".jsonl", ".ndjson")):
+            for line in f:
+                if line.strip():
+                    yield _import_key(json.loads(line))
+        elif lower.endswith(".json"):
+            for record in _iter_json_array(f):
+                yield _import_key(record)
+        else:
+            raise ValueError(f"unsupported import file: {path} (use .csv, .json or .jsonl)")
+
+def _import_date(value):
+    value = _field(value)
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            pass
+    raise ValidationError(f"invalid date: {value!r}")
+
+class BulkImporter:
+    # Loads customers, products or historical invoices from CSV/JSON files.
+    #
+    # Secondary indexes on the target tables are dropped for the duration of
+    # the import and recreated once at the end, even when it fails. The
+    # triggers stay, so the store can be used meanwhile with its summaries,
+    # search indexes and versions current, and so does the invoice_id index
+    # that invoice deletes need. The definitions are kept in import_deferred,
+    # so one left behind by a killed process is put back on the next start.
+    # Progress is committed with every chunk in
+    # import_jobs, and running the same file again resumes after the last
+    # committed chunk. Historical invoices do not change product stock.
+    def __init__(self, db, chunk_size=IMPORT_CHUNK_SIZE, update=False, progress=None):
+        self.db = db
+        self.chunk_size = chunk_size
+        self.update = update
+        self.progress = progress
+
+    def run(self, kind, path, restart=False):
+        if kind not in IMPORT_KINDS:
+            raise ValueError(f"unknown import kind: {kind}")
+        started = time.perf_counter()
+        records = iter_import_records(path)
+        job_id, resumed_from = self._start_job(kind, path, restart)
+        self.stats = {"kind": kind, "rows": resumed_from, "resumed_from": resumed_from,
+                      "written": 0, "skipped": 0, "rejected": 0, "errors": []}
+
+        def report():
+            self.stats["seconds"] = time.perf_counter() - started
+            done = self.stats["rows"] - resumed_from
+            self.stats["rows_per_second"] = done / self.stats["seconds"] if self.stats["seconds"] else 0.0
+            if self.progress is not None:
+                self.progress(dict(self.stats))
+
+        self.defer_objects(IMPORT_KINDS[kind])
+        try:
+            if kind == "invoices":
+                self._load_maps()
+            for chunk, consumed in self._chunks(kind, islice(records, resumed_from, None)):
+                rows_done = self.stats["rows"] + consumed
+                written, skipped, errors = self.db.write_transaction(self._write_chunk, kind, chunk, job_id, rows_done)
+                self.stats["rows"] = rows_done
+                self.stats["written"] += written
+                self.stats["skipped"] += skipped
+                self.stats["rejected"] += len(errors)
+                self.stats["errors"].extend(errors[:IMPORT_MAX_ERRORS - len(self.stats["errors"])])
+                report()
+
+            self.db.run_query("UPDATE import_jobs SET status = 'done', finished = ? WHERE job_id = ?",
+                              (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), job_id), commit=True)
+        finally:
+            self.restore_deferred()
+        report()
+        return self.stats
+
+    def _start_job(self, kind, path, restart):
+        source = os.path.abspath(path)
+        size = os.path.getsize(path)
+
+        def write(cursor):
+            row = cursor.execute("""
+                SELECT job_id, rows_done FROM import_jobs
+                WHERE kind = ? AND source = ? AND source_size = ? AND status = 'running'
+                ORDER BY job_id DESC LIMIT 1
+            """, (kind, source, size)).fetchone()
+            if row is not None:
+                if not restart:
+                    return row[0], row[1]
+                cursor.execute("UPDATE import_jobs SET status = 'abandoned' WHERE job_id = ?", (row[0],))
+            cursor.execute("INSERT INTO import_jobs (kind, source, source_size, started) VALUES (?, ?, ?, ?)",
+                           (kind, source, size, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+            return cursor.lastrowid, 0
+
+        return self.db.write_transaction(write)
+
+    def defer_objects(self, tables):
+        self.db.write_transaction(defer_schema_objects, tables, False, IMPORT_KEPT_INDEXES)
+
+    def restore_deferred(self):
+        if self.db.write_transaction(restore_schema_objects):
+            with self.db.get_conn() as conn:
+                conn.execute("ANALYZE")
+
+    def _load_maps(self):
+        self.customers_by_phone = {}
+        self.customers_by_name = {}
+        for row in self.db.run_query("SELECT customer_id, name, phone FROM customers"):
+            if row["phone"]:
+                self.customers_by_phone[row["phone"]] = row["customer_id"]
+            # Names are not unique; an ambiguous name cannot be resolved.
+            if row["name"] in self.customers_by_name:
+                self.customers_by_name[row["name"]] = None
+            else:
+                self.customers_by_name[row["name"]] = row["customer_id"]
+        self.products_by_name = {row["name"]: (row["product_id"], row["price"])
+                                 for row in self.db.run_query("SELECT product_id, name, price FROM products")}
+
+    def _chunks(self, kind, records):
+        units = self._invoices(records) if kind == "invoices" else ((record, 1) for record in records)
+        chunk, consumed = [], 0
+        for unit, count in units:
+            chunk.append(unit)
+            consumed += count
+            if consumed >= self.chunk_size:
+                yield chunk, consumed
+                chunk, consumed = [], 0
+        if chunk:
+            yield chunk, consumed
+
+    def _invoices(self, records):
+        # A record is either a whole invoice with an "items" list, or one
+        # invoice line; lines of the same invoice must be adjacent and share
+        # an "invoice" reference.
+        current, ref, count = None, None, 0
+        for record in records:
+            if "items" in record:
+                if current is not None:
+                    yield current, count
+                    current, ref, count = None, None, 0
+                yield record, 1
+                continue
+            line_ref = _field(record.get("invoice"))
+            if current is not None and line_ref == ref:
+                current["items"].append(record)
+                count += 1
+                continue
+            if current is not None:
+                yield current, count
+            current = dict(record, items=[record])
+            ref, count = line_ref, 1
+        if current is not None:
+            yield current, count
+
+    def _write_chunk(self, cursor, kind, chunk, job_id, rows_done):
+        rows, errors = [], []
+        for record in chunk:
+            try:
+                rows.append(getattr(self, f"_{kind}_row")(record))
+            except (ValidationError, NotFound, ValueError, TypeError, KeyError) as e:
+                errors.append(f"{_field(record.get('invoice') or record.get('name'))}: {e}")
+
+        if kind == "customers":
+            conflict = "DO UPDATE SET name = excluded.name, address = excluded.address" if self.update else "DO NOTHING"
+            cursor.executemany(f"INSERT INTO customers (name, phone, address) VALUES (?, ?, ?) "
+                               f"ON CONFLICT (phone) {conflict}", rows)
+            written = cursor.rowcount
+        elif kind == "products":
+            conflict = "DO UPDATE SET price = excluded.price, stock = excluded.stock" if self.update else "DO NOTHING"
+            cursor.executemany(f"INSERT INTO products (name, price, stock) VALUES (?, ?, ?) "
+                               f"ON CONFLICT (name) {conflict}", rows)
+            written = cursor.rowcount
+        else:
+            next_id = cursor.execute("""
+                SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'invoices'), 0),
+                           COALESCE((SELECT MAX(invoice_id) FROM invoices), 0)) + 1
+            """).fetchone()[0]
+            invoices, items = [], []
+            for invoice_id, (customer_id, invoice_date, lines) in enumerate(rows, next_id):
+                invoices.append((invoice_id, customer_id, invoice_date, sum(line[-1] for line in lines)))
+                items.extend((invoice_id,) + line for line in lines)
+            cursor.executemany("INSERT INTO invoices (invoice_id, customer_id, date, total_amount) VALUES (?, ?, ?, ?)",
+                               invoices)
+            cursor.executemany(INSERT_INVOICE_ITEM, items)
+            written = len(invoices)
+
+        # Rows already present under a UNIQUE name or phone are skipped, or
+        # updated in place with update=True.
+        cursor.execute("UPDATE import_jobs SET rows_done = ? WHERE job_id = ?", (rows_done, job_id))
+        return written, len(rows) - written, errors
+
+    def _customers_row(self, record):
+        name, phone, address = StoreService.customer_fields(record.get("name"), record.get("phone"), record.get("address"))
+        return name, phone or None, address
+
+    def _products_row(self, record):
+        return StoreService.product_fields(record.get("name"), record.get("price"), record.get("stock"))
+
+    def _invoices_row(self, record):
+        phone = _field(record.get("customer_phone"))
+        if phone:
+            customer_id = self.customers_by_phone.get(phone)
+        else:
+            customer_id = self.customers_by_name.get(_field(record.get("customer_name")))
+        if customer_id is None:
+            raise NotFound("customer not found or ambiguous")
+
+        # One line per product, as StoreService.create_invoice writes them;
+        # the summaries count lines as sales of a product.
+        lines = {}
+        for item in record["items"]:
+            name = _field(item.get("product_name") or item.get("product"))
+            if name not in self.products_by_name:
+                raise NotFound(f"product not found: {name}")
+            product_id, price = self.products_by_name[name]
+            quantity = int(item["quantity"])
+            if quantity <= 0:
+                raise ValidationError("تعداد باید یک عدد صحیح مثبت باشد.")
+            # Unit prices in the file are whole rials, like the exports.
+            unit_price = int(_field(item["unit_price"])) if _field(item.get("unit_price")) else price
+            if product_id in lines:
+                if lines[product_id][2] != unit_price:
+                    raise ValidationError(f"کالای {name} با دو قیمت مختلف در فاکتور آمده است.")
+                quantity += lines[product_id][3]
+            lines[product_id] = (product_id, name, unit_price, quantity, unit_price * quantity)
+        if not lines:
+            raise ValidationError("سبد خرید خالی است.")
+        return customer_id, _import_date(record.get("date")), list(lines.values())
+
+ARCHIVE_HOT_YEARS = 2
+ARCHIVE_CHUNK = 50000
+ARCHIVE_TABLES = {
+    "invoices": "invoice_id, customer_id, date, total_amount, day",
+    "invoice_items": "item_id, invoice_id, product_id, product_name, unit_price, quantity, subtotal",
+}
+
+# Run with the archive file attached as {schema}. archive_batch ends every
+# index so that the batch filter of the routed views keeps them covering.
+ARCHIVE_PARTITION_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS {schema}.invoices (
+        invoice_id INTEGER PRIMARY KEY,
+        customer_id INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        total_amount INTEGER NOT NULL,
+        archive_batch INTEGER NOT NULL,
+        day INTEGER GENERATED ALWAYS AS (""" + INVOICE_DAY_SQL + """) VIRTUAL
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS {schema}.invoice_items (
+        item_id INTEGER PRIMARY KEY,
+        invoice_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        product_name TEXT NOT NULL,
+        unit_price INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        subtotal INTEGER NOT NULL,
+        archive_batch INTEGER NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_invoices_date ON invoices (date, archive_batch)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_invoices_day ON invoices (day, customer_id, total_amount, archive_batch)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_invoices_customer_date ON invoices (customer_id, date, total_amount, archive_batch)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_invoices_total ON invoices (total_amount, archive_batch)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_invoice_items_invoice ON invoice_items (invoice_id, archive_batch)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_invoice_items_product ON invoice_items "
+    "(product_id, quantity, subtotal, archive_batch)",
+]
+
+ARCHIVED_SALES_ADD = [
+    """
+    INSERT INTO archived_product_sales (product_id, product_name, total_quantity, total_revenue, line_count)
+    SELECT ii.product_id, ii.product_name, SUM(ii.quantity), SUM(ii.subtotal), COUNT(*)
+    FROM main.invoice_items ii
+    JOIN main.invoices i ON ii.invoice_id = i.invoice_id
+    WHERE i.day BETWEEN ? AND ?
+    GROUP BY ii.product_id, ii.product_name
+    ON CONFLICT (product_id, product_name) DO UPDATE SET
+        total_quantity = total_quantity + excluded.total_quantity,
+        total_revenue = total_revenue + excluded.total_revenue,
+        line_count = line_count + excluded.line_count""",
+    """
+    INSERT INTO archived_customer_sales (customer_id, total_spent, invoice_count, total_items)
+    SELECT i.customer_id, SUM(i.total_amount), COUNT(*),
+           COALESCE(SUM((SELECT SUM(quantity) FROM main.invoice_items ii WHERE ii.invoice_id = i.invoice_id)), 0)
+    FROM main.invoices i
+    WHERE i.day BETWEEN ? AND ?
+    GROUP BY i.customer_id
+    ON CONFLICT (customer_id) DO UPDATE SET
+        total_spent = total_spent + excluded.total_spent,
+        invoice_count = invoice_count + excluded.invoice_count,
+        total_items = total_items + excluded.total_items""",
+    """
+    INSERT INTO archived_daily_product_sales (sale_date, product_name, quantity, line_count)
+    SELECT substr(i.date, 1, 10), ii.product_name, SUM(ii.quantity), COUNT(*)
+    FROM main.invoice_items ii
+    JOIN main.invoices i ON ii.invoice_id = i.invoice_id
+    WHERE i.day BETWEEN ? AND ?
+    GROUP BY substr(i.date, 1, 10), ii.product_name
+    ON CONFLICT (sale_date, product_name) DO UPDATE SET
+        quantity = quantity + excluded.quantity,
+        line_count = line_count + excluded.line_count""",
+]
+
+class ArchiveMismatch(sqlite3.DatabaseError):
+    pass
+
+class InvoiceArchiver:
+    # Moves closed years of invoices out of the hot database into one file
+    # per year next to it (store.archive-2023.db), which is attached only
+    # when a query's date range reaches it (see Database.route).
+    #
+    # SQLite commits attached WAL databases one after the other, not
+    # atomically, so a year moves in two steps. The rows are first copied
+    # into the archive in short transactions under a new batch number.
+    # Then one transaction on the hot database checks the copy against the
+    # rows still there, deletes them, and registers the batch. Until that
+    # commits, readers ignore the new batch, and the next run discards it.
+    # Archived invoices are read-only; the sales summaries keep counting
+    # them through the archived_* tables.
+    def __init__(self, db, chunk_size=ARCHIVE_CHUNK, progress=None):
+        self.db = db
+        self.chunk_size = chunk_size
+        self.progress = progress
+
+    def closed_years(self, hot_years=ARCHIVE_HOT_YEARS):
+        # Years before the last hot_years that still have hot invoices, one
+        # index seek per year.
+        last = datetime.now().year - hot_years
+        years, start = [], ""
+        while True:
+            first = self.db.run_query("SELECT MIN(date) FROM invoices WHERE date >= ?", (start,))[0][0]
+            if first is None or int(first[:4]) > last:
+                return years
+            years.append(int(first[:4]))
+            start = f"{years[-1] + 1}-01-01"
+
+    def partitions(self):
+        return self.db.run_query("SELECT * FROM archive_partitions ORDER BY year")
+
+    def archive_year(self, year):
+        started = time.perf_counter()
+        days = (day_number(datetime(year, 1, 1)), day_number(datetime(year, 12, 31)))
+        name = f"{os.path.splitext(os.path.basename(self.db.db_file))[0]}.archive-{year}.db"
+
+        def register(cursor):
+            cursor.execute("INSERT INTO archive_partitions (year, path, first_day, last_day) VALUES (?, ?, ?, ?) "
+                           "ON CONFLICT (year) DO NOTHING", (year, name) + days)
+            return tuple(cursor.execute("SELECT path, batch FROM archive_partitions WHERE year = ?", (year,)).fetchone())
+
+        name, batch = self.db.write_transaction(register)
+        attach = {"archive": self.db.archive_path(name)}
+
+        def prepare(cursor):
+            for statement in ARCHIVE_PARTITION_SCHEMA:
+                cursor.execute(statement.format(schema="archive"))
+            # Copied by a run that did not get to register its batch.
+            cursor.execute("DELETE FROM archive.invoice_items WHERE archive_batch > ?", (batch,))
+            cursor.execute("DELETE FROM archive.invoices WHERE archive_batch > ?", (batch,))
+            return tuple(cursor.execute("SELECT MIN(invoice_id), MAX(invoice_id) FROM main.invoices "
+                                        "WHERE day BETWEEN ? AND ?", days).fetchone())
+
+        def copy(cursor, low, high):
+            cursor.execute("""
+                INSERT INTO archive.invoices (invoice_id, customer_id, date, total_amount, archive_batch)
+                SELECT invoice_id, customer_id, date, total_amount, ? FROM main.invoices
+                WHERE invoice_id BETWEEN ? AND ? AND day BETWEEN ? AND ?
+            """, (batch + 1, low, high) + days)
+            cursor.execute("""
+                INSERT INTO archive.invoice_items
+                    (item_id, invoice_id, product_id, product_name, unit_price, quantity, subtotal, archive_batch)
+                SELECT ii.item_id, ii.invoice_id, ii.product_id, ii.product_name, ii.unit_price, ii.quantity,
+                       ii.subtotal, ?
+                FROM main.invoices i
+                JOIN main.invoice_items ii ON ii.invoice_id = i.invoice_id
+                WHERE i.invoice_id BETWEEN ? AND ? AND i.day BETWEEN ? AND ?
+            """, (batch + 1, low, high) + days)
+
+        def move(cursor):
+            hot = cursor.execute("""
+                SELECT COUNT(*), COALESCE(SUM(total_amount), 0),
+                       (SELECT COUNT(*) FROM main.invoice_items WHERE invoice_id IN
+                           (SELECT invoice_id FROM main.invoices WHERE day BETWEEN ?1 AND ?2))
+                FROM main.invoices WHERE day BETWEEN ?1 AND ?2
+            """, days).fetchone()
+            copied = cursor.execute("""
+                SELECT COUNT(*), COALESCE(SUM(total_amount), 0),
+                       (SELECT COUNT(*) FROM archive.invoice_items WHERE archive_batch = ?1)
+                FROM archive.invoices WHERE archive_batch = ?1
+            """, (batch + 1,)).fetchone()
+            if tuple(hot) != tuple(copied):
+                raise ArchiveMismatch(f"invoices of {year} changed while they were copied; run the archive again")
+            for statement in ARCHIVED_SALES_ADD:
+                cursor.execute(statement, days)
+            # Without the summary triggers the deletes leave the summaries
+            # alone; restoring rebuilds them from the hot rows plus the
+            # archived_* tables.
+            defer_schema_objects(cursor, ("invoices", "invoice_items"))
+            cursor.execute("DELETE FROM main.invoice_items WHERE invoice_id IN "
+                           "(SELECT invoice_id FROM main.invoices WHERE day BETWEEN ? AND ?)", days)
+            cursor.execute("DELETE FROM main.invoices WHERE day BETWEEN ? AND ?", days)
+            cursor.execute("UPDATE archive_partitions SET batch = ?, invoices = invoices + ?, lines = lines + ?, "
+                           "archived = ? WHERE year = ?",
+                           (batch + 1, hot[0], hot[2], datetime.now().strftime("%Y-%m-%d %H:%M:%S"), year))
+            restore_schema_objects(cursor)
+            return hot[0], hot[2]
+
+        low, high = self.db.write_transaction(prepare, attach=attach)
+        if low is not None:
+            # Short copy transactions keep the write lock on the hot
+            # database free for the application in between.
+            for start in range(low, high + 1, self.chunk_size):
+                self.db.write_transaction(copy, start, min(start + self.chunk_size - 1, high), attach=attach)
+                if self.progress is not None:
+                    self.progress({"year": year, "invoice_id": min(start + self.chunk_size - 1, high), "last": high})
+        invoices, lines = self.db.write_transaction(move, attach=attach)
+        with self.db.get_conn() as conn:
+            conn.execute("ANALYZE")
+        return {"year": year, "path": attach["archive"], "invoices": invoices, "lines": lines,
+                "seconds": time.perf_counter() - started}
+
+    def run(self, years=None, hot_years=ARCHIVE_HOT_YEARS, vacuum=False):
+        years = self.closed_years(hot_years) if years is None else years
+        results = [self.archive_year(year) for year in years]
+        if vacuum and results:
+            # Deleted pages are only returned to the file system by VACUUM.
+            with self.db.get_conn() as conn:
+                conn.execute("VACUUM")
+        return results
+
+def _registered_archives(conn):
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'archive_partitions'").fetchone():
+        return []
+    return conn.execute("SELECT year, path FROM archive_partitions WHERE batch > 0 ORDER BY year").fetchall()
+
+class BackupRestarted(Exception):
+    pass
+
+class SnapshotManager:
+    # Online snapshots through SQLite's backup API, into a directory next to
+    # the database (backups/store-20241005-230000.db.gz), with a copy of each
+    # archived year's file beside it (...-230000.archive-2023.db.gz). Pages
+    # are copied in small steps with a pause after each, so the copy takes
+    # little disk time from invoice writes; in WAL mode a step only holds a
+    # read snapshot and never blocks a writer. A write from another connection
+    # makes SQLite start the copy over, so after a few restarts, or once the
+    # steps run well past what the page count needs, the whole copy is
+    # done in a single step instead.
+    def __init__(self, db, directory=None, keep=BACKUP_KEEP, compress=True, pages=BACKUP_PAGES,
+                 pause=BACKUP_PAUSE, progress=None):
+        self.db = db
+        self.directory = directory or os.path.join(os.path.dirname(os.path.abspath(db.db_file)), "backups")
+        self.stem = os.path.splitext(os.path.basename(db.db_file))[0]
+        self.keep = keep
+        self.compress = compress
+        self.pages = pages
+        self.pause = pause
+        self.progress = progress
+
+    def snapshots(self):
+        if not os.path.isdir(self.directory):
+            return []
+        pattern = re.compile(re.escape(self.stem) + r"-\d{8}-\d{6}(-\d+)?\.db(\.gz)?$")
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if pattern.match(name)]
+        return sorted(paths, key=lambda path: (os.path.getmtime(path), path))
+
+    def _copy(self, source, target):
+        state = {"remaining": None, "pages": 0, "restarts": 0, "steps": 0}
+
+        def step(status, remaining, pages):
+            state["steps"] += 1
+            # A restart does not always show as a jump: between two steps
+            # the copy can start over and reach the same page again.
+            if state["remaining"] is not None and (remaining >= state["remaining"] or pages != state["pages"]):
+                state["restarts"] += 1
+            state["remaining"] = remaining
+            state["pages"] = pages
+            if step_pages > 0 and remaining and (
+                    state["restarts"] >= BACKUP_RESTARTS
+                    or state["steps"] > -(-pages // step_pages) + BACKUP_SPARE_STEPS):
+                raise BackupRestarted()
+            if self.progress:
+                self.progress({"stage": "copy", "pages": pages, "remaining": remaining, "restarts": state["restarts"]})
+            if remaining:
+                time.sleep(self.pause)
+
+        step_pages = self.pages
+        while True:
+            try:
+                source.backup(target, pages=step_pages, progress=step)
+                return state["pages"], state["restarts"]
+            except BackupRestarted:
+                step_pages = -1
+
+    def run(self):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{self.stem}-{datetime.now():%Y%m%d-%H%M%S}"
+        base = os.path.join(self.directory, name)
+        taken = 1
+        while os.path.exists(base + ".db") or os.path.exists(base + ".db.gz"):
+            taken += 1
+            base = os.path.join(self.directory, f"{name}-{taken}")
+        started = time.perf_counter()
+        totals = {"pages": 0, "restarts": 0, "bytes": 0}
+        # (final path, file being written) for the database and then one per
+        # archived year, stored beside it as <snapshot>.archive-2023.db.
+        files = [(base + ".db", base + ".db.part")]
+        try:
+            with self.db.get_conn() as conn:
+                self._copy_file(conn, files[0][1], totals)
+            # The archive files are copied after the database, so every batch
+            # the copy has registered is in the copied archive files; batches
+            # added since are hidden by the batch filter of Database.route.
+            with closing(sqlite3.connect(files[0][1])) as copy:
+                partitions = _registered_archives(copy)
+            for year, archive in partitions:
+                path = f"{base}.archive-{year}.db"
+                files.append((path, path + ".part"))
+                with closing(_read_only(self.db.archive_path(archive))) as source:
+                    self._copy_file(source, path + ".part", totals)
+            copied = time.perf_counter() - started
+            if self.compress:
+                if self.progress:
+                    self.progress({"stage": "compress", "bytes": totals["bytes"]})
+                files = [(path + ".gz", self._compress(part, path + ".gz.part")) for path, part in files]
+            # The database file goes last, so a listed snapshot is complete.
+            for path, part in reversed(files):
+                os.replace(part, path)
+        finally:
+            for path, part in files:
+                for leftover in (part, path + ".part", path + ".gz.part"):
+                    if os.path.exists(leftover):
+                        os.remove(leftover)
+        seconds = time.perf_counter() - started
+        return {
+            "path": files[0][0], "archives": len(files) - 1, "pages": totals["pages"], "bytes": totals["bytes"],
+            "stored_bytes": sum(os.path.getsize(path) for path, _ in files), "restarts": totals["restarts"],
+            "copy_seconds": copied, "seconds": seconds,
+            "mb_per_second": totals["bytes"] / 1e6 / copied if copied else 0.0,
+            "removed": self.rotate(),
+        }
+
+    def _copy_file(self, source, path, totals):
+        if os.path.exists(path):
+            os.remove(path)
+        with closing(sqlite3.connect(path)) as target:
+            pages, restarts = self._copy(source, target)
+            # The copy carries the WAL flag of the live file; a snapshot is
+            # easier to move around as a single file.
+            target.execute("PRAGMA journal_mode = DELETE")
+            check = target.execute("PRAGMA quick_check").fetchone()[0]
+        if check != "ok":
+            raise sqlite3.DatabaseError(f"snapshot of {os.path.basename(path)} failed its integrity check: {check}")
+        totals["pages"] += pages
+        totals["restarts"] += restarts
+        totals["bytes"] += os.path.getsize(path)
+
+    def _compress(self, plain, path):
+        with open(plain, "rb") as src, gzip.open(path, "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.remove(plain)
+        return path
+
+    def archive_files(self, snapshot):
+        base = re.sub(r"\.db(\.gz)?$", "", os.path.basename(snapshot))
+        directory = os.path.dirname(os.path.abspath(snapshot))
+        pattern = re.compile(re.escape(base) + r"\.archive-(\d+)\.db(\.gz)?$")
+        files = {}
+        for name in os.listdir(directory):
+            match = pattern.match(name)
+            if match:
+                files[int(match.group(1))] = os.path.join(directory, name)
+        return files
+
+    def rotate(self):
+        old = self.snapshots()[:-self.keep] if self.keep else []
+        for path in old:
+            for archive in self.archive_files(path).values():
+                os.remove(archive)
+            os.remove(path)
+        return old
+
+    def _unpacked(self, path, target, unpacked):
+        if not path.endswith(".gz"):
+            return path
+        with gzip.open(path, "rb") as src, open(target, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        unpacked.append(target)
+        return target
+
+    def restore(self, path):
+        # Copies the snapshot over the live database, and its archive files
+        # over the live ones, through the backup API as well, so other
+        # connections see the new contents instead of a file swapped
+        # underneath them. Everything is checked before anything is
+        # replaced, and the current contents are saved first, in a
+        # pre-restore/ subdirectory that rotation leaves alone.
+        path = os.path.abspath(path)
+        archives = self.archive_files(path)
+        unpacked = []
+        sources = []
+        try:
+            # (live file, snapshot copy), the database last as in run.
+            plain = self._unpacked(path, os.path.abspath(self.db.db_file) + ".restore", unpacked)
+            with closing(_read_only(plain)) as snapshot:
+                partitions = _registered_archives(snapshot)
+            files = []
+            for year, archive in partitions:
+                if year not in archives:
+                    raise FileNotFoundError(f"the snapshot has no copy of the archived year {year}")
+                live = self.db.archive_path(archive)
+                files.append((live, self._unpacked(archives[year], live + ".restore", unpacked)))
+            files.append((os.path.abspath(self.db.db_file), plain))
+            for live, copy in files:
+                source = _read_only(copy)
+                sources.append(source)
+                check = source.execute("PRAGMA quick_check").fetchone()[0]
+                if check != "ok":
+                    raise sqlite3.DatabaseError(f"{os.path.basename(copy)} failed its integrity check: {check}")
+            saved = SnapshotManager(self.db, os.path.join(self.directory, BACKUP_PRE_RESTORE), keep=0,
+                                    compress=self.compress, pages=self.pages, pause=self.pause,
+                                    progress=self.progress).run()
+            started = time.perf_counter()
+            for (live, copy), source in zip(files[:-1], sources):
+                with closing(sqlite3.connect(live)) as target:
+                    source.backup(target)
+            with self.db.get_conn() as conn:
+                sources[-1].backup(conn)
+            seconds = time.perf_counter() - started
+        finally:
+            for source in sources:
+                source.close()
+            for leftover in unpacked:
+                os.remove(leftover)
+        self.db.report_cache.clear()
+        return {"path": path, "archives": len(files) - 1, "saved": saved["path"], "seconds": seconds}
+
+GENERATOR_SIZES = {
+    "small": {"customers": 1000, "products": 300, "lines": 10000},
+    "medium": {"customers": 50000, "products": 5000, "lines": 1000000},
+    "large": {"customers": 200000, "products": 20000, "lines": 10000000},
+}
+GENERATOR_CHUNK = 20000
+FIRST_NAMES = ("علی", "محمد", "رضا", "حسین", "مهدی", "زهرا", "فاطمه", "مریم", "سارا", "نرگس",
+               "امیر", "نیلوفر", "کیان", "یاسمن", "پارسا", "الهام", "بهرام", "شیرین", "آرش", "مینا")
+LAST_NAMES = ("احمدی", "محمدی", "حسینی", "رضایی", "کریمی", "موسوی", "جعفری", "صادقی", "قاسمی", "نوری",
+              "رحیمی", "اکبری", "تهرانی", "شیرازی", "کاظمی", "یزدانی", "فراهانی", "مرادی", "عباسی", "زمانی")
+CITIES = ("تهران", "مشهد", "اصفهان", "شیراز", "تبریز", "کرج", "قم", "اهواز", "رشت", "یزد")
+PRODUCT_KINDS = ("برنج", "روغن", "چای", "قند", "حبوبات", "ماکارونی", "رب", "پنیر", "شیر", "ماست",
+                 "شوینده", "دستمال", "کنسرو", "ادویه", "خشکبار", "نوشابه", "آبمیوه", "بیسکویت", "شکلات", "قهوه")
+PRODUCT_BRANDS = ("طلایی", "ممتاز", "اقتصادی", "خانواده", "ویژه", "سبز", "آفتاب", "البرز", "کوهستان", "دریا")
+
+def _skewed_weights(count, exponent):
+    # Zipf-like popularity: a few customers and products account for most sales.
+    return list(accumulate(1.0 / (rank + 1) ** exponent for rank in range(count)))
+
+def _draws(rng, population, cum_weights, batch=4096):
+    while True:
+        yield from rng.choices(population, cum_weights=cum_weights, k=batch)
+
+def _day_weights(days, end):
+    # Sales grow towards the present, peak on Thursdays and in the weeks
+    # before Nowruz, and dip on Fridays.
+    weights = []
+    for offset in range(days):
+        day = end - timedelta(days=days - 1 - offset)
+        weight = 1.0 + 2.0 * offset / days
+        weight *= {3: 1.4, 4: 0.5}.get(day.weekday(), 1.0)
+        if (day.month == 3 and day.day <= 20) or (day.month == 2 and day.day >= 20):
+            weight *= 1.8
+        weights.append(weight)
+    return list(accumulate(weights))
+
+def generate_data(db, customers, products, lines, seed=42, days=730, progress=None):
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    importer = BulkImporter(db)
+    importer.defer_objects(("customers", "products", "invoices", "invoice_items"))
+
+    def add_customers(cursor):
+        first = cursor.execute("SELECT COALESCE(MAX(customer_id), 0) FROM customers").fetchone()[0]
+        cursor.executemany("INSERT INTO customers (name, phone, address) VALUES (?, ?, ?)", [
+            (f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}", f"09{first + n:09d}",
+             f"{rng.choice(CITIES)}، خیابان {rng.randint(1, 300)}")
+            for n in range(1, customers + 1)
+        ])
+        return [row[0] for row in cursor.execute("SELECT customer_id FROM customers WHERE customer_id > ?", (first,))]
+
+    def add_products(cursor):
+        first = cursor.execute("SELECT COALESCE(MAX(product_id), 0) FROM products").fetchone()[0]
+        cursor.executemany("INSERT INTO products (name, price, stock) VALUES (?, ?, ?)", [
+            (f"{rng.choice(PRODUCT_KINDS)} {rng.choice(PRODUCT_BRANDS)} {first + n}",
+             int(round(rng.lognormvariate(11, 0.8), -3) or 1000) * RIALS_PER_TOMAN, rng.randint(1000, 100000))
+            for n in range(1, products + 1)
+        ])
+        return [tuple(row) for row in cursor.execute(
+            "SELECT product_id, name, price FROM products WHERE product_id > ?", (first,))]
+
+    customer_ids = db.write_transaction(add_customers)
+    product_rows = db.write_transaction(add_products)
+    rng.shuffle(customer_ids)
+    rng.shuffle(product_rows)
+    customer_weights = _skewed_weights(len(customer_ids), 0.8)
+    product_weights = _skewed_weights(len(product_rows), 1.0)
+    end = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    day_weights = _day_weights(days, end)
+    first_day = end - timedelta(days=days - 1)
+    buyers = _draws(rng, customer_ids, customer_weights)
+    sale_days = _draws(rng, range(days), day_weights)
+    sold = _draws(rng, product_rows, product_weights)
+
+    def add_invoices(cursor, target):
+        next_id = cursor.execute("""
+            SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'invoices'), 0),
+                       COALESCE((SELECT MAX(invoice_id) FROM invoices), 0)) + 1
+        """).fetchone()[0]
+        invoices, items = [], []
+        invoice_id = next_id
+        while len(items) < target:
+            customer_id = next(buyers)
+            moment = first_day + timedelta(days=next(sale_days), seconds=rng.randint(9 * 3600, 22 * 3600))
+            basket = {row[0]: row for row in islice(sold, min(rng.randint(1, 6), target - len(items)))}
+            total = 0
+            for product_id, name, price in basket.values():
+                quantity = rng.choice((1, 1, 1, 2, 2, 3, 5, 10))
+                items.append((invoice_id, product_id, name, price, quantity, price * quantity))
+                total += price * quantity
+            invoices.append((invoice_id, customer_id, moment.strftime("%Y-%m-%d %H:%M:%S"), total))
+            invoice_id += 1
+        cursor.executemany("INSERT INTO invoices (invoice_id, customer_id, date, total_amount) VALUES (?, ?, ?, ?)",
+                           invoices)
+        cursor.executemany(INSERT_INVOICE_ITEM, items)
+        return len(items)
+
+    written = 0
+    while written < lines:
+        written += db.write_transaction(add_invoices, min(GENERATOR_CHUNK, lines - written))
+        if progress is not None:
+            progress({"lines": written, "seconds": time.perf_counter() - started})
+
+    importer.restore_deferred()
+    return {"customers": len(customer_ids), "products": len(product_rows), "lines": written,
+            "seconds": time.perf_counter() - started}
+
+BENCH_REPEAT = 5
+BENCH_WRITES = 200
+BENCH_TOLERANCE = 0.25
+BENCH_NOISE_MS = 2.0
+
+def _timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {"runs": repeat, "median_ms": samples[len(samples) // 2], "min_ms": samples[0], "max_ms": samples[-1]}
+
+def run_benchmarks(db, repeat=BENCH_REPEAT, writes=BENCH_WRITES, seed=42):
+    rng = random.Random(seed)
+    service = StoreService(db)
+    results = {}
+
+    latest = db.run_query("SELECT MAX(date) FROM invoices")[0][0] or datetime.now().strftime("%Y-%m-%d")
+    month = latest[:7]
+    customer = db.run_query("SELECT name, phone FROM customers ORDER BY customer_id LIMIT 1")
+    product = db.run_query("SELECT name FROM products ORDER BY product_id LIMIT 1")
+
+    for report in REPORTS:
+        def run(report=report):
+            # Cold results: the cache would otherwise answer every repeat.
+            db.report_cache.clear()
+            db.run_report(report.number, month)
+        results[f"report_{report.number:02d}"] = _timed(run, repeat)
+
+    # The same summaries recomputed from the invoice lines over the process
+    # pool; one untimed run starts the workers.
+    parallel = [report for report in REPORTS if report.partial is not None]
+    if parallel:
+        db.report_cache.clear()
+        db.run_parallel_report(parallel[0].number)
+    for report in parallel:
+        def run(report=report):
+            db.report_cache.clear()
+            db.run_parallel_report(report.number)
+        results[f"report_{report.number:02d}_parallel"] = _timed(run, repeat)
+
+    if customer:
+        name = customer[0]["name"]
+        results["search_customers_short"] = _timed(lambda: db.search_customers(name[:2]), repeat)
+        results["search_customers_name"] = _timed(lambda: db.search_customers(name), repeat)
+        results["search_customers_phone"] = _timed(lambda: db.search_customers(customer[0]["phone"][-6:]), repeat)
+    if product:
+        results["search_products_name"] = _timed(lambda: db.search_products(product[0]["name"][:5]), repeat)
+
+    # The queries each window runs when it opens.
+    results["load_customer_window"] = _timed(lambda: db.run_query("SELECT * FROM customers ORDER BY name"), repeat)
+    results["load_product_window"] = _timed(lambda: db.run_query("SELECT * FROM products ORDER BY name"), repeat)
+    # The invoice window loads through the catalog cache: a first open reads
+    # both tables, a later one only confirms the versions.
+    results["load_new_invoice_window"] = _timed(
+        lambda: CatalogCache(db).refresh().products_in_stock(), repeat)
+    db.catalog.refresh()
+    results["reopen_new_invoice_window"] = _timed(lambda: db.catalog.refresh().products_in_stock(), repeat)
+    results["load_invoices_first_page"] = _timed(
+        lambda: db.invoice_page(("9999-12-31", 0), INVOICE_PAGE_SIZE), repeat)
+    results["load_invoices_jump_to_date"] = _timed(
+        lambda: db.invoice_page((month + "-15", 0), INVOICE_PAGE_SIZE), repeat)
+    results["load_invoice_details"] = _timed(lambda: db.run_query(
+        "SELECT item_id, product_name, unit_price, quantity, subtotal FROM invoice_items WHERE invoice_id = "
+        "(SELECT MAX(invoice_id) FROM invoices)"), repeat)
+
+    # Write throughput. Stock and the summaries are put back by deleting the
+    # benchmark invoices again.
+    stocked = [row["product_id"] for row in db.run_query(
+        "SELECT product_id FROM products WHERE stock >= 1000 ORDER BY product_id LIMIT 500")]
+    customer_ids = [row["customer_id"] for row in db.run_query("SELECT customer_id FROM customers LIMIT 500")]
+    if stocked and customer_ids:
+        carts = [(rng.choice(customer_ids), {pid: rng.randint(1, 3) for pid in rng.sample(stocked, min(3, len(stocked)))})
+                 for _ in range(writes)]
+
+        started = time.perf_counter()
+        invoice_ids = [service.create_invoice(customer_id, cart) for customer_id, cart in carts]
+        elapsed = time.perf_counter() - started
+        results["invoice_save"] = {"runs": writes, "median_ms": elapsed / writes * 1000, "per_second": writes / elapsed}
+
+        started = time.perf_counter()
+        for invoice_id in invoice_ids:
+            db.delete_invoice(invoice_id)
+        elapsed = time.perf_counter() - started
+        results["invoice_delete"] = {"runs": writes, "median_ms": elapsed / writes * 1000, "per_second": writes / elapsed}
+
+        prices = {row["product_id"]: row for row in db.run_query(
+            "SELECT product_id, name, price FROM products WHERE product_id IN (SELECT value FROM json_each(?))",
+            (json.dumps(stocked),))}
+        bulk = [(customer_id, {pid: {"name": prices[pid]["name"], "price": prices[pid]["price"], "quantity": quantity}
+                               for pid, quantity in cart.items()})
+                for customer_id, cart in carts * 5]
+        stats = db.create_invoices(bulk)
+        results["invoice_bulk_save"] = {"runs": len(bulk), "median_ms": stats["seconds"] / len(bulk) * 1000,
+                                        "per_second": stats["invoices_per_second"]}
+        for invoice_id in stats["invoice_ids"]:
+            db.delete_invoice(invoice_id)
+
+    counts = db.run_query("""
+        SELECT (SELECT COUNT(*) FROM customers), (SELECT COUNT(*) FROM products),
+               (SELECT COUNT(*) FROM invoices), (SELECT COUNT(*) FROM invoice_items)
+    """)[0]
+    return {
+        "meta": {
+            "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "python": sys.version.split()[0],
+            "sqlite": sqlite3.sqlite_version,
+            "customers": counts[0], "products": counts[1], "invoices": counts[2], "invoice_items": counts[3],
+        },
+        "results": results,
+    }
+
+def compare_benchmarks(current, baseline, tolerance=BENCH_TOLERANCE):
+    # Returns (name, baseline_ms, current_ms) for every benchmark whose median
+    # got slower by more than the tolerance and the noise floor.
+    regressions = []
+    for name, result in current["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if before is None:
+            continue
+        if result["median_ms"] > before["median_ms"] * (1 + tolerance) + BENCH_NOISE_MS:
+            regressions.append((name, before["median_ms"], result["median_ms"]))
+    return regressions
+
+
+def main(argv=None, gui=None):
+    parser = argparse.ArgumentParser(description="Store management system")
+    parser.add_argument("--db", default="store.db", help="path to the SQLite database file")
+    parser.add_argument("--slow-ms", type=float, default=QUERY_SLOW_MS,
+                        help="statements slower than this get their query plan captured")
+    parser.add_argument("--profile-log", help="append slow statements to this file as JSON lines")
+    parser.add_argument("--processes", type=int, help="worker processes for parallel reports (default: one per core)")
+    parser.add_argument("--backup-dir", help="where snapshots are kept (default: backups/ next to the database)")
+    parser.add_argument("--backup-every", type=float, default=0,
+                        help="while the GUI or server runs, take a snapshot every this many minutes")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("explain", help="print the query plan of every report")
+    report_parser = commands.add_parser("report", help="run a report without the GUI")
+    report_parser.add_argument("number", type=int, nargs="?", help="report number; omit to list reports")
+    report_parser.add_argument("--param", default="", help="report parameter, e.g. a month as YYYY-MM")
+    report_parser.add_argument("--parallel", action="store_true",
+                               help="recompute a summary report from the invoice lines in worker processes")
+    import_parser = commands.add_parser("import", help="bulk import customers, products or invoices from CSV/JSON")
+    import_parser.add_argument("kind", nargs="?", choices=sorted(IMPORT_KINDS))
+    import_parser.add_argument("path", nargs="?", help="a .csv, .json (array) or .jsonl file")
+    import_parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE, help="rows per transaction")
+    import_parser.add_argument("--update", action="store_true", help="update rows that already exist instead of skipping them")
+    import_parser.add_argument("--restart", action="store_true", help="ignore an unfinished import of the same file")
+    import_parser.add_argument("--restore", action="store_true",
+                               help="only recreate the indexes and triggers left dropped by a failed import")
+    export_parser = commands.add_parser("export", help="export invoices, invoice items or a report to CSV or columnar")
+    export_parser.add_argument("source", help="'invoices', 'items' or a report number")
+    export_parser.add_argument("path", help="output file; .csv writes CSV, anything else the columnar format")
+    export_parser.add_argument("--param", default="", help="report parameter, e.g. a month as YYYY-MM")
+    export_parser.add_argument("--no-compress", action="store_true", help="do not zlib-compress columnar files")
+    generate_parser = commands.add_parser("generate", help="fill the database with seeded synthetic data")
+    generate_parser.add_argument("--size", choices=sorted(GENERATOR_SIZES), default="small")
+    generate_parser.add_argument("--customers", type=int, help="override the customer count of --size")
+    generate_parser.add_argument("--products", type=int, help="override the product count of --size")
+    generate_parser.add_argument("--lines", type=int, help="override the invoice line count of --size")
+    generate_parser.add_argument("--days", type=int, default=730, help="days of history to spread invoices over")
+    generate_parser.add_argument("--seed", type=int, default=42)
+    bench_parser = commands.add_parser("bench", help="time reports, searches, window loads and invoice writes")
+    bench_parser.add_argument("--repeat", type=int, default=BENCH_REPEAT)
+    bench_parser.add_argument("--writes", type=int, default=BENCH_WRITES, help="invoices saved and deleted")
+    bench_parser.add_argument("--output", help="write the results to this JSON file")
+    bench_parser.add_argument("--baseline", help="compare against this JSON results file")
+    bench_parser.add_argument("--profile-output", help="write the query profile of the run to this JSON file")
+    bench_parser.add_argument("--tolerance", type=float, default=BENCH_TOLERANCE,
+                              help="allowed slowdown before a result counts as a regression")
+    archive_parser = commands.add_parser("archive", help="move closed years of invoices into per-year archive files")
+    archive_parser.add_argument("--year", type=int, action="append", help="archive this year; may be repeated")
+    archive_parser.add_argument("--hot-years", type=int, default=ARCHIVE_HOT_YEARS,
+                                help="without --year, keep this many most recent years in the main database")
+    archive_parser.add_argument("--vacuum", action="store_true", help="shrink the database file afterwards")
+    archive_parser.add_argument("--list", action="store_true", help="only list the archived years")
+    backup_parser = commands.add_parser("backup", help="take an online snapshot of the database")
+    backup_parser.add_argument("--keep", type=int, default=BACKUP_KEEP, help="snapshots to keep; older ones are deleted")
+    backup_parser.add_argument("--no-compress", action="store_true", help="keep the snapshot as a plain .db file")
+    backup_parser.add_argument("--pages", type=int, default=BACKUP_PAGES, help="pages copied per step")
+    backup_parser.add_argument("--pause", type=float, default=BACKUP_PAUSE, help="seconds to sleep between steps")
+    backup_parser.add_argument("--list", action="store_true", help="only list the snapshots")
+    backup_parser.add_argument("--restore", metavar="SNAPSHOT",
+                               help="replace the database contents with this snapshot, saving them first")
+    serve_parser = commands.add_parser("serve", help="serve the store operations as a JSON HTTP API")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8080)
+    serve_parser.add_argument("--pool-size", type=int, default=8, help="connections shared by all requests")
+    serve_parser.add_argument("--workers", type=int, default=6, help="threads running read queries")
+    args = parser.parse_args(argv)
+    if args.command is None and gui is None:
+        parser.error("no command given; the GUI is started with test3.py")
+
+    def show_migration(stats):
+        if stats["stage"] == "backfill":
+            print(f"converting {stats['table']} to rials: row {stats['rowid']:,} of {stats['last_rowid']:,}", flush=True)
+        else:
+            print(f"{stats['table']}.{stats['column']}: {stats['rows']:,} rows, {stats['new_total']:,} rials "
+                  f"({stats['caught_up']:,} rows caught up)")
+
+    try:
+        setup_database(args.db, progress=show_migration)
+    except MoneyMismatch as e:
+        sys.exit(f"money conversion stopped, the old columns are unchanged: {e}")
+    if args.command == "serve":
+        db_instance = Database(args.db, pool_size=args.pool_size, workers=args.workers,
+                               slow_ms=args.slow_ms, profile_log=args.profile_log,
+                               backup_interval=args.backup_every * 60, backup_dir=args.backup_dir)
+        server = StoreServer(StoreService(db_instance), args.host, args.port)
+        print(f"Serving on http://{args.host}:{args.port}")
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            db_instance.close()
+        return
+
+    db_instance = Database(args.db, slow_ms=args.slow_ms, profile_log=args.profile_log,
+                           report_processes=args.processes, backup_dir=args.backup_dir,
+                           backup_interval=args.backup_every * 60 if args.command is None else 0)
+
+    if args.command == "explain":
+        for report, details, problems in explain_report_plans(db_instance):
+            status = "OK" if not problems else "CHECK"
+            print(f"[{status}] {report.label}")
+            for detail in details:
+                print(f"    {detail}")
+            for problem in problems:
+                print(f"    !! {problem}")
+        db_instance.close()
+        return
+
+    if args.command == "import":
+        def show_progress(stats):
+            print(f"{stats['rows']:,} rows, {stats['rows_per_second']:,.0f} rows/s, "
+                  f"{stats['rejected']:,} rejected", flush=True)
+
+        importer = BulkImporter(db_instance, args.chunk_size, args.update, progress=show_progress)
+        try:
+            if args.restore:
+                importer.restore_deferred()
+            elif args.kind is None or args.path is None:
+                parser.error("import needs a kind and a file")
+            else:
+                stats = importer.run(args.kind, args.path, args.restart)
+                if stats["resumed_from"]:
+                    print(f"resumed after {stats['resumed_from']:,} rows")
+                print(f"{stats['written']:,} written, {stats['skipped']:,} skipped, {stats['rejected']:,} rejected "
+                      f"in {stats['seconds']:.1f}s ({stats['rows_per_second']:,.0f} rows/s)")
+                for error in stats["errors"]:
+                    print(f"    !! {error}")
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f"import stopped: {e}")
+            print("run the same command again to resume")
+        finally:
+            db_instance.close()
+        return
+
+    if args.command == "export":
+        compress = not args.no_compress
+        try:
+            if args.source in EXPORT_QUERIES:
+                stats = db_instance.export_table(args.source, args.path, compress)
+            else:
+                stats = db_instance.export_report(args.source, args.param, args.path, compress)
+        except ValueError as e:
+            db_instance.close()
+            parser.error(str(e))
+        print(f"{stats['rows']:,} rows, {stats['bytes']:,} bytes in {stats['seconds']:.1f}s "
+              f"({stats['rows_per_second']:,.0f} rows/s)")
+        db_instance.close()
+        return
+
+    if args.command == "archive":
+        def show_progress(stats):
+            print(f"{stats['year']}: copied up to invoice {stats['invoice_id']:,} of {stats['last']:,}", flush=True)
+
+        archiver = InvoiceArchiver(db_instance, progress=show_progress)
+        try:
+            if not args.list:
+                for stats in archiver.run(args.year, args.hot_years, args.vacuum):
+                    print(f"{stats['year']}: {stats['invoices']:,} invoices, {stats['lines']:,} lines "
+                          f"moved to {stats['path']} in {stats['seconds']:.1f}s")
+            for row in archiver.partitions():
+                print(f"{row['year']}\t{row['path']}\t{row['invoices']:,} invoices\t{row['lines']:,} lines\t"
+                      f"{row['archived'] or 'not finished'}")
+        except (OSError, sqlite3.Error) as e:
+            print(f"archive stopped: {e}")
+            print("run the same command again to finish it")
+        finally:
+            db_instance.close()
+        return
+
+    if args.command == "backup":
+        manager = SnapshotManager(db_instance, args.backup_dir, args.keep, not args.no_compress, args.pages, args.pause)
+        try:
+            if args.restore:
+                result = manager.restore(args.restore)
+                print(f"restored {result['path']} and {result['archives']} archived years in {result['seconds']:.1f}s")
+                print(f"the previous contents were saved to {result['saved']}")
+            elif not args.list:
+                result = manager.run()
+                print(f"{result['path']} (+{result['archives']} archived years): {result['pages']:,} pages, "
+                      f"{result['bytes'] / 1e6:,.1f} MB "
+                      f"in {result['copy_seconds']:.2f}s ({result['mb_per_second']:,.1f} MB/s, "
+                      f"{result['restarts']} restarts), {result['stored_bytes'] / 1e6:,.1f} MB stored, "
+                      f"{result['seconds']:.2f}s in all")
+                for path in result["removed"]:
+                    print(f"removed {path}")
+            else:
+                for path in manager.snapshots():
+                    stat = os.stat(path)
+                    print(f"{path}\t{stat.st_size / 1e6:,.1f} MB\t"
+                          f"{datetime.fromtimestamp(stat.st_mtime):%Y-%m-%d %H:%M:%S}")
+        except (OSError, sqlite3.Error) as e:
+            print(f"backup failed: {e}")
+            sys.exit(1)
+        finally:
+            db_instance.close()
+        return
+
+    if args.command == "generate":
+        sizes = dict(GENERATOR_SIZES[args.size])
+        for key in sizes:
+            if getattr(args, key) is not None:
+                sizes[key] = getattr(args, key)
+
+        def show_progress(stats):
+            print(f"{stats['lines']:,} lines, {stats['lines'] / stats['seconds']:,.0f} lines/s", flush=True)
+
+        stats = generate_data(db_instance, seed=args.seed, days=args.days, progress=show_progress, **sizes)
+        print(f"{stats['customers']:,} customers, {stats['products']:,} products, "
+              f"{stats['lines']:,} invoice lines in {stats['seconds']:.1f}s")
+        db_instance.close()
+        return
+
+    if args.command == "bench":
+        current = run_benchmarks(db_instance, args.repeat, args.writes)
+        if args.profile_output:
+            db_instance.profiler.export(args.profile_output)
+        db_instance.close()
+        for name, result in sorted(current["results"].items()):
+            rate = f"  {result['per_second']:,.0f}/s" if "per_second" in result else ""
+            print(f"{name:32} {result['median_ms']:10.2f} ms{rate}")
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(current, f, indent=2, ensure_ascii=False)
+        if args.baseline:
+            with open(args.baseline, encoding="utf-8") as f:
+                regressions = compare_benchmarks(current, json.load(f), args.tolerance)
+            for name, before, after in regressions:
+                print(f"!! {name}: {before:.2f} ms -> {after:.2f} ms")
+            if regressions:
+                sys.exit(1)
+        return
+
+    if args.command == "report":
+        if args.number is None:
+            for report in REPORTS:
+                print(report.label)
+        else:
+            try:
+                if args.parallel:
+                    columns, rows = db_instance.run_parallel_report(args.number, args.param)
+                else:
+                    columns, rows = db_instance.run_report(args.number, args.param)
+            except ValueError as e:
+                db_instance.close()
+                parser.error(str(e))
+            print("\t".join(columns))
+            for row in rows:
+                print("\t".join("" if value is None else str(value) for value in row))
+        db_instance.close()
+        return
+
+    gui(db_instance)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,77 +1,419 @@
+import os
+import queue
 import sqlite3
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 from datetime import datetime, timedelta
 
-def setup_database():
-    conn = sqlite3.connect('store.db')
-    conn.execute("PRAGMA foreign_keys = ON;")
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS customers (
-        customer_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        phone TEXT UNIQUE,
-        address TEXT
-    );""")
-    
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS products (
-        product_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL UNIQUE,
-        price REAL NOT NULL,
-        stock INTEGER NOT NULL DEFAULT 0
-    );""")
-    
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS invoices (
-        invoice_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        customer_id INTEGER NOT NULL,
-        date TEXT NOT NULL,
-        total_amount REAL NOT NULL,
-        FOREIGN KEY (customer_id) REFERENCES customers (customer_id) ON DELETE RESTRICT
-    );""")
-    
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS invoice_items (
-        item_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        invoice_id INTEGER NOT NULL,
-        product_id INTEGER NOT NULL,
-        product_name TEXT NOT NULL, 
-        unit_price REAL NOT NULL,
-        quantity INTEGER NOT NULL,
-        subtotal REAL NOT NULL,
-        FOREIGN KEY (invoice_id) REFERENCES invoices (invoice_id) ON DELETE CASCADE,
-        FOREIGN KEY (product_id) REFERENCES products (product_id) ON DELETE RESTRICT
-    );""")
-    
-    conn.commit()
-    conn.close()
-
-class Database:
-    def __init__(self, db_file="store.db"):
-        self.db_file = db_file
-
-    def get_conn(self):
-        conn = sqlite3.connect(self.db_file)
-        conn.execute("PRAGMA foreign_keys = ON;")
-        conn.row_factory = sqlite3.Row
-        return conn
-
-    def execute_query(self, query, params=(), commit=False):
-        try:
-            with self.get_conn() as conn:
-                cursor = conn.cursor()
-                cursor.execute(query, params)
-                if commit:
-                    conn.commit()
-                    return cursor.lastrowid
-                else:
-                    return cursor.fetchall()
-        except sqlite3.Error as e:
-            messagebox.showerror("Database Error", f"An error occurred: {e}")
-            return None if not commit else -1
+import store
+from store import (INVOICE_PAGE_SIZE, REPORT_BATCH_SIZE, REPORT_LIST, REPORTS, SEARCH_LIMIT, BulkImporter,
+                   QueryCancelled, StockError, StoreService, ValidationError, format_toman, parse_toman)
+
+class TaskStatusBar(ttk.Frame):
+    POLL_INTERVAL = 30
+
+    def __init__(self, parent, db):
+        super().__init__(parent, padding=(10, 2))
+        self.db = db
+        self.tasks = {}
+
+        self.cancel_button = ttk.Button(self, text="لغو", command=self.cancel_all, state="disabled")
+        self.cancel_button.pack(side="left")
+        self.progress = ttk.Progressbar(self, mode="indeterminate", length=120)
+        self.progress.pack(side="left", padx=5)
+        self.message_label = ttk.Label(self, text="")
+        self.message_label.pack(side="right")
+
+    def run(self, fn, *args, on_success=None, on_error=None, message="در حال بارگذاری..."):
+        task = self.db.submit_for(self.winfo_toplevel().title(), fn, *args)
+        self.tasks[task] = message
+        self.update_busy()
+        self.after(self.POLL_INTERVAL, self.poll, task, on_success, on_error)
+        return task
+
+    def query(self, query, params=(), commit=False, on_success=None, on_error=None, message="در حال بارگذاری..."):
+        return self.run(self.db.run_query, query, params, commit,
+                        on_success=on_success, on_error=on_error, message=message)
+
+    def poll(self, task, on_success, on_error):
+        if not self.winfo_exists():
+            task.cancel()
+            return
+        if not task.done():
+            self.after(self.POLL_INTERVAL, self.poll, task, on_success, on_error)
+            return
+
+        self.tasks.pop(task, None)
+        self.update_busy()
+        if task.cancelled():
+            return
+        error = task.future.exception()
+        if error is None:
+            if on_success is not None:
+                on_success(task.future.result())
+        elif isinstance(error, QueryCancelled):
+            return
+        elif on_error is not None:
+            on_error(error)
+        else:
+            messagebox.showerror("Database Error", f"An error occurred: {error}", parent=self)
+
+    def set_message(self, task, message):
+        if task in self.tasks:
+            self.tasks[task] = message
+            self.message_label.config(text=list(self.tasks.values())[-1])
+
+    def update_busy(self):
+        toplevel = self.winfo_toplevel()
+        if self.tasks:
+            self.message_label.config(text=list(self.tasks.values())[-1])
+            self.cancel_button.config(state="normal")
+            self.progress.start(15)
+            toplevel.config(cursor="watch")
+        else:
+            self.message_label.config(text="")
+            self.cancel_button.config(state="disabled")
+            self.progress.stop()
+            toplevel.config(cursor="")
+
+    def cancel_all(self):
+        for task in list(self.tasks):
+            task.cancel()
+
+    def destroy(self):
+        self.cancel_all()
+        super().destroy()
+
+EXPORT_FILE_TYPES = [("CSV", "*.csv"), ("Columnar, zlib", "*.stcol")]
+EXPORT_POLL = 200
+
+def run_export(window, export_fn, *args):
+    # Runs export_fn(*args, path, progress=...) on the window's status bar and
+    # shows the row count while it writes.
+    path = filedialog.asksaveasfilename(parent=window, defaultextension=".csv", filetypes=EXPORT_FILE_TYPES)
+    if not path:
+        return
+    latest = {}
+
+    def on_done(stats):
+        messagebox.showinfo("خروجی", f"{stats['rows']:,} ردیف در {stats['seconds']:.1f} ثانیه "
+                                     f"({stats['bytes'] / 1024 / 1024:,.1f} مگابایت) ذخیره شد.", parent=window)
+
+    def on_failed(e):
+        messagebox.showerror("خطا", f"خطا در ذخیره خروجی: {e}", parent=window)
+
+    def poll():
+        if not window.winfo_exists() or task.done():
+            return
+        if latest:
+            window.status_bar.set_message(task, f"در حال ذخیره خروجی... {latest['rows']:,} ردیف")
+        window.after(EXPORT_POLL, poll)
+
+    task = window.status_bar.run(lambda: export_fn(*args, path, progress=latest.update),
+                                 on_success=on_done, on_error=on_failed, message="در حال ذخیره خروجی...")
+    poll()
+
+def _longest_increasing_run(positions):
+    # Returns the indexes into positions that form a longest increasing
+    # subsequence; those rows are already in relative order and stay put.
+    tails = []
+    tail_indexes = []
+    previous = [-1] * len(positions)
+    for i, value in enumerate(positions):
+        lo, hi = 0, len(tails)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if tails[mid] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo > 0:
+            previous[i] = tail_indexes[lo - 1]
+        if lo == len(tails):
+            tails.append(value)
+            tail_indexes.append(i)
+        else:
+            tails[lo] = value
+            tail_indexes[lo] = i
+
+    result = set()
+    i = tail_indexes[-1] if tail_indexes else -1
+    while i != -1:
+        result.add(i)
+        i = previous[i]
+    return result
+
+class TreeBinding:
+    def __init__(self, tree, key, values, sort_key=None):
+        self.tree = tree
+        self.key = key
+        self.values = values
+        self.sort_key = sort_key
+        self.order = []
+        self.rows = {}
+        self.sort_keys = {}
+
+    def rebind(self, tree):
+        self.tree = tree
+        self.order = []
+        self.rows = {}
+        self.sort_keys = {}
+
+    def _items(self, rows):
+        items = []
+        seen = {}
+        for row in rows:
+            iid = str(self.key(row))
+            if iid in seen:
+                seen[iid] += 1
+                iid = f"{iid}#{seen[iid]}"
+            else:
+                seen[iid] = 0
+            items.append((iid, tuple(self.values(row)), self.sort_key(row) if self.sort_key else None))
+        return items
+
+    def sync(self, rows):
+        items = self._items(rows)
+        wanted = {iid for iid, values, sort_key in items}
+
+        stale = [iid for iid in self.order if iid not in wanted]
+        if stale:
+            self.tree.delete(*stale)
+        current = [iid for iid in self.order if iid in wanted]
+        position = {iid: n for n, iid in enumerate(current)}
+
+        kept = [iid for iid, values, sort_key in items if iid in position]
+        in_order = _longest_increasing_run([position[iid] for iid in kept])
+        stay = {kept[i] for i in in_order}
+        moving = [iid for iid in current if iid not in stay]
+        if moving:
+            self.tree.detach(*moving)
+
+        remaining = len(stay)
+        for index, (iid, values, sort_key) in enumerate(items):
+            if iid in stay:
+                remaining -= 1
+                if self.rows[iid] != values:
+                    self.tree.item(iid, values=values)
+                continue
+            # Appending at "end" avoids Tk walking the child list on big loads.
+            target = "end" if remaining == 0 else index
+            if iid in position:
+                self.tree.move(iid, "", target)
+                if self.rows[iid] != values:
+                    self.tree.item(iid, values=values)
+            else:
+                self.tree.insert("", target, iid=iid, values=values)
+
+        self.order = [iid for iid, values, sort_key in items]
+        self.rows = {iid: values for iid, values, sort_key in items}
+        self.sort_keys = {iid: sort_key for iid, values, sort_key in items}
+
+    def extend(self, rows):
+        for row in rows:
+            iid = str(self.key(row))
+            if iid in self.rows:
+                n = 1
+                while f"{iid}#{n}" in self.rows:
+                    n += 1
+                iid = f"{iid}#{n}"
+            values = tuple(self.values(row))
+            self.tree.insert("", "end", iid=iid, values=values)
+            self.order.append(iid)
+            self.rows[iid] = values
+            self.sort_keys[iid] = self.sort_key(row) if self.sort_key else None
+
+    def _insert_index(self, sort_key):
+        lo, hi = 0, len(self.order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.sort_keys[self.order[mid]] <= sort_key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def upsert(self, row):
+        iid = str(self.key(row))
+        values = tuple(self.values(row))
+        sort_key = self.sort_key(row) if self.sort_key else None
+
+        if iid in self.rows:
+            if self.rows[iid] != values:
+                self.tree.item(iid, values=values)
+                self.rows[iid] = values
+            if sort_key == self.sort_keys[iid]:
+                return
+            self.order.remove(iid)
+            self.tree.detach(iid)
+            index = self._insert_index(sort_key)
+            self.tree.move(iid, "", index)
+        else:
+            index = self._insert_index(sort_key) if self.sort_key else len(self.order)
+            self.tree.insert("", index, iid=iid, values=values)
+            self.rows[iid] = values
+
+        self.sort_keys[iid] = sort_key
+        self.order.insert(index, iid)
+
+    def remove(self, key):
+        iid = str(key)
+        if iid not in self.rows:
+            return
+        self.tree.delete(iid)
+        self.order.remove(iid)
+        del self.rows[iid]
+        del self.sort_keys[iid]
+
+    def clear(self):
+        self.sync([])
+
+class LiveSearch:
+    DEBOUNCE_MS = 250
+
+    def __init__(self, status_bar, entry, search_fn, all_query, fields, show_rows, limit=SEARCH_LIMIT):
+        self.status_bar = status_bar
+        self.entry = entry
+        self.search_fn = search_fn
+        self.all_query = all_query
+        self.fields = fields
+        self.show_rows = show_rows
+        self.limit = limit
+        self.cached_term = None
+        self.cached_rows = []
+        self.pending = None
+        self.task = None
+        entry.bind("<KeyRelease>", self.on_key)
+
+    def on_key(self, event=None):
+        # A keystroke makes the running search stale: it is cancelled now,
+        # so it frees its worker and never draws its rows.
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.pending is not None:
+            self.entry.after_cancel(self.pending)
+        self.pending = self.entry.after(self.DEBOUNCE_MS, self.run)
+
+    def run(self):
+        self.pending = None
+        term = self.entry.get().strip()
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+        # A longer term can only match a subset of what the shorter one did,
+        # so an untruncated cached result is narrowed without a new query.
+        if (self.cached_term and term.casefold().startswith(self.cached_term.casefold())
+                and len(self.cached_rows) < self.limit):
+            needle = term.casefold()
+            rows = [row for row in self.cached_rows
+                    if any(needle in str(row[f] or "").casefold() for f in self.fields)]
+            self.remember(term, rows)
+            return
+
+        def on_loaded(rows):
+            self.task = None
+            self.remember(term, rows)
+
+        self.task = self.status_bar.run(self.fetch, term, on_success=on_loaded, message="در حال جستجو...")
+
+    def fetch(self, term):
+        if not term:
+            return self.status_bar.db.run_query(self.all_query)
+        return self.search_fn(term)
+
+    def remember(self, term, rows):
+        self.cached_term = term
+        self.cached_rows = rows
+        self.show_rows(rows)
+
+    def invalidate(self):
+        self.cached_term = None
+        self.cached_rows = []
+
+    def refresh(self):
+        self.invalidate()
+        self.run()
+
+class CustomerPicker(ttk.Frame):
+    # An entry with a drop-down of matching customers, answered from the
+    # catalog cache on the Tk thread without touching the database.
+    VISIBLE_ROWS = 8
+
+    def __init__(self, parent, catalog):
+        super().__init__(parent)
+        self.catalog = catalog
+        self.customer_id = None
+        self.matches = []
+
+        self.entry = ttk.Entry(self)
+        self.entry.pack(fill="x", expand=True)
+        self.entry.bind("<KeyRelease>", self.on_key)
+        self.entry.bind("<Down>", self.focus_list)
+        self.entry.bind("<Return>", lambda event: self.pick(0))
+        self.entry.bind("<Escape>", lambda event: self.hide())
+        self.entry.bind("<FocusOut>", lambda event: self.after(150, self.hide_unless_focused))
+
+        self.listbox = tk.Listbox(self.winfo_toplevel(), height=self.VISIBLE_ROWS, exportselection=False)
+        self.listbox.bind("<ButtonRelease-1>", self.pick_selected)
+        self.listbox.bind("<Return>", self.pick_selected)
+        self.listbox.bind("<Escape>", lambda event: (self.hide(), self.entry.focus_set()))
+
+    def on_key(self, event):
+        if event.keysym in ("Up", "Down", "Return", "Escape", "Tab"):
+            return
+        self.customer_id = None
+        self.show_matches()
+
+    def show_matches(self):
+        self.matches = self.catalog.find_customers(self.entry.get())
+        self.listbox.delete(0, "end")
+        for row in self.matches:
+            self.listbox.insert("end", f"{row['name']}  —  {row['phone'] or ''}")
+        if self.matches:
+            self.listbox.place(in_=self.entry, relx=0, rely=1, relwidth=1)
+            self.listbox.lift()
+        else:
+            self.hide()
+
+    def focus_list(self, event=None):
+        if not self.matches:
+            self.show_matches()
+        if self.matches:
+            self.listbox.focus_set()
+            self.listbox.selection_clear(0, "end")
+            self.listbox.selection_set(0)
+            self.listbox.activate(0)
+
+    def pick_selected(self, event=None):
+        selection = self.listbox.curselection()
+        if selection:
+            self.pick(selection[0])
+
+    def pick(self, index):
+        if index >= len(self.matches):
+            return
+        row = self.matches[index]
+        self.customer_id = row["customer_id"]
+        self.entry.delete(0, "end")
+        self.entry.insert(0, row["name"])
+        self.hide()
+        self.entry.focus_set()
+
+    def hide_unless_focused(self):
+        if self.winfo_exists() and self.focus_get() is not self.listbox:
+            self.hide()
+
+    def hide(self):
+        self.listbox.place_forget()
+
+    def refresh(self):
+        # The catalog was reloaded; drop a pick that no longer exists.
+        if self.customer_id is not None and self.catalog.customer(self.customer_id) is None:
+            self.customer_id = None
+        if self.listbox.winfo_ismapped():
+            self.show_matches()
 
 class CustomerWindow(tk.Toplevel):
     def __init__(self, parent, db):
@@ -79,6 +421,10 @@ class CustomerWindow(tk.Toplevel):
         self.db = db
         self.title("مدیریت مشتریان")
         self.geometry("600x400")
+
+        self.status_bar = TaskStatusBar(self, db)
+        self.status_bar.pack(side="bottom", fill="x")
+        self.service = StoreService(db)
         
         frame_form = ttk.Frame(self, padding="10")
         frame_form.pack(fill="x")
@@ -111,6 +457,8 @@ class CustomerWindow(tk.Toplevel):
         self.search_entry = ttk.Entry(frame_search)
         self.search_entry.pack(side="right", padx=5, fill="x", expand=True)
         ttk.Button(frame_search, text="جستجو", command=self.search_customer).pack(side="right")
+        self.live_search = LiveSearch(self.status_bar, self.search_entry, db.search_customers, "SELECT * FROM customers ORDER BY name",
+                                      ("name", "phone", "address"), self.show_customers)
         
         self.tree = ttk.Treeview(self, columns=("id", "name", "phone", "address"), show="headings", height=10)
         self.tree.heading("id", text="شناسه")
@@ -125,33 +473,41 @@ class CustomerWindow(tk.Toplevel):
         
         self.tree.pack(fill="both", expand=True, padx=10, pady=10)
         self.tree.bind("<<TreeviewSelect>>", self.on_customer_select)
+        self.binding = TreeBinding(self.tree, key=lambda row: row["customer_id"],
+                                   values=lambda row: (row["customer_id"], row["name"], row["phone"], row["address"]),
+                                   sort_key=lambda row: row["name"])
         
         self.load_customers()
 
-    def load_customers(self, query="SELECT * FROM customers ORDER BY name"):
-        for row in self.tree.get_children():
-            self.tree.delete(row)
-        
-        rows = self.db.execute_query(query)
-        if rows:
-            for row in rows:
-                self.tree.insert("", "end", values=(row["customer_id"], row["name"], row["phone"], row["address"]))
+    def load_customers(self):
+        self.live_search.refresh()
+
+    def show_customers(self, rows):
+        self.binding.sync(rows)
+
+    def refresh_customer(self, customer_id):
+        def on_loaded(rows):
+            if rows:
+                self.binding.upsert(rows[0])
+            else:
+                self.binding.remove(customer_id)
+
+        self.live_search.invalidate()
+        self.status_bar.query("SELECT * FROM customers WHERE customer_id = ?", (customer_id,), on_success=on_loaded)
 
     def add_customer(self):
-        name = self.name_entry.get()
-        phone = self.phone_entry.get()
-        address = self.address_entry.get()
-        
-        if not name:
-            messagebox.showwarning("خطا", "فیلد نام نمی‌تواند خالی باشد.")
+        try:
+            fields = self.service.customer_fields(self.name_entry.get(), self.phone_entry.get(), self.address_entry.get())
+        except ValidationError as e:
+            messagebox.showwarning("خطا", str(e))
             return
             
-        res = self.db.execute_query("INSERT INTO customers (name, phone, address) VALUES (?, ?, ?)",
-                                  (name, phone, address), commit=True)
-        if res != -1:
+        def on_added(customer_id):
             messagebox.showinfo("موفقیت", "مشتری با موفقیت اضافه شد.")
             self.clear_fields()
-            self.load_customers()
+            self.refresh_customer(customer_id)
+
+        self.status_bar.run(self.service.add_customer, *fields, on_success=on_added, message="در حال ذخیره...")
         
     def update_customer(self):
         selected_item = self.tree.focus()
@@ -160,20 +516,19 @@ class CustomerWindow(tk.Toplevel):
             return
             
         customer_id = self.tree.item(selected_item)["values"][0]
-        name = self.name_entry.get()
-        phone = self.phone_entry.get()
-        address = self.address_entry.get()
-        
-        if not name:
-            messagebox.showwarning("خطا", "فیلد نام نمی‌تواند خالی باشد.")
+        try:
+            fields = self.service.customer_fields(self.name_entry.get(), self.phone_entry.get(), self.address_entry.get())
+        except ValidationError as e:
+            messagebox.showwarning("خطا", str(e))
             return
             
-        res = self.db.execute_query("UPDATE customers SET name=?, phone=?, address=? WHERE customer_id=?",
-                                  (name, phone, address, customer_id), commit=True)
-        if res != -1:
+        def on_updated(_):
             messagebox.showinfo("موفقیت", "مشتری با موفقیت ویرایش شد.")
             self.clear_fields()
-            self.load_customers()
+            self.refresh_customer(customer_id)
+
+        self.status_bar.run(self.service.update_customer, customer_id, *fields,
+                            on_success=on_updated, message="در حال ذخیره...")
 
     def delete_customer(self):
         selected_item = self.tree.focus()
@@ -186,16 +541,16 @@ class CustomerWindow(tk.Toplevel):
             
         customer_id = self.tree.item(selected_item)["values"][0]
         
-        res = self.db.execute_query("DELETE FROM customers WHERE customer_id=?", (customer_id,), commit=True)
-        if res != -1:
+        def on_deleted(_):
             messagebox.showinfo("موفقیت", "مشتری با موفقیت حذف شد.")
             self.clear_fields()
-            self.load_customers()
+            self.live_search.invalidate()
+            self.binding.remove(customer_id)
+
+        self.status_bar.run(self.service.delete_customer, customer_id, on_success=on_deleted, message="در حال حذف...")
 
     def search_customer(self):
-        search_term = self.search_entry.get()
-        query = f"SELECT * FROM customers WHERE name LIKE '%{search_term}%' OR phone LIKE '%{search_term}%' ORDER BY name"
-        self.load_customers(query)
+        self.live_search.run()
 
     def clear_fields(self):
         self.name_entry.delete(0, "end")
@@ -220,6 +575,10 @@ class ProductWindow(tk.Toplevel):
         self.db = db
         self.title("مدیریت کالاها")
         self.geometry("600x400")
+
+        self.status_bar = TaskStatusBar(self, db)
+        self.status_bar.pack(side="bottom", fill="x")
+        self.service = StoreService(db)
         
         frame_form = ttk.Frame(self, padding="10")
         frame_form.pack(fill="x")
@@ -228,7 +587,7 @@ class ProductWindow(tk.Toplevel):
         self.name_entry = ttk.Entry(frame_form)
         self.name_entry.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
         
-        ttk.Label(frame_form, text="قیمت واحد:").grid(row=1, column=0, padx=5, pady=5, sticky="w")
+        ttk.Label(frame_form, text="قیمت واحد (تومان):").grid(row=1, column=0, padx=5, pady=5, sticky="w")
         self.price_entry = ttk.Entry(frame_form)
         self.price_entry.grid(row=1, column=1, padx=5, pady=5, sticky="ew")
         
@@ -252,11 +611,13 @@ class ProductWindow(tk.Toplevel):
         self.search_entry = ttk.Entry(frame_search)
         self.search_entry.pack(side="right", padx=5, fill="x", expand=True)
         ttk.Button(frame_search, text="جستجو", command=self.search_product).pack(side="right")
+        self.live_search = LiveSearch(self.status_bar, self.search_entry, db.search_products, "SELECT * FROM products ORDER BY name",
+                                      ("name",), self.show_products)
         
         self.tree = ttk.Treeview(self, columns=("id", "name", "price", "stock"), show="headings", height=10)
         self.tree.heading("id", text="شناسه")
         self.tree.heading("name", text="نام کالا")
-        self.tree.heading("price", text="قیمت")
+        self.tree.heading("price", text="قیمت (تومان)")
         self.tree.heading("stock", text="موجودی")
         
         self.tree.column("id", width=50)
@@ -266,40 +627,42 @@ class ProductWindow(tk.Toplevel):
         
         self.tree.pack(fill="both", expand=True, padx=10, pady=10)
         self.tree.bind("<<TreeviewSelect>>", self.on_product_select)
+        self.binding = TreeBinding(self.tree, key=lambda row: row["product_id"],
+                                   values=lambda row: (row["product_id"], row["name"], format_toman(row["price"]), row["stock"]),
+                                   sort_key=lambda row: row["name"])
         
         self.load_products()
 
-    def load_products(self, query="SELECT * FROM products ORDER BY name"):
-        for row in self.tree.get_children():
-            self.tree.delete(row)
-        
-        rows = self.db.execute_query(query)
-        if rows:
-            for row in rows:
-                self.tree.insert("", "end", values=(row["product_id"], row["name"], row["price"], row["stock"]))
+    def load_products(self):
+        self.live_search.refresh()
+
+    def show_products(self, rows):
+        self.binding.sync(rows)
+
+    def refresh_product(self, product_id):
+        def on_loaded(rows):
+            if rows:
+                self.binding.upsert(rows[0])
+            else:
+                self.binding.remove(product_id)
+
+        self.live_search.invalidate()
+        self.status_bar.query("SELECT * FROM products WHERE product_id = ?", (product_id,), on_success=on_loaded)
 
     def add_product(self):
-        name = self.name_entry.get()
-        price = self.price_entry.get()
-        stock = self.stock_entry.get()
-        
-        if not name or not price or not stock:
-            messagebox.showwarning("خطا", "تمام فیلدها باید پر شوند.")
-            return
-            
         try:
-            price_val = float(price)
-            stock_val = int(stock)
-        except ValueError:
-            messagebox.showwarning("خطا", "قیمت و موجودی باید عدد باشند.")
+            fields = self.service.product_fields(self.name_entry.get(), parse_toman(self.price_entry.get()),
+                                                 self.stock_entry.get())
+        except ValidationError as e:
+            messagebox.showwarning("خطا", str(e))
             return
             
-        res = self.db.execute_query("INSERT INTO products (name, price, stock) VALUES (?, ?, ?)",
-                                  (name, price_val, stock_val), commit=True)
-        if res != -1:
+        def on_added(product_id):
             messagebox.showinfo("موفقیت", "کالا با موفقیت اضافه شد.")
             self.clear_fields()
-            self.load_products()
+            self.refresh_product(product_id)
+
+        self.status_bar.run(self.service.add_product, *fields, on_success=on_added, message="در حال ذخیره...")
         
     def update_product(self):
         selected_item = self.tree.focus()
@@ -308,27 +671,20 @@ class ProductWindow(tk.Toplevel):
             return
             
         product_id = self.tree.item(selected_item)["values"][0]
-        name = self.name_entry.get()
-        price = self.price_entry.get()
-        stock = self.stock_entry.get()
-        
-        if not name or not price or not stock:
-            messagebox.showwarning("خطا", "تمام فیلدها باید پر شوند.")
-            return
-            
         try:
-            price_val = float(price)
-            stock_val = int(stock)
-        except ValueError:
-            messagebox.showwarning("خطا", "قیمت و موجودی باید عدد باشند.")
+            fields = self.service.product_fields(self.name_entry.get(), parse_toman(self.price_entry.get()),
+                                                 self.stock_entry.get())
+        except ValidationError as e:
+            messagebox.showwarning("خطا", str(e))
             return
 
-        res = self.db.execute_query("UPDATE products SET name=?, price=?, stock=? WHERE product_id=?",
-                                  (name, price_val, stock_val, product_id), commit=True)
-        if res != -1:
+        def on_updated(_):
             messagebox.showinfo("موفقیت", "کالا با موفقیت ویرایش شد.")
             self.clear_fields()
-            self.load_products()
+            self.refresh_product(product_id)
+
+        self.status_bar.run(self.service.update_product, product_id, *fields,
+                            on_success=on_updated, message="در حال ذخیره...")
 
     def delete_product(self):
         selected_item = self.tree.focus()
@@ -341,16 +697,16 @@ class ProductWindow(tk.Toplevel):
             
         product_id = self.tree.item(selected_item)["values"][0]
         
-        res = self.db.execute_query("DELETE FROM products WHERE product_id=?", (product_id,), commit=True)
-        if res != -1:
+        def on_deleted(_):
             messagebox.showinfo("موفقیت", "کالا با موفقیت حذف شد.")
             self.clear_fields()
-            self.load_products()
+            self.live_search.invalidate()
+            self.binding.remove(product_id)
+
+        self.status_bar.run(self.service.delete_product, product_id, on_success=on_deleted, message="در حال حذف...")
 
     def search_product(self):
-        search_term = self.search_entry.get()
-        query = f"SELECT * FROM products WHERE name LIKE '%{search_term}%' ORDER BY name"
-        self.load_products(query)
+        self.live_search.run()
 
     def clear_fields(self):
         self.name_entry.delete(0, "end")
@@ -377,12 +733,16 @@ class NewInvoiceWindow(tk.Toplevel):
         self.title("ثبت فاکتور جدید")
         self.geometry("800x600")
 
+        self.status_bar = TaskStatusBar(self, db)
+        self.status_bar.pack(side="bottom", fill="x")
+        self.service = StoreService(db)
+
         frame_top = ttk.Frame(self, padding=10)
         frame_top.pack(fill="x")
         
         ttk.Label(frame_top, text="مشتری:").pack(side="right", padx=5)
-        self.customer_combo = ttk.Combobox(frame_top, state="readonly")
-        self.customer_combo.pack(side="right", fill="x", expand=True, padx=5)
+        self.customer_picker = CustomerPicker(frame_top, db.catalog)
+        self.customer_picker.pack(side="right", fill="x", expand=True, padx=5)
         
         self.total_label = ttk.Label(frame_top, text="مجموع: 0 تومان", font=("Arial", 12, "bold"))
         self.total_label.pack(side="left", padx=10)
@@ -394,7 +754,7 @@ class NewInvoiceWindow(tk.Toplevel):
         self.product_tree = ttk.Treeview(frame_products, columns=("id", "name", "price", "stock"), show="headings", height=8)
         self.product_tree.heading("id", text="شناسه")
         self.product_tree.heading("name", text="نام کالا")
-        self.product_tree.heading("price", text="قیمت")
+        self.product_tree.heading("price", text="قیمت (تومان)")
         self.product_tree.heading("stock", text="موجودی")
         self.product_tree.column("id", width=50)
         self.product_tree.pack(fill="both", expand=True, pady=5)
@@ -413,7 +773,7 @@ class NewInvoiceWindow(tk.Toplevel):
         self.cart_tree = ttk.Treeview(frame_cart, columns=("id", "name", "price", "qty", "subtotal"), show="headings", height=8)
         self.cart_tree.heading("id", text="شناسه")
         self.cart_tree.heading("name", text="نام کالا")
-        self.cart_tree.heading("price", text="قیمت")
+        self.cart_tree.heading("price", text="قیمت (تومان)")
         self.cart_tree.heading("qty", text="تعداد")
         self.cart_tree.heading("subtotal", text="جمع جزء")
         self.cart_tree.column("id", width=50)
@@ -426,23 +786,28 @@ class NewInvoiceWindow(tk.Toplevel):
         frame_bottom = ttk.Frame(self, padding=10)
         frame_bottom.pack(fill="x")
         ttk.Button(frame_bottom, text="ثبت نهایی فاکتور", command=self.save_invoice).pack(expand=True)
+
+        self.product_binding = TreeBinding(self.product_tree, key=lambda p: p["product_id"],
+                                           values=lambda p: (p["product_id"], p["name"], format_toman(p["price"]), p["stock"]))
+        self.cart_binding = TreeBinding(self.cart_tree, key=lambda line: line[0],
+                                        values=lambda line: (line[0], line[1], format_toman(line[2]), line[3],
+                                                             format_toman(line[4])))
         
         self.load_customers_and_products()
 
     def load_customers_and_products(self):
-        customers = self.db.execute_query("SELECT customer_id, name FROM customers ORDER BY name")
-        if customers:
-            self.customer_combo["values"] = [f"{c['name']} (ID: {c['customer_id']})" for c in customers]
-        
+        # A catalog loaded earlier is shown right away; the refresh only
+        # reloads tables whose version has moved since then.
+        if self.db.catalog.loaded:
+            self.show_catalog(self.db.catalog)
         self.load_products()
 
     def load_products(self):
-        for row in self.product_tree.get_children():
-            self.product_tree.delete(row)
-        products = self.db.execute_query("SELECT * FROM products WHERE stock > 0 ORDER BY name")
-        if products:
-            for p in products:
-                self.product_tree.insert("", "end", values=(p["product_id"], p["name"], p["price"], p["stock"]))
+        self.status_bar.run(self.db.catalog.refresh, on_success=self.show_catalog, message="در حال بارگذاری کالاها...")
+
+    def show_catalog(self, catalog):
+        self.product_binding.sync(catalog.products_in_stock())
+        self.customer_picker.refresh()
 
     def add_to_cart(self):
         selected_item = self.product_tree.focus()
@@ -461,10 +826,13 @@ class NewInvoiceWindow(tk.Toplevel):
         product = self.product_tree.item(selected_item)["values"]
         product_id = product[0]
         product_name = product[1]
-        unit_price = float(product[2])
+        unit_price = parse_toman(product[2])
         stock = int(product[3])
+        in_cart = self.cart[product_id]["quantity"] if product_id in self.cart else 0
         
-        if quantity > stock:
+        # Only a hint: the stock shown may be stale, and save_invoice is
+        # where the reservation is actually checked.
+        if quantity + in_cart > stock:
             messagebox.showwarning("خطا", f"موجودی کالا کافی نیست. (موجودی: {stock})")
             return
         
@@ -494,69 +862,68 @@ class NewInvoiceWindow(tk.Toplevel):
         self.refresh_cart_tree()
 
     def refresh_cart_tree(self):
-        for row in self.cart_tree.get_children():
-            self.cart_tree.delete(row)
-        
+        lines = []
         total = 0
         for pid, item in self.cart.items():
             subtotal = item["price"] * item["quantity"]
-            self.cart_tree.insert("", "end", values=(pid, item["name"], item["price"], item["quantity"], subtotal))
+            lines.append((pid, item["name"], item["price"], item["quantity"], subtotal))
             total += subtotal
+        self.cart_binding.sync(lines)
             
-        self.total_label.config(text=f"مجموع: {total:,.2f} تومان")
+        self.total_label.config(text=f"مجموع: {format_toman(total)} تومان")
         self.current_total = total
 
     def save_invoice(self):
-        customer_selection = self.customer_combo.get()
-        if not customer_selection:
+        customer_id = self.customer_picker.customer_id
+        if customer_id is None:
             messagebox.showwarning("خطا", "مشتری انتخاب نشده است.")
             return
             
         if not self.cart:
             messagebox.showwarning("خطا", "سبد خرید خالی است.")
             return
-            
-        try:
-            customer_id = int(customer_selection.split("(ID: ")[1].replace(")", ""))
-        except Exception:
-            messagebox.showerror("خطا", "خطا در شناسایی مشتری.")
-            return
         
-        invoice_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        total_amount = self.current_total
-        
-        try:
-            with self.db.get_conn() as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute("INSERT INTO invoices (customer_id, date, total_amount) VALUES (?, ?, ?)",
-                               (customer_id, invoice_date, total_amount))
-                invoice_id = cursor.lastrowid
-                
-                for pid, item in self.cart.items():
-                    subtotal = item["price"] * item["quantity"]
-                    cursor.execute("""
-                        INSERT INTO invoice_items 
-                        (invoice_id, product_id, product_name, unit_price, quantity, subtotal) 
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    """, (invoice_id, pid, item["name"], item["price"], item["quantity"], subtotal))
-                    
-                    cursor.execute("UPDATE products SET stock = stock - ? WHERE product_id = ?",
-                                   (item["quantity"], pid))
-                
-                conn.commit()
-                messagebox.showinfo("موفقیت", f"فاکتور شماره {invoice_id} با موفقیت ثبت شد.")
-                self.destroy()
-                
-        except sqlite3.Error as e:
-            messagebox.showerror("خطای دیتابیس", f"خطا در ثبت فاکتور: {e}")
+        def on_saved(invoice_id):
+            messagebox.showinfo("موفقیت", f"فاکتور شماره {invoice_id} با موفقیت ثبت شد.")
+            self.destroy()
+
+        def on_failed(e):
+            if isinstance(e, StockError):
+                lines = []
+                for pid, requested, available in e.shortages:
+                    name = cart[pid]["name"] if pid in cart else pid
+                    if available is None:
+                        lines.append(f"{name}: کالا حذف شده است")
+                    else:
+                        lines.append(f"{name}: درخواست {requested}، موجودی {available}")
+                messagebox.showwarning("موجودی ناکافی", "موجودی این کالاها کافی نیست:\n" + "\n".join(lines), parent=self)
+                self.load_products()
+                return
+            messagebox.showerror("خطای دیتابیس", f"خطا در ثبت فاکتور: {e}", parent=self)
+
+        cart = {pid: dict(item) for pid, item in self.cart.items()}
+        quantities = {pid: item["quantity"] for pid, item in cart.items()}
+        self.status_bar.run(self.service.create_invoice, customer_id, quantities,
+                            on_success=on_saved, on_error=on_failed, message="در حال ثبت فاکتور...")
 
 class ViewInvoicesWindow(tk.Toplevel):
+    PAGE_SIZE = INVOICE_PAGE_SIZE
+    MAX_LOADED_ROWS = 500
+    PREFETCH_MARGIN = 0.2
+
     def __init__(self, parent, db):
         super().__init__(parent)
         self.db = db
+        self.has_older = False
+        self.has_newer = False
+        self.paging = False
+        self.page_generation = 0
         self.title("مشاهده فاکتورها")
         self.geometry("900x600")
+
+        self.status_bar = TaskStatusBar(self, db)
+        self.status_bar.pack(side="bottom", fill="x")
+        self.service = StoreService(db)
         
         frame_main = ttk.Frame(self, padding=10)
         frame_main.pack(fill="both", expand=True)
@@ -574,17 +941,31 @@ class ViewInvoicesWindow(tk.Toplevel):
         self.invoice_tree.heading("id", text="شماره فاکتور")
         self.invoice_tree.heading("customer", text="مشتری")
         self.invoice_tree.heading("date", text="تاریخ")
-        self.invoice_tree.heading("total", text="مبلغ کل")
+        self.invoice_tree.heading("total", text="مبلغ کل (تومان)")
         self.invoice_tree.column("id", width=80)
         self.invoice_tree.column("customer", width=150)
         self.invoice_tree.column("date", width=150)
         self.invoice_tree.column("total", width=100)
+        self.invoice_scroll = ttk.Scrollbar(frame_invoices, orient="vertical", command=self.invoice_tree.yview)
+        self.invoice_tree.configure(yscrollcommand=self.on_invoice_scroll)
+        self.invoice_scroll.pack(side="right", fill="y")
         self.invoice_tree.pack(fill="both", expand=True)
         self.invoice_tree.bind("<<TreeviewSelect>>", self.load_invoice_details)
 
         frame_buttons = ttk.Frame(frame_main)
         frame_buttons.grid(row=0, column=1, sticky="ew", padx=5)
         ttk.Button(frame_buttons, text="حذف فاکتور", command=self.delete_invoice).pack(fill="x")
+        ttk.Button(frame_buttons, text="خروجی فاکتورها...",
+                   command=lambda: run_export(self, self.db.export_table, "invoices")).pack(fill="x", pady=(5, 0))
+        ttk.Button(frame_buttons, text="خروجی اقلام فاکتورها...",
+                   command=lambda: run_export(self, self.db.export_table, "items")).pack(fill="x", pady=(5, 0))
+
+        frame_jump = ttk.Frame(frame_buttons)
+        frame_jump.pack(fill="x", pady=5)
+        self.jump_entry = ttk.Entry(frame_jump, width=12)
+        self.jump_entry.pack(side="right", fill="x", expand=True)
+        self.jump_entry.insert(0, datetime.now().strftime("%Y-%m-%d"))
+        ttk.Button(frame_jump, text="برو به تاریخ", command=self.jump_to_date).pack(side="right", padx=5)
         
         frame_items = ttk.Frame(frame_main, padding=5)
         frame_items.grid(row=1, column=1, rowspan=2, sticky="nsew", padx=5)
@@ -592,7 +973,7 @@ class ViewInvoicesWindow(tk.Toplevel):
         ttk.Label(frame_items, text="جزئیات اقلام فاکتور").pack()
         self.items_tree = ttk.Treeview(frame_items, columns=("name", "price", "qty", "subtotal"), show="headings")
         self.items_tree.heading("name", text="نام کالا")
-        self.items_tree.heading("price", text="قیمت واحد")
+        self.items_tree.heading("price", text="قیمت واحد (تومان)")
         self.items_tree.heading("qty", text="تعداد")
         self.items_tree.heading("subtotal", text="جمع جزء")
         self.items_tree.column("name", width=120)
@@ -600,39 +981,132 @@ class ViewInvoicesWindow(tk.Toplevel):
         self.items_tree.column("qty", width=50)
         self.items_tree.column("subtotal", width=80)
         self.items_tree.pack(fill="both", expand=True)
+        self.items_binding = TreeBinding(self.items_tree, key=lambda row: row["item_id"],
+                                         values=lambda row: (row["product_name"], format_toman(row["unit_price"]), row["quantity"],
+                                                             format_toman(row["subtotal"])))
         
         self.load_invoices()
 
-    def load_invoices(self):
-        for row in self.invoice_tree.get_children():
-            self.invoice_tree.delete(row)
-        
-        query = """
-            SELECT i.invoice_id, c.name, i.date, i.total_amount 
-            FROM invoices i
-            JOIN customers c ON i.customer_id = c.customer_id
-            ORDER BY i.date DESC
-        """
-        rows = self.db.execute_query(query)
-        if rows:
-            for row in rows:
-                self.invoice_tree.insert("", "end", values=(row["invoice_id"], row["name"], row["date"], f"{row['total_amount']:,.0f}"))
+    def load_invoices(self, before_date=None):
+        # The newest page is fetched with an upper bound past any stored date.
+        key = (before_date, 0) if before_date else ("\uffff", 0)
+        self.page_generation += 1
+        generation = self.page_generation
+        self.paging = True
+
+        def on_loaded(rows):
+            if generation != self.page_generation:
+                return
+            for row in self.invoice_tree.get_children():
+                self.invoice_tree.delete(row)
+            self.has_newer = before_date is not None
+            self.has_older = len(rows) == self.PAGE_SIZE
+            self.insert_invoice_rows(rows, "end")
+            self.paging = False
+
+        self.status_bar.run(self.db.invoice_page, key, self.PAGE_SIZE,
+                            on_success=on_loaded, on_error=self.on_page_error)
+
+    def jump_to_date(self):
+        try:
+            day = datetime.strptime(self.jump_entry.get().strip(), "%Y-%m-%d")
+        except ValueError:
+            messagebox.showwarning("خطا", "تاریخ باید به شکل YYYY-MM-DD باشد.")
+            return
+        next_day = (day + timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
+        self.load_invoices(before_date=next_day)
+
+    def insert_invoice_rows(self, rows, index):
+        for row in rows:
+            self.invoice_tree.insert("", index, iid=str(row["invoice_id"]),
+                                     values=(row["invoice_id"], row["name"], row["date"], format_toman(row["total_amount"])))
+            if index != "end":
+                index += 1
+
+    def invoice_key(self, item):
+        return (self.invoice_tree.set(item, "date"), int(item))
+
+    def on_invoice_scroll(self, first, last):
+        self.invoice_scroll.set(first, last)
+        if self.paging:
+            return
+        if float(last) >= 1 - self.PREFETCH_MARGIN and self.has_older:
+            self.paging = True
+            self.after_idle(self.load_older_page)
+        elif float(first) <= self.PREFETCH_MARGIN and self.has_newer:
+            self.paging = True
+            self.after_idle(self.load_newer_page)
+
+    def on_page_error(self, e):
+        self.paging = False
+        messagebox.showerror("خطای دیتابیس", f"خطا در بارگذاری فاکتورها: {e}", parent=self)
+
+    def load_older_page(self):
+        children = self.invoice_tree.get_children()
+        if not children:
+            self.paging = False
+            return
+        generation = self.page_generation
+
+        def on_loaded(rows):
+            if generation != self.page_generation:
+                return
+            current = self.invoice_tree.get_children()
+            self.has_older = len(rows) == self.PAGE_SIZE
+            self.insert_invoice_rows(rows, "end")
+
+            overflow = len(current) + len(rows) - self.MAX_LOADED_ROWS
+            if overflow > 0:
+                anchor = self.invoice_tree.identify_row(1) or current[-1]
+                self.invoice_tree.delete(*current[:overflow])
+                self.has_newer = True
+                self.invoice_tree.see(anchor)
+            self.paging = False
+
+        key = self.invoice_key(children[-1])
+        self.status_bar.run(self.db.invoice_page, key, self.PAGE_SIZE,
+                            on_success=on_loaded, on_error=self.on_page_error)
+
+    def load_newer_page(self):
+        children = self.invoice_tree.get_children()
+        if not children:
+            self.paging = False
+            return
+        generation = self.page_generation
+
+        def on_loaded(rows):
+            if generation != self.page_generation:
+                return
+            current = self.invoice_tree.get_children()
+            self.has_newer = len(rows) == self.PAGE_SIZE
+            self.insert_invoice_rows(list(reversed(rows)), 0)
+
+            overflow = len(current) + len(rows) - self.MAX_LOADED_ROWS
+            if overflow > 0:
+                self.invoice_tree.delete(*current[-overflow:])
+                self.has_older = True
+            if rows:
+                self.invoice_tree.yview(len(rows))
+            self.paging = False
+
+        key = self.invoice_key(children[0])
+        self.status_bar.run(self.db.invoice_page, key, self.PAGE_SIZE, True,
+                            on_success=on_loaded, on_error=self.on_page_error)
 
     def load_invoice_details(self, event=None):
-        for row in self.items_tree.get_children():
-            self.items_tree.delete(row)
-            
         selected_item = self.invoice_tree.focus()
         if not selected_item:
+            self.items_binding.clear()
             return
             
         invoice_id = self.invoice_tree.item(selected_item)["values"][0]
+
+        def show_details(rows):
+            if self.invoice_tree.focus() == selected_item:
+                self.items_binding.sync(rows)
         
-        query = "SELECT product_name, unit_price, quantity, subtotal FROM invoice_items WHERE invoice_id = ?"
-        rows = self.db.execute_query(query, (invoice_id,))
-        if rows:
-            for row in rows:
-                self.items_tree.insert("", "end", values=(row["product_name"], row["unit_price"], row["quantity"], row["subtotal"]))
+        self.status_bar.run(self.db.invoice_lines, invoice_id, self.invoice_tree.set(selected_item, "date"),
+                            on_success=show_details)
 
     def delete_invoice(self):
         selected_item = self.invoice_tree.focus()
@@ -644,69 +1118,72 @@ class ViewInvoicesWindow(tk.Toplevel):
             return
             
         invoice_id = self.invoice_tree.item(selected_item)["values"][0]
-        
-        try:
-            with self.db.get_conn() as conn:
-                cursor = conn.cursor()
-                
-                items_to_restore = cursor.execute("SELECT product_id, quantity FROM invoice_items WHERE invoice_id = ?", (invoice_id,)).fetchall()
-                
-                for item in items_to_restore:
-                    cursor.execute("UPDATE products SET stock = stock + ? WHERE product_id = ?", (item["quantity"], item["product_id"]))
-                
-                cursor.execute("DELETE FROM invoices WHERE invoice_id = ?", (invoice_id,))
-                
-                conn.commit()
-                messagebox.showinfo("موفقیت", "فاکتور با موفقیت حذف شد و موجودی کالاها بروزرسانی شد.")
-                self.load_invoices()
-                for row in self.items_tree.get_children():
-                    self.items_tree.delete(row)
-                    
-        except sqlite3.Error as e:
-            messagebox.showerror("خطای دیتابیس", f"خطا در حذف فاکتور: {e}")
+
+        def on_deleted(_):
+            messagebox.showinfo("موفقیت", "فاکتور با موفقیت حذف شد و موجودی کالاها بروزرسانی شد.")
+            if self.invoice_tree.exists(selected_item):
+                self.invoice_tree.delete(selected_item)
+            self.items_binding.clear()
+
+        def on_failed(e):
+            messagebox.showerror("خطای دیتابیس", f"خطا در حذف فاکتور: {e}", parent=self)
+
+        self.status_bar.run(self.service.delete_invoice, invoice_id,
+                            on_success=on_deleted, on_error=on_failed, message="در حال حذف فاکتور...")
 
 class ReportsWindow(tk.Toplevel):
+    ROW_CAP = 2000
+    STREAM_POLL = 20
+    BATCHES_PER_TICK = 4
+    QUEUED_BATCHES = 4
+
     def __init__(self, parent, db):
         super().__init__(parent)
         self.db = db
         self.title("گزارش‌ها")
         self.geometry("800x600")
+
+        self.status_bar = TaskStatusBar(self, db)
+        self.status_bar.pack(side="bottom", fill="x")
+        self.report_task = None
+        self.stream = None
+        self.rows_shown = 0
+        self.stream_task = None
+        self.stream_report = None
+        self.stream_param = ""
+        self.stream_parallel = False
+        self.stream_fresh = False
+        self.money_columns = ()
         
         frame_controls = ttk.Frame(self, padding=10)
         frame_controls.pack(fill="x")
 
-        self.report_list = [
-            "1. مجموع فروش هر کالا (تعداد)",
-            "2. کالاها با فروش بیشتر از 10 عدد",
-            "3. مجموع خرید هر مشتری (مبلغ)",
-            "4. مشتریان با خرید بالای 500",
-            "5. فاکتورهای با مبلغ بالای 1000",
-            "6. کالاها با فروش کمتر از 5 عدد",
-            "7. پرفروش‌ترین کالا (مبلغ)",
-            "8. بهترین مشتریان (م مبلغ)",
-            "9. کالاهای با موجودی کمتر از 5",
-            "10. فروش کالا در ماه خاص (مثال: 2024-10)",
-            "11. مشتریان فعال در ماه خاص (مثال: 2024-10)",
-            "12. فاکتورهای با بیش از 5 قلم کالا",
-            "13. کالاهای فروخته شده کمتر از 3 بار",
-            "14. مجموع خرید هر مشتری (تعداد)",
-            "15. مشتریان با بیش از 3 فاکتور",
-            "16. کالاها با فروش بیش از 500 (مبلغ)",
-            "17. خرید مشتری در 3 ماه گذشته",
-            "18. کالاها با موجودی بین 5 تا 10",
-            "19. مشتریان بدون خرید در ماه گذشته",
-            "20. مجموع فروش روزانه هر کالا (تعداد)"
-        ]
+        self.report_list = REPORT_LIST
         
         self.report_combo = ttk.Combobox(frame_controls, values=self.report_list, state="readonly", width=60)
         self.report_combo.pack(side="right", fill="x", expand=True, padx=5)
         self.report_combo.current(0)
+        self.report_combo.bind("<<ComboboxSelected>>", self.on_report_selected)
         
         self.param_entry = ttk.Entry(frame_controls, width=15)
         self.param_entry.pack(side="right", padx=5)
         self.param_entry.insert(0, "YYYY-MM")
         
         ttk.Button(frame_controls, text="اجرای گزارش", command=self.run_report).pack(side="right")
+        ttk.Button(frame_controls, text="خروجی...", command=self.export_report).pack(side="right", padx=5)
+        self.parallel = tk.BooleanVar(value=False)
+        self.parallel_check = ttk.Checkbutton(frame_controls, text="محاسبه موازی از فاکتورها", variable=self.parallel)
+        self.parallel_check.pack(side="right", padx=5)
+        self.on_report_selected()
+
+        frame_info = ttk.Frame(self, padding=(10, 0))
+        frame_info.pack(fill="x")
+        self.cache_label = ttk.Label(frame_info, text="")
+        self.cache_label.pack(side="right")
+        self.more_button = ttk.Button(frame_info, text="نمایش بیشتر", command=self.load_more, state="disabled")
+        self.more_button.pack(side="left")
+        self.rows_label = ttk.Label(frame_info, text="")
+        self.rows_label.pack(side="left", padx=5)
         
         self.tree_frame = ttk.Frame(self)
         self.tree_frame.pack(fill="both", expand=True, padx=10, pady=10)
@@ -720,9 +1197,22 @@ class ReportsWindow(tk.Toplevel):
         self.v_scroll.pack(side="right", fill="y")
         self.h_scroll.pack(side="bottom", fill="x")
         self.tree.pack(fill="both", expand=True)
+
+        # Report rows have no primary key; the grouping columns identify them.
+        self.binding = TreeBinding(self.tree, key=lambda row: tuple(row)[:-1] if len(row) > 1 else row[0],
+                                   values=self.report_values)
+
+    def on_report_selected(self, event=None):
+        report = REPORTS[self.report_combo.current()]
+        self.parallel_check.config(state="normal" if report.partial is not None else "disabled")
+
+    def report_values(self, row):
+        return tuple(format_toman(value) if i in self.money_columns else value for i, value in enumerate(row))
         
     def setup_tree_columns(self, columns):
         if hasattr(self, 'tree'):
+            if tuple(self.tree["columns"]) == tuple(columns):
+                return
             self.tree.destroy()
             
         self.tree = ttk.Treeview(self.tree_frame, columns=columns, show="headings")
@@ -735,226 +1225,322 @@ class ReportsWindow(tk.Toplevel):
         self.tree.pack(fill="both", expand=True)
         self.v_scroll.config(command=self.tree.yview)
         self.h_scroll.config(command=self.tree.xview)
+        self.binding.rebind(self.tree)
 
     def run_report(self):
-        for row in self.tree.get_children():
-            self.tree.delete(row)
+        if self.report_task is not None:
+            self.report_task.cancel()
 
-        selected_report = self.report_combo.get()
-        param = self.param_entry.get()
-        query = ""
-        params = ()
-        columns = []
+        report = REPORTS[self.report_combo.current()]
+        self.stream_report = report.number
+        self.stream_param = self.param_entry.get()
+        self.stream_parallel = self.parallel.get()
+        self.rows_shown = 0
+        self.rows_label.config(text="")
+        self.stream_fresh = True
+        self.money_columns = report.money
+        self.start_stream()
 
-        try:
-            if selected_report.startswith("1."):
-                columns = ["نام کالا", "مجموع تعداد فروش"]
-                query = """
-                    SELECT p.name, SUM(ii.quantity) as total_quantity
-                    FROM invoice_items ii
-                    JOIN products p ON ii.product_id = p.product_id
-                    GROUP BY p.name
-                    ORDER BY total_quantity DESC
-                """
-            elif selected_report.startswith("2."):
-                columns = ["نام کالا", "مجموع تعداد فروش"]
-                query = """
-                    SELECT p.name, SUM(ii.quantity) as total_quantity
-                    FROM invoice_items ii
-                    JOIN products p ON ii.product_id = p.product_id
-                    GROUP BY p.name
-                    HAVING total_quantity > 10
-                    ORDER BY total_quantity DESC
-                """
-            elif selected_report.startswith("3."):
-                columns = ["نام مشتری", "مجموع مبلغ خرید"]
-                query = """
-                    SELECT c.name, SUM(i.total_amount) as total_spent
-                    FROM invoices i
-                    JOIN customers c ON i.customer_id = c.customer_id
-                    GROUP BY c.name
-                    ORDER BY total_spent DESC
-                """
-            elif selected_report.startswith("4."):
-                columns = ["نام مشتری", "مجموع مبلغ خرید"]
-                query = """
-                    SELECT c.name, SUM(i.total_amount) as total_spent
-                    FROM invoices i
-                    JOIN customers c ON i.customer_id = c.customer_id
-                    GROUP BY c.name
-                    HAVING total_spent > 500
-                    ORDER BY total_spent DESC
-                """
-            elif selected_report.startswith("5."):
-                columns = ["شماره فاکتور", "نام مشتری", "مبلغ کل"]
-                query = """
-                    SELECT i.invoice_id, c.name, i.total_amount
-                    FROM invoices i
-                    JOIN customers c ON i.customer_id = c.customer_id
-                    WHERE i.total_amount > 1000
-                    ORDER BY i.total_amount DESC
-                """
-            elif selected_report.startswith("6."):
-                columns = ["نام کالا", "مجموع تعداد فروش"]
-                query = """
-                    SELECT p.name, SUM(ii.quantity) as total_quantity
-                    FROM invoice_items ii
-                    JOIN products p ON ii.product_id = p.product_id
-                    GROUP BY p.name
-                    HAVING total_quantity < 5
-                    ORDER BY total_quantity ASC
-                """
-            elif selected_report.startswith("7."):
-                columns = ["نام کالا", "مجموع مبلغ فروش"]
-                query = """
-                    SELECT ii.product_name, SUM(ii.subtotal) as total_revenue
-                    FROM invoice_items ii
-                    GROUP BY ii.product_name
-                    ORDER BY total_revenue DESC
-                    LIMIT 5
-                """
-            elif selected_report.startswith("8."):
-                columns = ["نام مشتری", "مجموع مبلغ خرید"]
-                query = """
-                    SELECT c.name, SUM(i.total_amount) as total_spent
-                    FROM invoices i
-                    JOIN customers c ON i.customer_id = c.customer_id
-                    GROUP BY c.name
-                    ORDER BY total_spent DESC
-                    LIMIT 5
-                """
-            elif selected_report.startswith("9."):
-                columns = ["نام کالا", "موجودی"]
-                query = "SELECT name, stock FROM products WHERE stock < 5 ORDER BY stock ASC"
-            
-            elif selected_report.startswith("10."):
-                columns = ["نام کالا", "تعداد فروش در ماه"]
-                query = """
-                    SELECT ii.product_name, SUM(ii.quantity) as total_quantity
-                    FROM invoice_items ii
-                    JOIN invoices i ON ii.invoice_id = i.invoice_id
-                    WHERE STRFTIME('%Y-%m', i.date) = ?
-                    GROUP BY ii.product_name
-                    ORDER BY total_quantity DESC
-                """
-                params = (param,)
-
-            elif selected_report.startswith("11."):
-                columns = ["نام مشتری", "مجموع خرید در ماه"]
-                query = """
-                    SELECT c.name, SUM(i.total_amount) as total_spent
-                    FROM invoices i
-                    JOIN customers c ON i.customer_id = c.customer_id
-                    WHERE STRFTIME('%Y-%m', i.date) = ?
-                    GROUP BY c.name
-                    ORDER BY total_spent DESC
-                """
-                params = (param,)
-
-            elif selected_report.startswith("12."):
-                columns = ["شماره فاکتور", "تعداد اقلام"]
-                query = """
-                    SELECT invoice_id, COUNT(item_id) as item_count
-                    FROM invoice_items
-                    GROUP BY invoice_id
-                    HAVING item_count > 5
-                    ORDER BY item_count DESC
-                """
-            elif selected_report.startswith("13."):
-                columns = ["نام کالا", "تعداد دفعات فروش"]
-                query = """
-                    SELECT product_name, COUNT(DISTINCT invoice_id) as sale_count
-                    FROM invoice_items
-                    GROUP BY product_name
-                    HAVING sale_count < 3
-                    ORDER BY sale_count ASC
-                """
-            elif selected_report.startswith("14."):
-                columns = ["نام مشتری", "مجموع تعداد خرید"]
-                query = """
-                    SELECT c.name, SUM(ii.quantity) as total_items
-                    FROM invoices i
-                    JOIN customers c ON i.customer_id = c.customer_id
-                    JOIN invoice_items ii ON i.invoice_id = ii.invoice_id
-                    GROUP BY c.name
-                    ORDER BY total_items DESC
-                """
-            elif selected_report.startswith("15."):
-                columns = ["نام مشتری", "تعداد فاکتور"]
-                query = """
-                    SELECT c.name, COUNT(i.invoice_id) as invoice_count
-                    FROM invoices i
-                    JOIN customers c ON i.customer_id = c.customer_id
-                    GROUP BY c.name
-                    HAVING invoice_count > 3
-                    ORDER BY invoice_count DESC
-                """
-            elif selected_report.startswith("16."):
-                columns = ["نام کالا", "مجموع مبلغ فروش"]
-                query = """
-                    SELECT product_name, SUM(subtotal) as total_revenue
-                    FROM invoice_items
-                    GROUP BY product_name
-                    HAVING total_revenue > 500
-                    ORDER BY total_revenue DESC
-                """
-            elif selected_report.startswith("17."):
-                columns = ["نام مشتری", "مجموع خرید ۳ ماه اخیر"]
-                date_3_months_ago = (datetime.now() - timedelta(days=90)).strftime("%Y-%m-%d %H:%M:%S")
-                query = """
-                    SELECT c.name, SUM(i.total_amount) as total_spent
-                    FROM invoices i
-                    JOIN customers c ON i.customer_id = c.customer_id
-                    WHERE i.date >= ?
-                    GROUP BY c.name
-                    ORDER BY total_spent DESC
-                """
-                params = (date_3_months_ago,)
-            
-            elif selected_report.startswith("18."):
-                columns = ["نام کالا", "موجودی"]
-                query = "SELECT name, stock FROM products WHERE stock BETWEEN 5 AND 10 ORDER BY stock ASC"
-
-            elif selected_report.startswith("19."):
-                date_1_month_ago = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d %H:%M:%S")
-                columns = ["نام مشتری"]
-                query = """
-                    SELECT name
-                    FROM customers
-                    WHERE customer_id NOT IN (
-                        SELECT DISTINCT customer_id FROM invoices WHERE date >= ?
-                    )
-                """
-                params = (date_1_month_ago,)
-            
-            elif selected_report.startswith("20."):
-                columns = ["تاریخ", "نام کالا", "تعداد فروش روزانه"]
-                query = """
-                    SELECT STRFTIME('%Y-%m-%d', i.date) as sale_date, ii.product_name, SUM(ii.quantity) as daily_quantity
-                    FROM invoice_items ii
-                    JOIN invoices i ON ii.invoice_id = i.invoice_id
-                    GROUP BY sale_date, ii.product_name
-                    ORDER BY sale_date DESC, daily_quantity DESC
-                """
-
-            self.setup_tree_columns(columns)
-            rows = self.db.execute_query(query, params)
-            if rows:
-                for row in rows:
-                    self.tree.insert("", "end", values=tuple(row))
-            elif rows is not None:
-                messagebox.showinfo("گزارش", "داده‌ای برای این گزارش یافت نشد.")
+    def start_stream(self):
+        # Each page is a task of its own, which ends once ROW_CAP rows are sent.
+        def on_finished(total):
+            self.report_task = None
 
-        except Exception as e:
-            messagebox.showerror("خطا", f"خطا در اجرای گزارش: {e}")
+        def on_failed(e):
+            self.report_task = None
+            self.stream = None
+            self.more_button.config(state="disabled")
+            messagebox.showerror("خطا", f"خطا در اجرای گزارش: {e}", parent=self)
+
+        self.stream = queue.Queue(maxsize=self.QUEUED_BATCHES)
+        self.more_button.config(state="disabled")
+        self.report_task = self.status_bar.run(self.db.stream_report, self.stream_report, self.stream_param,
+                                               self.stream, REPORT_BATCH_SIZE, self.stream_parallel,
+                                               self.rows_shown, self.ROW_CAP, on_success=on_finished,
+                                               on_error=on_failed, message="در حال اجرای گزارش...")
+        self.stream_task = self.report_task
+        self.after(self.STREAM_POLL, self.drain_stream, self.stream, self.stream_task)
+
+    def drain_stream(self, stream, task):
+        if stream is not self.stream or not self.winfo_exists():
+            return
+
+        for _ in range(self.BATCHES_PER_TICK):
+            try:
+                kind, payload = stream.get_nowait()
+            except queue.Empty:
+                if task.done():
+                    # Cancelled or failed before the end marker was queued.
+                    self.stream = None
+                    self.more_button.config(state="disabled")
+                    return
+                break
+
+            if kind == "columns":
+                self.setup_tree_columns(payload)
+            elif kind == "all":
+                # Cached results are complete, so they are diffed against the
+                # rows already on screen instead of being re-inserted.
+                self.binding.sync(payload)
+                self.rows_shown = len(payload)
+                self.stream_fresh = False
+            elif kind == "rows":
+                if self.stream_fresh:
+                    self.binding.clear()
+                    self.stream_fresh = False
+                self.binding.extend(payload)
+                self.rows_shown += len(payload)
+            elif kind == "more":
+                self.stream = None
+                self.more_button.config(state="normal")
+                self.rows_label.config(text=f"ردیف‌ها: {self.rows_shown:,} (ادامه دارد)")
+                return
+            elif kind == "done":
+                if self.stream_fresh:
+                    self.binding.clear()
+                self.stream = None
+                self.more_button.config(state="disabled")
+                self.rows_label.config(text=f"ردیف‌ها: {self.rows_shown:,}")
+                self.show_cache_stats()
+                if not payload:
+                    messagebox.showinfo("گزارش", "داده‌ای برای این گزارش یافت نشد.", parent=self)
+                return
+            self.rows_label.config(text=f"ردیف‌ها: {self.rows_shown:,}")
+
+        self.after(self.STREAM_POLL, self.drain_stream, stream, task)
+
+    def load_more(self):
+        if self.stream is not None or self.stream_report is None:
+            return
+        self.start_stream()
+
+    def export_report(self):
+        report = REPORTS[self.report_combo.current()]
+        run_export(self, self.db.export_report, report.number, self.param_entry.get())
+
+    def show_cache_stats(self):
+        stats = self.db.report_cache.stats()
+        self.cache_label.config(text=f"حافظه نهان گزارش‌ها: {stats['hits']} بازیابی / {stats['misses']} اجرای کامل")
+
+class ImportWindow(tk.Toplevel):
+    PROGRESS_POLL = 200
+    KIND_LABELS = {"customers": "مشتریان", "products": "کالاها", "invoices": "فاکتورهای قدیمی"}
+
+    def __init__(self, parent, db):
+        super().__init__(parent)
+        self.db = db
+        self.title("ورود گروهی داده")
+        self.geometry("600x260")
+
+        self.status_bar = TaskStatusBar(self, db)
+        self.status_bar.pack(side="bottom", fill="x")
+        self.import_task = None
+        self.latest = None
+
+        frame_form = ttk.Frame(self, padding="10")
+        frame_form.pack(fill="x")
+
+        ttk.Label(frame_form, text="نوع داده:").grid(row=0, column=0, padx=5, pady=5, sticky="w")
+        self.kinds = list(self.KIND_LABELS)
+        self.kind_combo = ttk.Combobox(frame_form, values=list(self.KIND_LABELS.values()), state="readonly")
+        self.kind_combo.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
+        self.kind_combo.current(0)
+
+        ttk.Label(frame_form, text="فایل:").grid(row=1, column=0, padx=5, pady=5, sticky="w")
+        self.path_entry = ttk.Entry(frame_form)
+        self.path_entry.grid(row=1, column=1, padx=5, pady=5, sticky="ew")
+        ttk.Button(frame_form, text="انتخاب...", command=self.choose_file).grid(row=1, column=2, padx=5, pady=5)
+
+        self.update_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(frame_form, text="بروزرسانی رکوردهای تکراری", variable=self.update_var).grid(
+            row=2, column=1, padx=5, sticky="w")
+        self.restart_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(frame_form, text="شروع دوباره از ابتدای فایل", variable=self.restart_var).grid(
+            row=3, column=1, padx=5, sticky="w")
+        frame_form.columnconfigure(1, weight=1)
+
+        self.start_button = ttk.Button(self, text="شروع ورود داده", command=self.start_import)
+        self.start_button.pack(pady=5)
+        self.progress_label = ttk.Label(self, text="")
+        self.progress_label.pack(pady=5)
+
+    def choose_file(self):
+        path = filedialog.askopenfilename(parent=self, filetypes=[
+            ("CSV / JSON", "*.csv *.json *.jsonl *.ndjson"), ("All files", "*.*")])
+        if path:
+            self.path_entry.delete(0, "end")
+            self.path_entry.insert(0, path)
+
+    def start_import(self):
+        path = self.path_entry.get().strip()
+        if not path:
+            messagebox.showwarning("خطا", "فایلی انتخاب نشده است.", parent=self)
+            return
+
+        def remember(stats):
+            # Called from the worker thread; the label is updated by poll_progress.
+            self.latest = stats
+
+        def on_done(stats):
+            self.import_task = None
+            self.start_button.config(state="normal")
+            self.show_progress(stats)
+            details = "\n".join(stats["errors"][:5])
+            messagebox.showinfo("ورود داده",
+                                f"{stats['written']:,} ردیف ثبت شد، {stats['skipped']:,} تکراری، "
+                                f"{stats['rejected']:,} نامعتبر.\n{details}", parent=self)
+
+        def on_failed(e):
+            self.import_task = None
+            self.start_button.config(state="normal")
+            messagebox.showerror("خطا", f"ورود داده متوقف شد: {e}\n"
+                                        "با اجرای دوباره، کار از آخرین بخش ذخیره‌شده ادامه می‌یابد.", parent=self)
+
+        importer = BulkImporter(self.db, update=self.update_var.get(), progress=remember)
+        kind = self.kinds[self.kind_combo.current()]
+        self.latest = None
+        self.start_button.config(state="disabled")
+        self.import_task = self.status_bar.run(importer.run, kind, path, self.restart_var.get(),
+                                               on_success=on_done, on_error=on_failed,
+                                               message="در حال ورود داده...")
+        self.poll_progress()
+
+    def poll_progress(self):
+        if self.import_task is None or not self.winfo_exists():
+            return
+        if self.latest is not None:
+            self.show_progress(self.latest)
+        if self.import_task.done():
+            self.start_button.config(state="normal")
+            return
+        self.after(self.PROGRESS_POLL, self.poll_progress)
+
+    def show_progress(self, stats):
+        self.progress_label.config(text=f"ردیف‌ها: {stats['rows']:,}  |  "
+                                        f"سرعت: {stats['rows_per_second']:,.0f} ردیف در ثانیه  |  "
+                                        f"نامعتبر: {stats['rejected']:,}")
+
+class PerformanceWindow(tk.Toplevel):
+    REFRESH_MS = 1000
+
+    def __init__(self, parent, db):
+        super().__init__(parent)
+        self.db = db
+        self.title("عملکرد")
+        self.geometry("1000x600")
+
+        frame_controls = ttk.Frame(self, padding=10)
+        frame_controls.pack(fill="x")
+        ttk.Button(frame_controls, text="ذخیره گزارش...", command=self.export).pack(side="right", padx=5)
+        ttk.Button(frame_controls, text="پاک کردن آمار", command=self.reset).pack(side="right", padx=5)
+        self.summary_label = ttk.Label(frame_controls, text="")
+        self.summary_label.pack(side="left")
+
+        notebook = ttk.Notebook(self)
+        notebook.pack(fill="both", expand=True, padx=10, pady=(0, 10))
+
+        self.statement_tree = self.make_tree(notebook, "دستورات", (
+            ("statement", "دستور", 420), ("count", "تعداد", 70), ("mean", "میانگین (ms)", 90),
+            ("p95", "p95 (ms)", 80), ("max", "بیشینه (ms)", 90), ("rows", "ردیف‌ها", 80), ("errors", "خطا", 50)))
+        self.statement_binding = TreeBinding(self.statement_tree, key=lambda s: s["statement"], values=lambda s: (
+            s["statement"][:200], s["count"], f"{s['mean_ms']:.2f}",
+            "-" if s["p95_ms"] is None else f"<={s['p95_ms']}", f"{s['max_ms']:.1f}", s["rows"], s["errors"]))
+
+        self.screen_tree = self.make_tree(notebook, "صفحه‌ها", (
+            ("screen", "صفحه", 300), ("count", "تعداد", 80), ("total", "مجموع (ms)", 100),
+            ("mean", "میانگین (ms)", 100), ("max", "بیشینه (ms)", 100)))
+        self.screen_binding = TreeBinding(self.screen_tree, key=lambda s: s[0], values=lambda s: (
+            s[0], s[1]["count"], f"{s[1]['total_ms']:.0f}", f"{s[1]['mean_ms']:.2f}", f"{s[1]['max_ms']:.1f}"))
+
+        frame_slow = ttk.Frame(notebook)
+        notebook.add(frame_slow, text="کندها")
+        self.slow_tree = ttk.Treeview(frame_slow, columns=("time", "ms", "rows", "screen", "statement"),
+                                      show="headings", height=12)
+        for column, text, width in (("time", "زمان", 140), ("ms", "ms", 70), ("rows", "ردیف‌ها", 70),
+                                    ("screen", "صفحه", 140), ("statement", "دستور", 500)):
+            self.slow_tree.heading(column, text=text)
+            self.slow_tree.column(column, width=width)
+        self.slow_tree.pack(fill="both", expand=True)
+        self.slow_tree.bind("<<TreeviewSelect>>", self.show_plan)
+        self.plan_text = tk.Text(frame_slow, height=8, wrap="none")
+        self.plan_text.pack(fill="x")
+        self.slow_binding = TreeBinding(self.slow_tree, key=self.slow_key,
+                                        values=lambda s: (s["time"], f"{s['ms']:.0f}", s["rows"], s["screen"],
+                                                          s["statement"][:200]))
+        self.slow_entries = {}
+
+        self.traced_tree = self.make_tree(notebook, "همه دستورات اجرا شده", (
+            ("kind", "نوع", 400), ("count", "تعداد", 100)))
+        self.traced_binding = TreeBinding(self.traced_tree, key=lambda t: t[0], values=tuple)
+
+        self.refresh()
+
+    def make_tree(self, notebook, title, columns):
+        frame = ttk.Frame(notebook)
+        notebook.add(frame, text=title)
+        tree = ttk.Treeview(frame, columns=[c[0] for c in columns], show="headings")
+        for column, text, width in columns:
+            tree.heading(column, text=text)
+            tree.column(column, width=width)
+        scroll = ttk.Scrollbar(frame, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=scroll.set)
+        scroll.pack(side="right", fill="y")
+        tree.pack(fill="both", expand=True)
+        return tree
+
+    def slow_key(self, entry):
+        return (entry["time"], entry["statement"], entry["ms"])
+
+    def refresh(self):
+        if not self.winfo_exists():
+            return
+        snapshot = self.db.profiler.snapshot()
+        self.statement_binding.sync(snapshot["statements"])
+        self.screen_binding.sync(sorted(snapshot["screens"].items(), key=lambda s: -s[1]["total_ms"]))
+        slow = list(reversed(snapshot["slow"]))
+        self.slow_entries = {str(self.slow_key(s)): s for s in slow}
+        self.slow_binding.sync(slow)
+        self.traced_binding.sync(list(snapshot["traced"].items()))
+        wait = snapshot["pool_wait"]
+        self.summary_label.config(text=f"از {snapshot['since']}  |  انتظار برای اتصال: میانگین {wait['mean_ms']:.2f} ms، "
+                                       f"بیشینه {wait['max_ms']:.1f} ms  |  آستانه کندی: {snapshot['slow_ms']} ms")
+        self.after(self.REFRESH_MS, self.refresh)
+
+    def show_plan(self, event=None):
+        selected = self.slow_tree.focus()
+        self.plan_text.delete("1.0", "end")
+        entry = self.slow_entries.get(selected) if selected else None
+        if entry is not None:
+            self.plan_text.insert("1.0", entry["statement"] + "\n\n" + "\n".join(entry["plan"]))
+
+    def reset(self):
+        self.db.profiler.reset()
+
+    def export(self):
+        path = filedialog.asksaveasfilename(parent=self, defaultextension=".json", filetypes=[("JSON", "*.json")])
+        if not path:
+            return
+        try:
+            self.db.profiler.export(path)
+        except OSError as e:
+            messagebox.showerror("خطا", f"خطا در ذخیره گزارش: {e}", parent=self)
 
 class App(tk.Tk):
     def __init__(self, db):
         super().__init__()
         self.db = db
+        self.performance_window = None
         self.title("سیستم مدیریت فروشگاه")
         self.geometry("400x500")
         
+        menubar = tk.Menu(self)
+        tools_menu = tk.Menu(menubar, tearoff=0)
+        tools_menu.add_command(label="ورود گروهی داده...", command=self.open_import_window)
+        tools_menu.add_command(label="عملکرد...", command=self.open_performance_window)
+        tools_menu.add_command(label="پشتیبان‌گیری اکنون", command=self.backup_now)
+        menubar.add_cascade(label="ابزارها", menu=tools_menu)
+        self.config(menu=menubar)
+
         main_frame = ttk.Frame(self, padding="20")
         main_frame.pack(expand=True, fill="both")
         
@@ -969,6 +1555,38 @@ class App(tk.Tk):
         ttk.Button(main_frame, text="مشاهده فاکتورها", command=self.open_view_invoices_window, style="TButton").pack(fill="x", pady=5)
         ttk.Button(main_frame, text="گزارش‌ها", command=self.open_reports_window, style="TButton").pack(fill="x", pady=5)
 
+        self.pool_label = ttk.Label(main_frame, text="")
+        self.pool_label.pack(side="bottom", pady=5)
+
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.refresh_pool_stats()
+
+    def refresh_pool_stats(self):
+        stats = self.db.connection_stats()
+        self.pool_label.config(text=f"اتصالات: {stats['opened']} باز شده / {stats['reused']} استفاده مجدد")
+        self.after(2000, self.refresh_pool_stats)
+
+    def on_close(self):
+        self.db.close()
+        self.destroy()
+
+    def backup_now(self):
+        self.check_backup(self.db.submit(self.db.backup))
+
+    def check_backup(self, task):
+        if not task.done():
+            self.after(500, self.check_backup, task)
+            return
+        try:
+            result = task.future.result()
+        except (OSError, sqlite3.Error) as e:
+            messagebox.showerror("خطا", f"پشتیبان‌گیری انجام نشد: {e}", parent=self)
+            return
+        messagebox.showinfo("پشتیبان‌گیری",
+                            f"{os.path.basename(result['path'])}\n"
+                            f"{result['bytes'] / 1e6:,.1f} MB در {result['seconds']:.1f} ثانیه "
+                            f"({result['mb_per_second']:,.1f} MB/s)", parent=self)
+
     def open_window(self, WindowClass):
         try:
             win = WindowClass(self, self.db)
@@ -993,9 +1611,20 @@ class App(tk.Tk):
     def open_reports_window(self):
         self.open_window(ReportsWindow)
 
+    def open_import_window(self):
+        self.open_window(ImportWindow)
+
+    def open_performance_window(self):
+        # Not modal, so it can stay open and refresh next to the other windows.
+        if self.performance_window is not None and self.performance_window.winfo_exists():
+            self.performance_window.lift()
+            return
+        self.performance_window = PerformanceWindow(self, self.db)
+
+def main(argv=None):
+    # The commands are handled by store.main; without one, the GUI opens.
+    store.main(argv, gui=lambda db_instance: App(db_instance).mainloop())
+
 
 if __name__ == "__main__":
-    setup_database()
-    db_instance = Database()
-    app = App(db_instance)
-    app.mainloop()
\ No newline at end of file
+    main()
@@ -0,0 +1,57 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import store
+
+
+@pytest.fixture(scope="session")
+def empty_db_file(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("template") / "store.db")
+    store.setup_database(path)
+    return path
+
+
+@pytest.fixture
+def db_file(tmp_path, empty_db_file):
+    # A copy of a database set up once, since the calendar migration is slow.
+    path = str(tmp_path / "store.db")
+    shutil.copy(empty_db_file, path)
+    return path
+
+
+@pytest.fixture
+def db(db_file):
+    database = store.Database(db_file, checkpoint_interval=0, workers=1)
+    yield database
+    database.close()
+    database.pool.close()
+
+
+def add_customer(db, name="مشتری", phone="09120000001"):
+    return db.write_transaction(lambda cursor: cursor.execute(
+        "INSERT INTO customers (name, phone, address) VALUES (?, ?, ?)", (name, phone, "تهران")).lastrowid)
+
+
+def add_product(db, name="چای", price=1000 * store.RIALS_PER_TOMAN, stock=10):
+    return db.write_transaction(lambda cursor: cursor.execute(
+        "INSERT INTO products (name, price, stock) VALUES (?, ?, ?)", (name, price, stock)).lastrowid)
+
+
+def summaries_match(db):
+    # The trigger-maintained summaries against the raw tables.
+    product_sales = db.run_query("""
+        SELECT product_id, product_name, SUM(quantity), SUM(subtotal), COUNT(*)
+        FROM invoice_items GROUP BY product_id, product_name ORDER BY 1, 2""")
+    customer_sales = db.run_query("""
+        SELECT customer_id, SUM(total_amount), COUNT(*) FROM invoices GROUP BY customer_id ORDER BY 1""")
+    return ([tuple(row) for row in product_sales] == [tuple(row) for row in db.run_query(
+                "SELECT product_id, product_name, total_quantity, total_revenue, line_count FROM product_sales "
+                "WHERE line_count > 0 ORDER BY 1, 2")]
+            and [tuple(row) for row in customer_sales] == [tuple(row) for row in db.run_query(
+                "SELECT customer_id, total_spent, invoice_count FROM customer_sales "
+                "WHERE invoice_count > 0 ORDER BY 1")])
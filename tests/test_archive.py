@@ -0,0 +1,114 @@
+import os
+from datetime import datetime
+
+import pytest
+
+import store
+
+
+@pytest.fixture
+def filled_db(db):
+    # Spread over more than three calendar years, so at least two are closed.
+    store.generate_data(db, customers=40, products=15, lines=1500, days=1200)
+    return db
+
+
+def all_reports(db):
+    # Sorted, since rows that tie in a report's ORDER BY may come back in
+    # either order.
+    results = {}
+    for report in store.REPORTS:
+        try:
+            results[report.number] = sorted(tuple(row) for row in db.run_report(report.number)[1])
+        except (ValueError, LookupError):
+            pass
+    return results
+
+
+def all_pages(db, limit=70):
+    rows, key = [], ("9999-12-31", 0)
+    while True:
+        page = db.invoice_page(key, limit)
+        if not page:
+            return rows
+        rows.extend(tuple(row) for row in page)
+        key = (page[-1]["date"], page[-1]["invoice_id"])
+
+
+def test_archived_years_are_routed_transparently(filled_db, tmp_path):
+    db = filled_db
+    reports, pages = all_reports(db), all_pages(db)
+    assert len(reports) > 10
+    archiver = store.InvoiceArchiver(db, chunk_size=200)
+    years = archiver.closed_years(hot_years=1)
+    assert len(years) >= 2 and max(years) < datetime.now().year
+
+    results = archiver.run(hot_years=1)
+
+    assert [result["year"] for result in results] == years
+    assert db.archived_years() == years
+    assert db.run_query("SELECT MIN(date) FROM invoices")[0][0][:4] > str(max(years))
+    for year in years:
+        assert os.path.exists(db.archive_path(f"store.archive-{year}.db"))
+    db.report_cache.clear()
+    assert all_reports(db) == reports
+    assert all_pages(db) == pages
+
+    # Lines of an archived invoice are found in its year's partition.
+    invoice_id, _, date, total = pages[-1]
+    lines = db.invoice_lines(invoice_id, date)
+    assert lines and sum(row["subtotal"] for row in lines) == total
+    assert db.invoice_lines(invoice_id) == lines
+
+    # A second run has nothing left to move.
+    assert archiver.run(hot_years=1) == []
+
+
+def test_archived_invoices_are_read_only(filled_db):
+    db = filled_db
+    service = store.StoreService(db)
+    store.InvoiceArchiver(db).run(hot_years=1)
+    oldest = all_pages(db)[-1][0]
+    with pytest.raises(store.ValidationError):
+        service.delete_invoice(oldest)
+
+    # The summaries count archived invoices too, so a hot delete only takes
+    # its own total off.
+    newest = db.run_query("SELECT invoice_id, customer_id, total_amount FROM invoices "
+                          "ORDER BY invoice_id DESC LIMIT 1")[0]
+    spent = "SELECT total_spent FROM customer_sales WHERE customer_id = ?"
+    before = db.run_query(spent, (newest["customer_id"],))[0][0]
+    service.delete_invoice(newest["invoice_id"])
+    with pytest.raises(store.NotFound):
+        service.delete_invoice(newest["invoice_id"])
+    assert db.run_query(spent, (newest["customer_id"],))[0][0] == before - newest["total_amount"]
+
+
+def test_interrupted_archive_run_is_discarded(filled_db, monkeypatch):
+    db = filled_db
+    reports = all_reports(db)
+    archiver = store.InvoiceArchiver(db, chunk_size=100)
+    year = archiver.closed_years(hot_years=1)[0]
+    write_transaction = db.write_transaction
+    calls = []
+
+    def failing(fn, *args, **kwargs):
+        # Fails once the copy has started, before the batch is registered.
+        calls.append(fn.__name__)
+        if calls.count("copy") == 2:
+            raise OSError("disk full")
+        return write_transaction(fn, *args, **kwargs)
+
+    monkeypatch.setattr(db, "write_transaction", failing)
+    with pytest.raises(OSError):
+        archiver.archive_year(year)
+    monkeypatch.undo()
+
+    db.report_cache.clear()
+    assert db.archived_years() == []
+    assert all_reports(db) == reports
+
+    archiver.archive_year(year)
+    db.report_cache.clear()
+    assert db.archived_years() == [year]
+    assert all_reports(db) == reports
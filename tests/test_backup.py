@@ -0,0 +1,109 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import threading
+from contextlib import closing
+
+import pytest
+
+import store
+
+
+@pytest.fixture
+def filled_db(db):
+    store.generate_data(db, customers=40, products=15, lines=3000, days=1200)
+    return db
+
+
+def count(path, table="invoices"):
+    if path.endswith(".gz"):
+        # Unpacked under a name that is not taken for a snapshot.
+        plain = path + ".unpacked"
+        with gzip.open(path, "rb") as src, open(plain, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        path = plain
+    with closing(sqlite3.connect(path)) as conn:
+        assert conn.execute("PRAGMA quick_check").fetchone()[0] == "ok"
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_backup_finishes_under_steady_writes(filled_db, tmp_path):
+    db = filled_db
+    service = store.StoreService(db)
+    customer_id, product_id = db.run_query("SELECT MIN(customer_id), MIN(product_id) FROM customers, products")[0]
+    stop = threading.Event()
+    written = []
+
+    def writer():
+        while not stop.is_set():
+            written.append(service.create_invoice(customer_id, {product_id: 1}))
+
+    first = db.run_query("SELECT COUNT(*) FROM invoices")[0][0]
+    manager = store.SnapshotManager(db, str(tmp_path / "backups"), compress=False, pages=4, pause=0.005)
+    result = {}
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        # In a thread of its own, so a copy that never ends fails the test
+        # instead of hanging it.
+        backup = threading.Thread(target=lambda: result.update(manager.run()))
+        backup.start()
+        backup.join(30)
+        assert not backup.is_alive()
+    finally:
+        stop.set()
+        thread.join()
+
+    assert written
+    assert result["restarts"] <= store.BACKUP_RESTARTS
+    assert first <= count(result["path"]) <= first + len(written)
+    assert manager.snapshots() == [result["path"]]
+
+
+def test_snapshot_and_restore_include_archived_years(filled_db, tmp_path):
+    db = filled_db
+    years = [result["year"] for result in store.InvoiceArchiver(db).run(hot_years=1)]
+    assert years
+    reports = {number: sorted(tuple(row) for row in db.run_report(number)[1]) for number in (1, 5, 12)}
+    manager = store.SnapshotManager(db, str(tmp_path / "backups"), keep=2, pause=0)
+
+    snapshot = manager.run()
+    assert snapshot["archives"] == len(years)
+    assert sorted(manager.archive_files(snapshot["path"])) == years
+
+    # Damage both the hot tables and an archived year, then restore.
+    db.run_query("DELETE FROM invoice_items", commit=True)
+    archive = db.archive_path(f"store.archive-{years[0]}.db")
+    with closing(sqlite3.connect(archive)) as conn:
+        conn.execute("DELETE FROM invoice_items")
+        conn.commit()
+    restored = manager.restore(snapshot["path"])
+
+    assert restored["archives"] == len(years)
+    assert {number: sorted(tuple(row) for row in db.run_report(number)[1]) for number in reports} == reports
+    # The copy saved before restoring sits outside the rotated snapshots.
+    assert os.path.dirname(restored["saved"]) == os.path.join(manager.directory, store.BACKUP_PRE_RESTORE)
+    assert manager.snapshots() == [snapshot["path"]]
+    assert count(restored["saved"], "invoice_items") < count(snapshot["path"], "invoice_items")
+
+    # Rotation takes the archive copies along with their snapshot.
+    newer = [manager.run()["path"] for _ in range(2)]
+    assert manager.snapshots() == newer
+    assert manager.archive_files(snapshot["path"]) == {}
+    assert os.path.exists(restored["saved"])
+
+
+def test_restore_refuses_a_snapshot_without_its_archives(filled_db, tmp_path):
+    db = filled_db
+    years = [result["year"] for result in store.InvoiceArchiver(db).run(hot_years=1)]
+    manager = store.SnapshotManager(db, str(tmp_path / "backups"), pause=0)
+    snapshot = manager.run()["path"]
+    os.remove(manager.archive_files(snapshot)[years[-1]])
+    store.StoreService(db).delete_invoice(db.run_query("SELECT MAX(invoice_id) FROM invoices")[0][0])
+    invoices = db.run_query("SELECT COUNT(*) FROM invoices")[0][0]
+
+    with pytest.raises(FileNotFoundError):
+        manager.restore(snapshot)
+    assert db.run_query("SELECT COUNT(*) FROM invoices")[0][0] == invoices
+    assert not os.path.exists(os.path.join(manager.directory, store.BACKUP_PRE_RESTORE))
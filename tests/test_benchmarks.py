@@ -0,0 +1,60 @@
+import store
+from conftest import summaries_match
+
+
+def table_contents(db):
+    return {table: [tuple(row) for row in db.run_query(f"SELECT * FROM {table} ORDER BY 1")]
+            for table in ("customers", "products", "invoices", "invoice_items")}
+
+
+def without_dates(contents):
+    return dict(contents, invoices=[row[:2] + row[3:] for row in contents["invoices"]])
+
+
+def test_generated_data_is_seeded(db, tmp_path):
+    stats = store.generate_data(db, customers=30, products=10, lines=400)
+    counts = db.run_query("SELECT (SELECT COUNT(*) FROM customers), (SELECT COUNT(*) FROM products), "
+                          "(SELECT COUNT(*) FROM invoice_items)")[0]
+    assert tuple(counts) == (30, 10, 400)
+    assert summaries_match(db)
+    assert db.run_query("SELECT COUNT(*) FROM products WHERE stock < 0")[0][0] == 0
+    assert stats["lines"] == 400
+
+    other_path = str(tmp_path / "other.db")
+    store.setup_database(other_path)
+    other = store.Database(other_path, checkpoint_interval=0, workers=1)
+    try:
+        store.generate_data(other, customers=30, products=10, lines=400)
+        # The same seed gives the same rows. Dates count back from today, so
+        # they are left out for a run that straddles midnight.
+        assert without_dates(table_contents(other)) == without_dates(table_contents(db))
+    finally:
+        other.close()
+        other.pool.close()
+
+
+def test_benchmarks_leave_the_data_as_they_found_it(db):
+    db.report_processes = 2
+    store.generate_data(db, customers=30, products=10, lines=400)
+    before = table_contents(db)
+
+    run = store.run_benchmarks(db, repeat=2, writes=5)
+
+    results = run["results"]
+    assert {f"report_{report.number:02d}" for report in store.REPORTS} <= set(results)
+    for name in ("load_new_invoice_window", "reopen_new_invoice_window", "invoice_save", "invoice_bulk_save"):
+        assert results[name]["median_ms"] >= 0
+    assert run["meta"]["invoice_items"] == 400
+    # Deleted benchmark invoices keep their ids used, so only the rows are compared.
+    assert table_contents(db) == before
+    assert summaries_match(db)
+
+
+def test_compare_flags_only_real_regressions():
+    def run(**medians):
+        return {"results": {name: {"median_ms": median} for name, median in medians.items()}}
+
+    baseline = run(fast=10.0, slow=10.0, tiny=0.1, gone=5.0)
+    current = run(fast=10.5, slow=20.0, tiny=1.0, added=50.0)
+    assert store.compare_benchmarks(current, baseline) == [("slow", 10.0, 20.0)]
+    assert store.compare_benchmarks(current, baseline, tolerance=1.0) == []
@@ -0,0 +1,53 @@
+import store
+from conftest import add_customer, add_product
+
+
+def test_unchanged_tables_are_not_reloaded(db):
+    catalog = store.CatalogCache(db)
+    assert not catalog.loaded
+    catalog.refresh()
+    assert catalog.loaded and catalog.loads == 2
+
+    catalog.refresh()
+    assert catalog.loads == 2
+    product_id = add_product(db, "برنج")
+    catalog.refresh()
+    assert catalog.loads == 3
+    assert catalog.product(product_id)["name"] == "برنج"
+
+    customer_id = add_customer(db, "علی احمدی", "09120000001")
+    db.run_query("UPDATE products SET stock = 0 WHERE product_id = ?", (product_id,), commit=True)
+    catalog.refresh()
+    assert catalog.loads == 5
+    assert catalog.customer(customer_id)["phone"] == "09120000001"
+    assert catalog.product(product_id)["stock"] == 0
+
+
+def test_products_in_stock(db):
+    add_product(db, "چای", stock=3)
+    add_product(db, "برنج", stock=0)
+    add_product(db, "آرد", stock=1)
+    names = [row["name"] for row in store.CatalogCache(db).refresh().products_in_stock()]
+    assert names == ["آرد", "چای"]
+
+
+def test_find_customers(db):
+    first = add_customer(db, "علی احمدی", "09120000001")
+    second = add_customer(db, "سارا علیزاده", "09350000002")
+    add_customer(db, "رضا كريمي", "09120000003")
+    catalog = store.CatalogCache(db).refresh()
+
+    def found(text):
+        return [row["customer_id"] for row in catalog.find_customers(text)]
+
+    assert found("علی") == [second, first]
+    assert found("احمد") == [first]
+    assert found("0935") == [second]
+    # Arabic and Persian spellings find the same customer.
+    assert [row["name"] for row in catalog.find_customers("کریمی")] == ["رضا كريمي"]
+    assert len(catalog.find_customers("")) == 3
+
+    db.run_query("DELETE FROM customers WHERE customer_id = ?", (first,), commit=True)
+    assert found("احمد") == [first]
+    catalog.refresh()
+    assert found("احمد") == []
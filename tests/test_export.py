@@ -0,0 +1,102 @@
+import csv
+import io
+import os
+
+import pytest
+
+import store
+
+ROWS = [
+    (1, 2.5, "چای", b"\x00\x01", None, None),
+    (None, None, None, None, None, None),
+    (-3, 0.0, "", b"", None, None),
+    (2 ** 40, 1e-9, "برنج ۵ کیلویی", b"\xff", None, None),
+]
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_columnar_round_trip(compress):
+    f = io.BytesIO()
+    writer = store.ColumnarWriter(f, ["id", "amount", "name", "data", "empty", "نام"], compress, row_group=3)
+    writer.writerows(ROWS[:1])
+    writer.writerows(ROWS[1:])
+    writer.close()
+    assert writer.rows == len(ROWS)
+
+    f.seek(0)
+    reader = store.ColumnarReader(f)
+    assert reader.columns == ["id", "amount", "name", "data", "empty", "نام"]
+    assert list(reader) == ROWS
+
+
+def test_columns_of_mixed_types():
+    f = io.BytesIO()
+    writer = store.ColumnarWriter(f, ["number", "big", "mixed"])
+    writer.writerows([(1, 1, 1), (2.5, 2 ** 64, "x")])
+    writer.close()
+    f.seek(0)
+    # Integers widen to reals, and to text when they do not fit 64 bits.
+    assert list(store.ColumnarReader(f)) == [(1.0, "1", "1"), (2.5, str(2 ** 64), "x")]
+
+
+def test_other_files_are_refused():
+    with pytest.raises(ValueError):
+        store.ColumnarReader(io.BytesIO(b"item_id,name\n"))
+
+
+@pytest.fixture
+def sold_db(db):
+    store.generate_data(db, customers=20, products=10, lines=300)
+    return db
+
+
+@pytest.fixture
+def out_dir(tmp_path):
+    # Apart from the database files, so a test can see what was left behind.
+    path = tmp_path / "exports"
+    path.mkdir()
+    return path
+
+
+def read_export(path):
+    if store.export_format(path) == "csv":
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            rows = list(csv.reader(f))
+        return rows[0], [tuple(row) for row in rows[1:]]
+    with open(path, "rb") as f:
+        reader = store.ColumnarReader(f)
+        return reader.columns, list(reader)
+
+
+@pytest.mark.parametrize("name", ["invoices.col", "invoices.csv"])
+def test_export_invoices(sold_db, out_dir, name):
+    path = str(out_dir / name)
+    seen = []
+    stats = sold_db.export_query(store.EXPORT_QUERIES["invoices"], (), path, progress=seen.append, batch_size=50)
+    expected = [tuple(row) for row in sold_db.run_query(store.EXPORT_QUERIES["invoices"])]
+    columns, rows = read_export(path)
+    if name.endswith(".csv"):
+        expected = [tuple(str(value) for value in row) for row in expected]
+    assert columns == ["invoice_id", "date", "customer_id", "customer_name", "total_amount"]
+    assert rows == expected
+    assert stats["rows"] == len(expected) and stats["bytes"] == os.path.getsize(path)
+    assert seen[-1]["rows"] == len(expected) and len(seen) == -(-len(expected) // 50)
+    assert os.listdir(out_dir) == [name]
+
+
+def test_export_report(sold_db, out_dir):
+    path = str(out_dir / "report.col")
+    sold_db.export_report(1, "", path)
+    columns, rows = read_export(path)
+    assert rows == [tuple(row) for row in sold_db.run_report(1)[1]]
+
+
+def test_failed_export_leaves_no_file(sold_db, out_dir):
+    path = str(out_dir / "items.col")
+
+    def progress(stats):
+        raise RuntimeError()
+
+    with pytest.raises(RuntimeError):
+        sold_db.export_table("items", path, progress=progress)
+    assert os.listdir(out_dir) == []
@@ -0,0 +1,132 @@
+import csv
+import json
+import sqlite3
+
+import pytest
+
+import store
+from conftest import add_customer, add_product, summaries_match
+
+
+def schema_objects(db, kind):
+    return sorted(row[0] for row in db.run_query(
+        "SELECT name FROM sqlite_master WHERE type = ? AND name NOT LIKE 'sqlite_%'", (kind,)))
+
+
+def write_customers(path, count):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "phone", "address"])
+        for n in range(count):
+            writer.writerow([f"مشتری {n}", f"0912{n:07d}", "تهران"])
+
+
+def write_invoices(path, count):
+    with open(path, "w", encoding="utf-8") as f:
+        for n in range(count):
+            f.write(json.dumps({"customer_phone": f"0912{n % 5:07d}", "date": f"2024-01-{n % 28 + 1:02d}",
+                                "items": [{"product_name": "چای", "quantity": 1 + n % 3}]}) + "\n")
+
+
+def fail_on_chunk(monkeypatch, importer, number):
+    write_chunk = importer._write_chunk
+    calls = []
+
+    def failing(cursor, *args):
+        calls.append(1)
+        if len(calls) == number:
+            raise sqlite3.DatabaseError("disk I/O error")
+        return write_chunk(cursor, *args)
+
+    monkeypatch.setattr(importer, "_write_chunk", failing)
+
+
+def test_failed_import_restores_indexes_and_resumes(db, tmp_path, monkeypatch):
+    path = str(tmp_path / "customers.csv")
+    write_customers(path, 25)
+    indexes, triggers = schema_objects(db, "index"), schema_objects(db, "trigger")
+
+    importer = store.BulkImporter(db, chunk_size=10)
+    fail_on_chunk(monkeypatch, importer, 2)
+    with pytest.raises(sqlite3.DatabaseError):
+        importer.run("customers", path)
+
+    # The first chunk is kept, and everything that was dropped is back.
+    assert db.run_query("SELECT COUNT(*) FROM customers")[0][0] == 10
+    assert tuple(db.run_query("SELECT rows_done, status FROM import_jobs")[0]) == (10, "running")
+    assert db.run_query("SELECT COUNT(*) FROM import_deferred")[0][0] == 0
+    assert schema_objects(db, "index") == indexes
+    assert schema_objects(db, "trigger") == triggers
+
+    stats = store.BulkImporter(db, chunk_size=10).run("customers", path)
+    assert stats["resumed_from"] == 10
+    assert (stats["rows"], stats["written"]) == (25, 15)
+    assert db.run_query("SELECT COUNT(*) FROM customers")[0][0] == 25
+    assert db.run_query("SELECT status FROM import_jobs")[0][0] == "done"
+    assert [row["name"] for row in db.search_customers("مشتری 24")][:1] == ["مشتری 24"]
+
+
+def test_import_keeps_triggers_and_restart_starts_over(db, tmp_path, monkeypatch):
+    customers = str(tmp_path / "customers.csv")
+    write_customers(customers, 5)
+    store.BulkImporter(db).run("customers", customers)
+    add_product(db, "چای", stock=0)
+    path = str(tmp_path / "invoices.jsonl")
+    write_invoices(path, 30)
+    triggers = schema_objects(db, "trigger")
+
+    importer = store.BulkImporter(db, chunk_size=10)
+    seen = []
+    write_chunk = importer._write_chunk
+
+    def watch(cursor, *args):
+        seen.append(schema_objects(db, "trigger"))
+        return write_chunk(cursor, *args)
+
+    monkeypatch.setattr(importer, "_write_chunk", watch)
+    fail_on_chunk(monkeypatch, importer, 3)
+    with pytest.raises(sqlite3.DatabaseError):
+        importer.run("invoices", path)
+    assert seen == [triggers, triggers]
+    assert db.run_query("SELECT COUNT(*) FROM invoices")[0][0] == 20
+    assert summaries_match(db)
+
+    stats = store.BulkImporter(db, chunk_size=10).run("invoices", path, restart=True)
+    assert stats["resumed_from"] == 0
+    assert db.run_query("SELECT COUNT(*) FROM invoices")[0][0] == 50
+    assert [row[0] for row in db.run_query("SELECT status FROM import_jobs WHERE kind = 'invoices' "
+                                           "ORDER BY job_id")] == ["abandoned", "done"]
+    # Historical invoices leave stock alone.
+    assert db.run_query("SELECT stock FROM products")[0][0] == 0
+    assert summaries_match(db)
+
+
+def test_setup_restores_objects_left_by_a_killed_import(db, db_file):
+    indexes = schema_objects(db, "index")
+    # What a process killed in the middle of an import leaves behind.
+    db.write_transaction(store.defer_schema_objects, ("customers", "products"), False, store.IMPORT_KEPT_INDEXES)
+    assert schema_objects(db, "index") != indexes
+    assert db.run_query("SELECT COUNT(*) FROM import_deferred")[0][0] > 0
+
+    store.setup_database(db_file)
+
+    assert schema_objects(db, "index") == indexes
+    assert db.run_query("SELECT COUNT(*) FROM import_deferred")[0][0] == 0
+
+
+def test_repeated_products_become_one_line(db, tmp_path):
+    add_customer(db)
+    tea = add_product(db, "dupcheck", stock=0)
+    path = str(tmp_path / "invoices.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        for items in ([{"product_name": "dupcheck", "quantity": 1}, {"product_name": "dupcheck", "quantity": 2}],
+                      [{"product_name": "dupcheck", "quantity": 1, "unit_price": 100},
+                       {"product_name": "dupcheck", "quantity": 1, "unit_price": 200}]):
+            f.write(json.dumps({"customer_phone": "09120000001", "date": "2024-02-01", "items": items}) + "\n")
+
+    stats = store.BulkImporter(db).run("invoices", path)
+
+    assert (stats["written"], stats["rejected"]) == (1, 1)
+    assert [tuple(row) for row in db.run_query("SELECT product_id, quantity FROM invoice_items")] == [(tea, 3)]
+    assert [tuple(row) for row in db.run_report(13)[1]] == [("dupcheck", 1)]
+    assert summaries_match(db)
@@ -0,0 +1,104 @@
+import sqlite3
+
+import store
+from conftest import summaries_match
+
+# The schema as it was before user_version was used, with prices in tomans.
+LEGACY_SCHEMA = """
+CREATE TABLE customers (
+    customer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    phone TEXT UNIQUE,
+    address TEXT
+);
+CREATE TABLE products (
+    product_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE,
+    price REAL NOT NULL,
+    stock INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE invoices (
+    invoice_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    customer_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    total_amount REAL NOT NULL,
+    FOREIGN KEY (customer_id) REFERENCES customers (customer_id) ON DELETE RESTRICT
+);
+CREATE TABLE invoice_items (
+    item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    invoice_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    product_name TEXT NOT NULL,
+    unit_price REAL NOT NULL,
+    quantity INTEGER NOT NULL,
+    subtotal REAL NOT NULL,
+    FOREIGN KEY (invoice_id) REFERENCES invoices (invoice_id) ON DELETE CASCADE,
+    FOREIGN KEY (product_id) REFERENCES products (product_id) ON DELETE RESTRICT
+);
+INSERT INTO customers (name, phone, address) VALUES ('علی احمدی', '09120000001', 'تهران');
+INSERT INTO customers (name, phone, address) VALUES ('سارا نوری', '09120000002', 'شیراز');
+INSERT INTO products (name, price, stock) VALUES ('چای', 120.5, 10);
+INSERT INTO products (name, price, stock) VALUES ('برنج', 300, 5);
+INSERT INTO invoices (customer_id, date, total_amount) VALUES (1, '2023-03-21 10:00:00', 541);
+INSERT INTO invoice_items (invoice_id, product_id, product_name, unit_price, quantity, subtotal)
+    VALUES (1, 1, 'چای', 120.5, 2, 241);
+INSERT INTO invoice_items (invoice_id, product_id, product_name, unit_price, quantity, subtotal)
+    VALUES (1, 2, 'برنج', 300, 1, 300);
+INSERT INTO invoices (customer_id, date, total_amount) VALUES (2, '2024-01-05 18:30:00', 600);
+INSERT INTO invoice_items (invoice_id, product_id, product_name, unit_price, quantity, subtotal)
+    VALUES (2, 2, 'برنج', 300, 2, 600);
+"""
+
+
+def column_types(conn, table):
+    return {row[1]: row[2] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def test_legacy_database_is_upgraded(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    with sqlite3.connect(path) as conn:
+        conn.executescript(LEGACY_SCHEMA)
+    conn.close()
+
+    store.setup_database(path)
+
+    conn = sqlite3.connect(path)
+    try:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == len(store.SCHEMA_MIGRATIONS)
+        assert column_types(conn, "products")["price"] == "INTEGER"
+        assert column_types(conn, "invoices")["total_amount"] == "INTEGER"
+        assert column_types(conn, "invoice_items")["subtotal"] == "INTEGER"
+        assert conn.execute("SELECT price FROM products ORDER BY product_id").fetchall() == [(1205,), (3000,)]
+        assert conn.execute("SELECT total_amount FROM invoices ORDER BY invoice_id").fetchall() == [(5410,), (6000,)]
+        assert conn.execute("SELECT typeof(unit_price), SUM(subtotal) FROM invoice_items").fetchone() == \
+            ("integer", 11410)
+        assert conn.execute("PRAGMA foreign_key_check").fetchall() == []
+        assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    finally:
+        conn.close()
+
+    db = store.Database(path, checkpoint_interval=0, workers=1)
+    try:
+        assert summaries_match(db)
+        # The search index and the reports work on the migrated rows.
+        assert [row["name"] for row in db.search_customers("سارا")] == ["سارا نوری"]
+        columns, rows = db.run_report(1)
+        assert rows
+    finally:
+        db.close()
+        db.pool.close()
+
+
+def test_upgrade_is_idempotent(db_file):
+    before = sqlite3.connect(db_file)
+    schema = before.execute("SELECT type, name, sql FROM sqlite_master ORDER BY name").fetchall()
+    before.close()
+
+    store.setup_database(db_file)
+
+    after = sqlite3.connect(db_file)
+    try:
+        assert after.execute("PRAGMA user_version").fetchone()[0] == len(store.SCHEMA_MIGRATIONS)
+        assert after.execute("SELECT type, name, sql FROM sqlite_master ORDER BY name").fetchall() == schema
+    finally:
+        after.close()
@@ -0,0 +1,64 @@
+import pytest
+
+import store
+from conftest import add_customer, add_product
+
+PARALLEL_REPORTS = [report.number for report in store.REPORTS if report.partial is not None]
+
+
+def limit_of(number):
+    return store.get_report(number).partial.limit
+
+
+def results(db, number, parallel):
+    db.report_cache.clear()
+    run = db.run_parallel_report if parallel else db.run_report
+    columns, rows = run(number)
+    rows = [tuple(row) for row in rows]
+    if limit_of(number):
+        # Rows tied at the cut may be picked either way; the totals may not.
+        return columns, [row[-1] for row in rows]
+    return columns, sorted(rows)
+
+
+@pytest.fixture(scope="module")
+def parallel_db(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("parallel") / "store.db")
+    store.setup_database(path)
+    db = store.Database(path, checkpoint_interval=0, workers=1, report_processes=2)
+    store.generate_data(db, customers=60, products=20, lines=3000, days=1200)
+    # A renamed product: the lines keep the old name, the reports group by it.
+    db.run_query("UPDATE products SET name = 'نام تازه' WHERE product_id = "
+                 "(SELECT MIN(product_id) FROM products)", commit=True)
+    # A product sold once, for the slow-seller reports.
+    store.StoreService(db).create_invoice(add_customer(db, "مشتری تازه", "09990000001"),
+                                          {add_product(db, "کالای کم فروش"): 1})
+    yield db
+    db.close()
+    db.pool.close()
+
+
+@pytest.mark.parametrize("number", PARALLEL_REPORTS)
+def test_parallel_matches_serial(parallel_db, number):
+    serial = results(parallel_db, number, parallel=False)
+    assert serial[1]
+    assert results(parallel_db, number, parallel=True) == serial
+
+
+def test_shards_cover_the_archives(db):
+    db.report_processes = 2
+    store.generate_data(db, customers=40, products=15, lines=1500, days=1200)
+    serial = {number: results(db, number, parallel=False) for number in PARALLEL_REPORTS}
+    store.InvoiceArchiver(db, chunk_size=200).run(hot_years=1)
+    assert db.archived_years()
+    with db.get_conn() as conn:
+        shards = db.report_shards(conn, "invoice_items", 4)
+    assert {batch for path, batch, low, high in shards} - {None}
+    for number in PARALLEL_REPORTS:
+        assert results(db, number, parallel=True) == serial[number]
+
+
+def test_reports_without_a_partial_refuse(db):
+    number = next(report.number for report in store.REPORTS if report.partial is None)
+    with pytest.raises(ValueError):
+        db.run_parallel_report(number)
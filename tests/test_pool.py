@@ -0,0 +1,112 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import store
+
+
+@pytest.fixture
+def pool(db_file):
+    pool = store.ConnectionPool(db_file, size=2, timeout=0.2)
+    yield pool
+    pool.close()
+
+
+def names(pool):
+    with pool.connection() as conn:
+        return [row[0] for row in conn.execute("SELECT name FROM customers ORDER BY name")]
+
+
+def test_nested_blocks_share_the_outer_transaction(pool):
+    with pytest.raises(RuntimeError):
+        with pool.connection() as outer:
+            outer.execute("INSERT INTO customers (name) VALUES ('الف')")
+            with pool.connection() as inner:
+                assert inner is outer
+                inner.execute("INSERT INTO customers (name) VALUES ('ب')")
+            # The inner block neither committed nor ended the transaction.
+            assert outer.in_transaction
+            raise RuntimeError()
+    assert names(pool) == []
+
+    with pool.connection() as outer:
+        outer.execute("INSERT INTO customers (name) VALUES ('الف')")
+        try:
+            with pool.connection() as inner:
+                inner.execute("INSERT INTO customers (name) VALUES ('ب')")
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        assert outer.in_transaction
+    assert names(pool) == ["الف", "ب"]
+
+
+def hold(pool, count):
+    # Checks out count connections, each from a thread of its own, since a
+    # thread that already holds one is given the same one again.
+    held, stop = [], threading.Event()
+
+    def run():
+        conn = pool.acquire()
+        held.append(conn)
+        stop.wait(5)
+        pool.release(conn)
+
+    threads = [threading.Thread(target=run) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    while len(held) < count:
+        time.sleep(0.01)
+    return held, stop, threads
+
+
+def test_checkout_times_out_when_all_are_taken(pool):
+    held, stop, threads = hold(pool, 2)
+    with pytest.raises(sqlite3.OperationalError):
+        pool.acquire()
+    stop.set()
+    for thread in threads:
+        thread.join()
+    assert pool.stats()["idle"] == 2
+
+
+def test_connections_open_outside_the_lock(pool, monkeypatch):
+    held, stop, threads = hold(pool, 1)
+    connect = pool._connect
+    opening, proceed = threading.Event(), threading.Event()
+
+    def slow_connect():
+        opening.set()
+        proceed.wait(5)
+        return connect()
+
+    monkeypatch.setattr(pool, "_connect", slow_connect)
+    opened = []
+    thread = threading.Thread(target=lambda: opened.append(pool.acquire()))
+    thread.start()
+    assert opening.wait(5)
+    try:
+        # While the second connection is being opened, the first can still
+        # be checked in and out.
+        stop.set()
+        threads[0].join(1)
+        assert not threads[0].is_alive()
+        with pool.connection() as conn:
+            assert conn is held[0]
+    finally:
+        proceed.set()
+        thread.join()
+    assert opened and opened[0] is not held[0]
+    assert pool.stats()["open"] == 2
+
+
+def test_broken_idle_connections_are_replaced(pool):
+    conn = pool.acquire()
+    pool.release(conn)
+    conn.close()
+    with pool.connection() as fresh:
+        assert fresh is not conn
+        assert fresh.execute("SELECT 1").fetchone()[0] == 1
+    assert pool.stats()["open"] == 1
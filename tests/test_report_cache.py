@@ -0,0 +1,56 @@
+import sqlite3
+
+import store
+from conftest import add_customer, add_product
+
+
+def test_entries_are_dropped_on_a_new_version():
+    cache = store.ReportCache(max_entries=2)
+    cache.put((1, ()), 5, ["a"])
+    assert cache.get((1, ()), 5) == ["a"]
+    assert cache.get((1, ()), 6) is None
+    # The stale entry is gone even for a reader that still sees the old version.
+    assert cache.get((1, ()), 5) is None
+    assert cache.stats() == {"entries": 0, "hits": 1, "misses": 2}
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = store.ReportCache(max_entries=2)
+    cache.put((1, ()), 0, ["a"])
+    cache.put((2, ()), 0, ["b"])
+    cache.get((1, ()), 0)
+    cache.put((3, ()), 0, ["c"])
+    assert cache.get((2, ()), 0) is None
+    assert cache.get((1, ()), 0) == ["a"] and cache.get((3, ()), 0) == ["c"]
+
+
+def test_results_over_max_rows_are_not_kept():
+    cache = store.ReportCache(max_rows=2)
+    cache.put((1, ()), 0, ["a"])
+    cache.put((1, ()), 1, ["a", "b", "c"])
+    assert cache.stats()["entries"] == 0
+
+
+def test_writes_invalidate_cached_reports(db):
+    service = store.StoreService(db)
+    customer_id = add_customer(db)
+    product_id = add_product(db, stock=100)
+    service.create_invoice(customer_id, {product_id: 2})
+
+    columns, first = db.run_report(1)
+    columns, again = db.run_report(1)
+    assert again is first
+    assert db.report_cache.stats()["hits"] == 1
+
+    service.create_invoice(customer_id, {product_id: 3})
+    columns, rows = db.run_report(1)
+    assert rows is not first and [tuple(row)[-1] for row in rows] == [5]
+
+    # A write from another connection, as by a second copy of the program,
+    # moves the same counter.
+    conn = sqlite3.connect(db.db_file)
+    with conn:
+        conn.execute("UPDATE products SET name = 'چای سبز' WHERE product_id = ?", (product_id,))
+    conn.close()
+    columns, renamed = db.run_report(1)
+    assert renamed is not rows and renamed[0][0] == "چای سبز"
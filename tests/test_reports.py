@@ -0,0 +1,99 @@
+import pytest
+
+import store
+from conftest import add_customer, add_product
+
+# The reports as they were computed from the invoice tables before the
+# summary tables, with the toman thresholds in rials.
+BASELINE_REPORTS = {
+    1: """
+        SELECT p.name, SUM(ii.quantity) FROM invoice_items ii JOIN products p ON ii.product_id = p.product_id
+        GROUP BY p.name""",
+    2: """
+        SELECT p.name, SUM(ii.quantity) FROM invoice_items ii JOIN products p ON ii.product_id = p.product_id
+        GROUP BY p.name HAVING SUM(ii.quantity) > 10""",
+    3: """
+        SELECT c.name, SUM(i.total_amount) FROM invoices i JOIN customers c ON i.customer_id = c.customer_id
+        GROUP BY c.name""",
+    4: f"""
+        SELECT c.name, SUM(i.total_amount) FROM invoices i JOIN customers c ON i.customer_id = c.customer_id
+        GROUP BY c.name HAVING SUM(i.total_amount) > {500 * store.RIALS_PER_TOMAN}""",
+    6: """
+        SELECT p.name, SUM(ii.quantity) FROM invoice_items ii JOIN products p ON ii.product_id = p.product_id
+        GROUP BY p.name HAVING SUM(ii.quantity) < 5""",
+    7: """
+        SELECT product_name, SUM(subtotal) AS total FROM invoice_items GROUP BY product_name
+        ORDER BY total DESC LIMIT 5""",
+    8: """
+        SELECT c.name, SUM(i.total_amount) AS total FROM invoices i JOIN customers c ON i.customer_id = c.customer_id
+        GROUP BY c.name ORDER BY total DESC LIMIT 5""",
+    13: """
+        SELECT product_name, COUNT(DISTINCT invoice_id) FROM invoice_items GROUP BY product_name
+        HAVING COUNT(DISTINCT invoice_id) < 3""",
+    14: """
+        SELECT c.name, SUM(ii.quantity) FROM invoices i JOIN customers c ON i.customer_id = c.customer_id
+        JOIN invoice_items ii ON i.invoice_id = ii.invoice_id GROUP BY c.name""",
+    15: """
+        SELECT c.name, COUNT(i.invoice_id) FROM invoices i JOIN customers c ON i.customer_id = c.customer_id
+        GROUP BY c.name HAVING COUNT(i.invoice_id) > 3""",
+    16: f"""
+        SELECT product_name, SUM(subtotal) FROM invoice_items GROUP BY product_name
+        HAVING SUM(subtotal) > {500 * store.RIALS_PER_TOMAN}""",
+    20: """
+        SELECT substr(i.date, 1, 10), ii.product_name, SUM(ii.quantity) FROM invoice_items ii
+        JOIN invoices i ON ii.invoice_id = i.invoice_id GROUP BY 1, 2""",
+}
+
+
+def rows_of(number, rows):
+    rows = [tuple(row) for row in rows]
+    if number == 20:
+        # Without the Jalali date column the baseline did not have.
+        rows = [(row[0],) + row[2:] for row in rows]
+    return sorted(rows)
+
+
+@pytest.fixture(scope="module")
+def sales_db(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("reports") / "store.db")
+    store.setup_database(path)
+    db = store.Database(path, checkpoint_interval=0, workers=1)
+    # Repeats among 200 generated customer names, a renamed product and a
+    # name taken over by a new product: the cases where grouping the
+    # summary rows by name differs from grouping the invoice lines.
+    store.generate_data(db, customers=200, products=30, lines=4000)
+    service = store.StoreService(db)
+    customer_id = db.run_query("SELECT MIN(customer_id) FROM customers")[0][0]
+    renamed = db.run_query("SELECT product_id, name FROM products ORDER BY product_id LIMIT 1")[0]
+    db.run_query("UPDATE products SET name = ?, stock = stock + 100 WHERE product_id = ?",
+                 ("نام تازه", renamed["product_id"]), commit=True)
+    service.create_invoice(customer_id, {renamed["product_id"]: 4})
+    reused = add_product(db, renamed["name"], stock=100)
+    service.create_invoice(customer_id, {reused: 2})
+    # Two cheap sales that pass the 500 toman thresholds only together,
+    # by two customers of one name and under one name for two products.
+    cheap = add_product(db, "کالای ارزان", price=300 * store.RIALS_PER_TOMAN, stock=100)
+    service.create_invoice(add_customer(db, "مشتری تازه", "09990000001"), {cheap: 1})
+    db.run_query("UPDATE products SET name = 'کالای ارزان قدیمی' WHERE product_id = ?", (cheap,), commit=True)
+    cheap = add_product(db, "کالای ارزان", price=300 * store.RIALS_PER_TOMAN, stock=100)
+    service.create_invoice(add_customer(db, "مشتری تازه", "09990000002"), {cheap: 1})
+    yield db
+    db.close()
+    db.pool.close()
+
+
+@pytest.mark.parametrize("number", sorted(BASELINE_REPORTS))
+def test_summary_report_matches_baseline(sales_db, number):
+    columns, rows = sales_db.run_report(number)
+    expected = sorted(tuple(row) for row in sales_db.run_query(BASELINE_REPORTS[number]))
+    assert expected
+    assert rows_of(number, rows) == expected
+
+
+def test_report_order(sales_db):
+    for number in (1, 2, 3, 4, 14, 15, 16):
+        totals = [row[-1] for row in sales_db.run_report(number)[1]]
+        assert totals == sorted(totals, reverse=True)
+    for number in (6, 13):
+        totals = [row[-1] for row in sales_db.run_report(number)[1]]
+        assert totals == sorted(totals)
@@ -0,0 +1,74 @@
+import sqlite3
+
+import pytest
+
+import store
+from conftest import add_customer, add_product
+
+
+def names(rows):
+    return sorted(row["name"] for row in rows)
+
+
+@pytest.fixture
+def people(db):
+    add_customer(db, "علی احمدی", "09121110000")
+    add_customer(db, "سارا محمدی", "09352220000")
+    add_customer(db, "رضا 100%_راضی", "09123330000")
+    return db
+
+
+def test_index_is_kept_by_the_triggers(people):
+    db = people
+    assert db.has_search_index("customers_fts") and db.has_search_index("products_fts")
+    assert names(db.search_customers("محمدی")) == ["سارا محمدی"]
+    assert names(db.search_customers("مدی")) == ["سارا محمدی", "علی احمدی"]
+    assert names(db.search_customers("2220")) == ["سارا محمدی"]
+    assert len(db.search_customers("تهران", limit=2)) == 2
+
+    customer_id = db.run_query("SELECT customer_id FROM customers WHERE name = 'سارا محمدی'")[0][0]
+    db.run_query("UPDATE customers SET name = 'سارا کریمی' WHERE customer_id = ?", (customer_id,), commit=True)
+    assert names(db.search_customers("محمدی")) == []
+    assert names(db.search_customers("کریمی")) == ["سارا کریمی"]
+    db.run_query("DELETE FROM customers WHERE customer_id = ?", (customer_id,), commit=True)
+    assert names(db.search_customers("کریمی")) == []
+
+    add_product(db, "چای سبز")
+    add_product(db, "چای سیاه")
+    assert names(db.search_products("چای")) == ["چای سبز", "چای سیاه"]
+
+
+@pytest.mark.parametrize("term", ["ع", "10", "0%_", '"قند"', "علی احمدی", "  احمد  "])
+def test_like_fallback_finds_the_same(people, term):
+    db = people
+    found = names(db.search_customers(term))
+    db._search_indexes["customers_fts"] = False
+    assert names(db.search_customers(term)) == found
+
+
+def test_wildcards_are_literal(people):
+    db = people
+    assert names(db.search_customers("%")) == ["رضا 100%_راضی"]
+    assert names(db.search_customers("0%_")) == ["رضا 100%_راضی"]
+    assert names(db.search_customers('"')) == []
+    assert db.search_customers('ab"cd') == []
+
+
+def test_existing_rows_are_indexed_on_upgrade(db_file):
+    # Rows written while the index was missing are picked up by the rebuild.
+    conn = sqlite3.connect(db_file)
+    with conn:
+        for suffix in ("_ai", "_ad", "_au"):
+            conn.execute(f"DROP TRIGGER customers_fts{suffix}")
+        conn.execute("DROP TABLE customers_fts")
+        conn.execute("INSERT INTO customers (name, phone) VALUES ('نگار یزدانی', '09190000000')")
+    conn.close()
+    with sqlite3.connect(db_file) as conn:
+        store.create_search_indexes(conn)
+    conn.close()
+    db = store.Database(db_file, checkpoint_interval=0, workers=1)
+    try:
+        assert names(db.search_customers("یزدانی")) == ["نگار یزدانی"]
+    finally:
+        db.close()
+        db.pool.close()
@@ -0,0 +1,120 @@
+import asyncio
+import json
+
+import pytest
+
+import store
+from conftest import add_customer, add_product
+
+
+def run_server(db, scenario):
+    # Runs scenario(request) against a server on a free port. request sends
+    # one raw HTTP request and returns the status and the decoded body.
+    async def main():
+        server = store.StoreServer(store.StoreService(db), port=0)
+        port = (await server.start()).sockets[0].getsockname()[1]
+
+        async def request(method, path, body=None, headers=None):
+            if body is not None and not isinstance(body, bytes):
+                body = json.dumps(body).encode("utf-8")
+            headers = dict(headers or {})
+            if body is not None:
+                headers.setdefault("Content-Length", str(len(body)))
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            head = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+            request_head = f"{method} {path} HTTP/1.1\r\nConnection: close\r\n{head}\r\n"
+            writer.write(request_head.encode("latin-1") + (body or b""))
+            response = await reader.read()
+            writer.close()
+            if not response:
+                return None, None
+            head, _, payload = response.partition(b"\r\n\r\n")
+            return int(head.split()[1]), json.loads(payload) if payload else None
+
+        try:
+            return await scenario(request)
+        finally:
+            server.close()
+
+    return asyncio.run(main())
+
+
+def test_crud_and_invoice_routes(db):
+    async def scenario(request):
+        status, body = await request("POST", "/customers", {"name": "علی", "phone": "09120000009"})
+        assert status == 201
+        customer_id = body["customer_id"]
+        # The API takes and returns whole rials.
+        status, body = await request("POST", "/products", {"name": "چای", "price": "120000", "stock": 5})
+        assert status == 201
+        product_id = body["product_id"]
+
+        status, body = await request("GET", f"/products/{product_id}")
+        assert (status, body["price"], body["stock"]) == (200, 120000, 5)
+        status, body = await request("POST", "/invoices", {"customer_id": customer_id,
+                                                           "items": [{"product_id": product_id, "quantity": 2}]})
+        assert status == 201
+        invoice_id = body["invoice_id"]
+        status, body = await request("GET", f"/invoices/{invoice_id}")
+        assert status == 200 and body["total_amount"] == 240000
+        assert [item["quantity"] for item in body["items"]] == [2]
+
+        status, body = await request("POST", "/invoices", {"customer_id": customer_id,
+                                                           "items": [{"product_id": product_id, "quantity": 9}]})
+        assert status == 409 and body["shortages"] == [{"product_id": product_id, "requested": 9, "available": 3}]
+        assert (await request("DELETE", f"/customers/{customer_id}"))[0] == 409
+        assert (await request("DELETE", f"/invoices/{invoice_id}"))[0] == 204
+        assert (await request("GET", f"/invoices/{invoice_id}"))[0] == 404
+        status, body = await request("GET", "/reports/1")
+        assert status == 200 and body["rows"] == []
+        assert (await request("PATCH", "/customers"))[0] == 405
+        assert (await request("GET", "/nowhere"))[0] == 404
+        status, body = await request("GET", "/metrics")
+        assert status == 200 and body["routes"]
+
+    run_server(db, scenario)
+
+
+def test_list_limits_are_clamped(db):
+    for n in range(5):
+        add_customer(db, f"مشتری {n}", f"0912000000{n}")
+
+    async def scenario(request):
+        for limit, expected in (("-1", 1), ("0", 1), ("2", 2), ("100000", 5)):
+            status, body = await request("GET", f"/customers?limit={limit}")
+            assert (status, len(body)) == (200, expected)
+        assert (await request("GET", "/invoices?limit=-1"))[0] == 200
+        assert (await request("GET", "/products?limit=many"))[0] == 400
+
+    run_server(db, scenario)
+
+
+@pytest.mark.parametrize("body", [
+    [1, 2],
+    {"customer_id": 1, "items": [{"quantity": 1}]},
+    {"customer_id": 1, "items": [{"product_id": [1], "quantity": 1}]},
+    {"customer_id": 1, "items": {"product_id": 1}},
+    b"{not json",
+])
+def test_malformed_bodies_are_client_errors(db, body):
+    add_customer(db)
+    add_product(db)
+
+    async def scenario(request):
+        status, payload = await request("POST", "/invoices", body)
+        assert status == 400 and payload["error"]
+
+    run_server(db, scenario)
+
+
+@pytest.mark.parametrize("length", ["abc", "-5"])
+def test_bad_content_length_gets_a_response(db, length):
+    async def scenario(request):
+        assert await request("POST", "/customers", b"{}", {"Content-Length": length}) == \
+            (400, {"error": "invalid Content-Length"})
+
+    run_server(db, scenario)
+
+
+def test_close_before_start(db):
+    store.StoreServer(store.StoreService(db)).close()
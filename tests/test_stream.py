@@ -0,0 +1,92 @@
+import queue
+
+import pytest
+
+import store
+
+
+@pytest.fixture(scope="module")
+def daily_db(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("stream") / "store.db")
+    store.setup_database(path)
+    db = store.Database(path, checkpoint_interval=0, workers=1, report_processes=2)
+    store.generate_data(db, customers=50, products=20, lines=3000, days=200)
+    yield db
+    db.close()
+    db.pool.close()
+
+
+def stream(db, number, **kwargs):
+    # The messages stream_report sends, with the row batches joined up.
+    out = queue.Queue()
+    returned = db.stream_report(number, "", out, batch_size=40, **kwargs)
+    messages, rows = [], []
+    while not out.empty():
+        kind, value = out.get()
+        if kind in ("rows", "all"):
+            rows.extend(tuple(row) for row in value)
+        else:
+            messages.append((kind, value))
+    return messages, rows, returned
+
+
+def full_report(db, number):
+    db.report_cache.clear()
+    return [tuple(row) for row in db.run_report(number)[1]]
+
+
+def test_pages_add_up_to_the_report(daily_db):
+    db = daily_db
+    expected = full_report(db, 20)
+    assert len(expected) > 250
+    db.report_cache.clear()
+    rows, offset = [], 0
+    while True:
+        messages, page, offset = stream(db, 20, offset=offset, limit=100)
+        assert len(page) <= 100
+        rows.extend(page)
+        if messages[-1][0] == "done":
+            break
+        assert messages[-1] == ("more", offset)
+    assert rows == expected
+    assert messages[-1] == ("done", len(expected))
+
+
+def test_cached_results_are_capped_too(daily_db):
+    db = daily_db
+    expected = full_report(db, 20)
+    assert db.report_cache.stats()["entries"] == 1
+
+    messages, rows, sent = stream(db, 20, limit=100)
+    assert (rows, sent) == (expected[:100], 100)
+    assert messages[-1] == ("more", 100)
+    messages, rows, sent = stream(db, 20, offset=100, limit=100)
+    assert rows == expected[100:200]
+
+    # A result that fits the page still comes from the cache in one piece.
+    messages, rows, sent = stream(db, 20, limit=len(expected))
+    assert rows == expected and messages[-1] == ("done", len(expected))
+
+
+def test_parallel_results_are_capped(daily_db):
+    db = daily_db
+    expected = sorted(full_report(db, 20))
+    db.report_cache.clear()
+    columns, rows = db.run_parallel_report(20)
+    assert sorted(tuple(row) for row in rows) == expected
+
+    for parallel in (True, False):
+        messages, rows, sent = stream(db, 20, limit=100, parallel=parallel)
+        assert (len(rows), messages[-1]) == (100, ("more", 100))
+
+
+def test_large_results_are_not_cached(daily_db, monkeypatch):
+    db = daily_db
+    monkeypatch.setattr(db.report_cache, "max_rows", 100)
+    db.report_cache.clear()
+    db.run_report(20)
+    db.run_parallel_report(20)
+    stream(db, 20)
+    assert db.report_cache.stats()["entries"] == 0
+    db.run_report(2)
+    assert db.report_cache.stats()["entries"] == 1
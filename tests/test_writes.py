@@ -0,0 +1,137 @@
+import sqlite3
+import threading
+
+import pytest
+
+import store
+from conftest import add_customer, add_product, summaries_match
+
+
+def test_write_transaction_retries_while_locked(db, db_file, monkeypatch):
+    # A short busy timeout, so the lock outlives it and the retry loop runs.
+    monkeypatch.setattr(db.pool, "timeout", 0.02)
+    holder = sqlite3.connect(db_file, isolation_level=None, check_same_thread=False)
+    holder.execute("BEGIN IMMEDIATE")
+    release = threading.Timer(0.2, holder.execute, ("COMMIT",))
+    release.start()
+    attempts = []
+
+    def write(cursor):
+        attempts.append(1)
+        return cursor.execute("INSERT INTO customers (name) VALUES ('رضا')").lastrowid
+
+    try:
+        customer_id = db.write_transaction(write)
+    finally:
+        release.join()
+        holder.close()
+    assert customer_id
+    assert db.run_query("SELECT name FROM customers WHERE customer_id = ?", (customer_id,))[0][0] == "رضا"
+    assert len(attempts) == 1
+
+
+def test_write_transaction_retries_busy_errors_from_fn(db):
+    calls = []
+
+    def write(cursor):
+        calls.append(1)
+        cursor.execute("INSERT INTO customers (name) VALUES ('مینا')")
+        if len(calls) < 3:
+            raise sqlite3.OperationalError("database is locked")
+
+    db.write_transaction(write)
+    assert len(calls) == 3
+    # The failed attempts were rolled back.
+    assert db.run_query("SELECT COUNT(*) FROM customers WHERE name = 'مینا'")[0][0] == 1
+
+
+def test_write_transaction_gives_up(db, monkeypatch):
+    monkeypatch.setattr(store, "WRITE_RETRY_ATTEMPTS", 2)
+    calls = []
+
+    def write(cursor):
+        calls.append(1)
+        raise sqlite3.OperationalError("database is locked")
+
+    with pytest.raises(sqlite3.OperationalError):
+        db.write_transaction(write)
+    assert len(calls) == 2
+
+
+def test_write_transaction_does_not_retry_other_errors(db):
+    calls = []
+
+    def write(cursor):
+        calls.append(1)
+        cursor.execute("INSERT INTO no_such_table VALUES (1)")
+
+    with pytest.raises(sqlite3.OperationalError):
+        db.write_transaction(write)
+    assert len(calls) == 1
+
+
+def test_invoice_with_too_little_stock_changes_nothing(db):
+    service = store.StoreService(db)
+    customer_id = add_customer(db)
+    tea = add_product(db, "چای", stock=5)
+    rice = add_product(db, "برنج", stock=2)
+
+    with pytest.raises(store.StockError) as raised:
+        service.create_invoice(customer_id, {tea: 1, rice: 3})
+    assert raised.value.shortages == [(rice, 3, 2)]
+    assert db.run_query("SELECT COUNT(*) FROM invoices")[0][0] == 0
+    assert [tuple(row) for row in db.run_query("SELECT product_id, stock FROM products ORDER BY product_id")] == \
+        [(tea, 5), (rice, 2)]
+
+
+def test_invoice_validation(db):
+    service = store.StoreService(db)
+    customer_id = add_customer(db)
+    tea = add_product(db)
+    with pytest.raises(store.ValidationError):
+        service.create_invoice(customer_id, {tea: 0})
+    with pytest.raises(store.ValidationError):
+        service.create_invoice(customer_id, {})
+    with pytest.raises(store.NotFound):
+        service.create_invoice(customer_id, {tea + 100: 1})
+
+
+def test_concurrent_invoices_never_oversell(db):
+    service = store.StoreService(db)
+    customer_id = add_customer(db)
+    tea = add_product(db, stock=10)
+    start = threading.Barrier(8)
+    sold, short = [], []
+
+    def buy():
+        start.wait()
+        try:
+            service.create_invoice(customer_id, {tea: 3})
+            sold.append(1)
+        except store.StockError:
+            short.append(1)
+
+    threads = [threading.Thread(target=buy) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert (len(sold), len(short)) == (3, 5)
+    assert db.run_query("SELECT stock FROM products WHERE product_id = ?", (tea,))[0][0] == 1
+    assert db.run_query("SELECT COUNT(*) FROM invoices")[0][0] == 3
+    assert summaries_match(db)
+
+
+def test_deleting_an_invoice_returns_its_stock(db):
+    service = store.StoreService(db)
+    customer_id = add_customer(db)
+    tea = add_product(db, stock=10)
+    invoice_id = service.create_invoice(customer_id, {tea: 4})
+    assert db.run_query("SELECT stock FROM products WHERE product_id = ?", (tea,))[0][0] == 6
+
+    service.delete_invoice(invoice_id)
+    assert db.run_query("SELECT stock FROM products WHERE product_id = ?", (tea,))[0][0] == 10
+    assert summaries_match(db)
+    with pytest.raises(store.NotFound):
+        service.delete_invoice(invoice_id)